@@ -0,0 +1,92 @@
+"""
+Предобработка аудио перед транскрибацией (уменьшение загрузки)
+
+Моно, 16 kHz, речевой кодек с низким битрейтом и (опционально) вырезание
+длинных пауз - распознаванию речи больше не нужно. ffmpeg работает
+в пуле процессов, поэтому сетевые потоки не ждут CPU.
+"""
+
+import os
+import subprocess
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import config
+
+
+CODEC_EXTENSIONS = {
+    "libopus": ".ogg",
+    "libmp3lame": ".mp3",
+    "aac": ".m4a",
+    "flac": ".flac",
+}
+
+_pool = None
+_pool_lock = threading.Lock()  # Пул создают сетевые потоки конвейера одновременно
+
+
+def build_ffmpeg_command(input_path: str, output_path: str) -> list:
+    """Команда ffmpeg по настройкам PREPROCESS_* из config"""
+    command = ["ffmpeg", "-v", "error", "-y", "-i", input_path, "-vn",
+               "-ac", "1", "-ar", str(config.PREPROCESS_SAMPLE_RATE)]
+    if config.PREPROCESS_TRIM_SILENCE:
+        command += ["-af", (
+            f"silenceremove=stop_periods=-1"
+            f":stop_duration={config.PREPROCESS_SILENCE_SEC}"
+            f":stop_threshold={config.PREPROCESS_SILENCE_DB}dB"
+        )]
+    command += ["-c:a", config.PREPROCESS_CODEC, "-b:a", config.PREPROCESS_BITRATE, output_path]
+    return command
+
+
+def preprocess_audio(input_path: str) -> tuple[str, int, int]:
+    """
+    Сжатие аудио для распознавания речи (выполняется в процессе пула).
+
+    Returns:
+        Tuple (output_path, bytes_before, bytes_after)
+    """
+    ext = CODEC_EXTENSIONS.get(config.PREPROCESS_CODEC, ".ogg")
+    output_path = f"{os.path.splitext(input_path)[0]}.speech{ext}"
+
+    subprocess.run(build_ffmpeg_command(input_path, output_path), check=True)
+
+    return output_path, os.path.getsize(input_path), os.path.getsize(output_path)
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=config.PREPROCESS_WORKERS)
+        return _pool
+
+
+def preprocess_in_pool(input_path: str) -> str:
+    """
+    Предобработка в пуле процессов с логом экономии.
+
+    При ошибке (нет ffmpeg, битый файл) возвращает исходный файл.
+
+    Returns:
+        Путь к файлу для загрузки
+    """
+    try:
+        output_path, before, after = get_pool().submit(preprocess_audio, input_path).result()
+    except Exception as e:
+        print(f"[WARNING] Предобработка не удалась ({e}) - загружаю исходный файл")
+        return input_path
+
+    saved = before - after
+    percent = saved / before * 100 if before else 0
+    print(f"[PREPROCESS] {before / 1024 / 1024:.1f} MB -> {after / 1024 / 1024:.1f} MB "
+          f"(сэкономлено {saved / 1024 / 1024:.1f} MB, {percent:.0f}%)")
+    return output_path
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
@@ -0,0 +1,141 @@
+"""
+Потоковая передача аудио YouTube -> Lemonfox без временного файла
+
+Байты аудио читаются из прямой ссылки на формат (из info yt-dlp)
+диапазонами по CHUNK_SIZE и сразу уходят в multipart загрузку.
+Параллельно считается SHA-256 (для кеша транскрипций по хешу).
+"""
+
+import hashlib
+
+import requests
+
+
+# YouTube режет скорость при одном длинном запросе - читаем диапазонами (как yt-dlp)
+CHUNK_SIZE = 10 * 1024 * 1024
+
+http_session = requests.Session()
+
+
+def select_audio_format(info: dict):
+    """
+    Выбор аудио формата как в yt-dlp: 'bestaudio[ext=m4a]/bestaudio'.
+
+    Returns:
+        Словарь формата из info['formats'] или None (нет прямой http ссылки)
+    """
+    candidates = [
+        f for f in info.get('formats') or []
+        if f.get('acodec') not in (None, 'none')
+        and f.get('vcodec') in (None, 'none')
+        and f.get('url')
+        and (f.get('protocol') or 'https') in ('http', 'https')
+    ]
+    if not candidates:
+        return None
+
+    m4a = [f for f in candidates if f.get('ext') == 'm4a']
+    pool = m4a or candidates
+    return max(pool, key=lambda f: f.get('abr') or f.get('tbr') or 0)
+
+
+class RangeStreamReader:
+    """
+    Файлоподобный объект (read(n)) поверх HTTP Range запросов.
+
+    Если размер неизвестен - один потоковый GET без Range. Если диапазон
+    вернул 0 байт (сервер не отдает Range), в начале файла - переход на
+    обычный GET, в середине - IOError (иначе read() крутится бесконечно).
+    """
+
+    def __init__(self, url: str, headers: dict = None, total_size: int = None,
+                 chunk_size: int = CHUNK_SIZE, timeout: tuple = (30, 120)):
+        self.url = url
+        self.headers = dict(headers or {})
+        self.total_size = total_size
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.position = 0
+        self.response = None
+        self.iterator = None
+        self.received = 0  # Байт из текущего ответа
+        self.buffer = b""
+        self.sha256 = hashlib.sha256()
+
+    def _open_next(self) -> bool:
+        """Открыть следующий диапазон. False - данные закончились."""
+        if self.total_size is not None and self.position >= self.total_size:
+            return False
+        if self.total_size is None and self.response is not None:
+            return False
+
+        headers = dict(self.headers)
+        if self.total_size is not None:
+            end = min(self.position + self.chunk_size, self.total_size) - 1
+            headers['Range'] = f"bytes={self.position}-{end}"
+
+        if self.response is not None:
+            self.response.close()
+        self.response = http_session.get(self.url, headers=headers, stream=True, timeout=self.timeout)
+        self.response.raise_for_status()
+        self.iterator = self.response.iter_content(chunk_size=256 * 1024)
+        self.received = 0
+        return True
+
+    def _empty_range(self):
+        """Открытый диапазон не дал ни байта"""
+        if self.position == 0:
+            print("[WARN] Пустой ответ на Range запрос - читаю одним GET без Range")
+            self.total_size = None
+            self.response.close()
+            self.response = None
+            return
+        raise IOError(f"Empty response for bytes={self.position}- ({self.position}/{self.total_size} bytes read)")
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self.buffer) < size:
+            chunk = next(self.iterator, None) if self.iterator else None
+            if chunk is None:
+                if self.total_size is not None and self.response is not None and self.received == 0:
+                    self._empty_range()
+                if not self._open_next():
+                    break
+                continue
+            self.buffer += chunk
+            self.received += len(chunk)
+            self.position += len(chunk)
+
+        if size < 0:
+            data, self.buffer = self.buffer, b""
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+
+        self.sha256.update(data)
+        return data
+
+    @property
+    def hexdigest(self) -> str:
+        return self.sha256.hexdigest()
+
+    def close(self):
+        if self.response is not None:
+            self.response.close()
+
+
+def open_audio_stream(info: dict):
+    """
+    Поток аудио для info видео.
+
+    Returns:
+        Tuple (reader, audio_format) или (None, None), если прямой ссылки нет
+    """
+    audio_format = select_audio_format(info)
+    if audio_format is None:
+        return None, None
+
+    reader = RangeStreamReader(
+        audio_format['url'],
+        headers=audio_format.get('http_headers'),
+        total_size=audio_format.get('filesize'),
+    )
+    return reader, audio_format
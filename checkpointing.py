@@ -0,0 +1,259 @@
+"""
+Чекпоинты LoRA во время обучения: в фоне, только адаптер, с продолжением
+
+Раньше модель сохранялась один раз - в конце train.py / train_runpod.py,
+поэтому вытеснение spot-инстанса RunPod или OOM на 90-м шаге теряли весь прогон.
+
+- AdapterCheckpointer - TrainerCallback: каждые CHECKPOINT_STEPS шагов
+  снимает состояние (LoRA веса, optimizer, scheduler, trainer_state, RNG)
+  в память CPU и пишет его на диск в фоновом потоке - шаг обучения ждет
+  только копирование GPU -> CPU (мегабайты, а не гигабайты 7B модели)
+- Формат - обычный чекпоинт HF (adapter_model.safetensors, optimizer.pt,
+  scheduler.pt, trainer_state.json, rng_state.pth), поэтому продолжение -
+  штатное trainer.train(resume_from_checkpoint=...)
+- Запись атомарная: checkpoint-N.tmp -> fsync -> rename в checkpoint-N;
+  недописанный чекпоинт никогда не выбирается для продолжения
+- Хранятся последние CHECKPOINT_KEEP чекпоинтов
+- SIGTERM (вытеснение spot): синхронный чекпоинт после текущего шага и
+  остановка обучения (preempted = True - финальную модель не сохранять)
+- В конце обучения - финальный чекпоинт; по нему latest() понимает, что
+  прогон завершен, и следующий запуск начинает заново. Чекпоинты прошлого
+  прогона при этом не удаляются, а переносятся в output_dir/previous-<время>/
+
+Использование (см. train.py):
+    checkpoints = AdapterCheckpointer()
+    trainer = build_trainer(..., checkpointer=checkpoints)
+    trainer.train(resume_from_checkpoint=checkpoints.latest(trainer.args.output_dir))
+"""
+
+import os
+import re
+import json
+import time
+import copy
+import random
+import shutil
+import signal
+import dataclasses
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from safetensors.torch import save_file
+from peft.utils import get_peft_model_state_dict
+from transformers import TrainerCallback
+
+import config
+
+
+CHECKPOINT_PREFIX = "checkpoint"
+ADAPTER_WEIGHTS = "adapter_model.safetensors"
+OPTIMIZER_FILE = "optimizer.pt"
+SCHEDULER_FILE = "scheduler.pt"
+STATE_FILE = "trainer_state.json"
+RNG_FILE = "rng_state.pth"
+
+_CHECKPOINT_RE = re.compile(rf"^{CHECKPOINT_PREFIX}-(\d+)$")
+
+
+def _to_cpu(obj):
+    """Копия вложенных dict/list/tensor в память CPU (живые тензоры optimizer не трогаются)"""
+    if torch.is_tensor(obj):
+        return obj.detach().to("cpu", copy=True).contiguous()
+    if isinstance(obj, dict):
+        return {k: _to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_cpu(v) for v in obj)
+    return copy.deepcopy(obj)
+
+
+def _rng_state() -> dict:
+    # Как Trainer._save_rng_state (без distributed); состояние numpy - списком,
+    # чтобы файл читался torch.load(weights_only=True) (torch >= 2.6)
+    name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    state = {
+        "python": random.getstate(),
+        "numpy": (name, keys.tolist(), pos, has_gauss, cached_gaussian),
+        "cpu": torch.random.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.random.get_rng_state()
+    return state
+
+
+def _fsync_dir_files(path: str):
+    for name in os.listdir(path):
+        with open(os.path.join(path, name), "r+b") as f:
+            os.fsync(f.fileno())
+
+
+def list_checkpoints(output_dir: str) -> list:
+    """Готовые чекпоинты [(step, path)] по возрастанию шага"""
+    if not os.path.isdir(output_dir):
+        return []
+    found = []
+    for name in os.listdir(output_dir):
+        match = _CHECKPOINT_RE.match(name)
+        path = os.path.join(output_dir, name)
+        if match and os.path.isdir(path):
+            found.append((int(match.group(1)), path))
+    return sorted(found)
+
+
+def latest_checkpoint(output_dir: str) -> str:
+    """
+    Последний чекпоинт незавершенного прогона или None.
+
+    Чекпоинт с global_step >= max_steps - финальный: прогон завершен,
+    продолжать нечего.
+    """
+    checkpoints = list_checkpoints(output_dir)
+    if not checkpoints:
+        return None
+    step, path = checkpoints[-1]
+    try:
+        with open(os.path.join(path, STATE_FILE), encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get("max_steps") and step >= state["max_steps"]:
+        return None
+    return path
+
+
+class AdapterCheckpointer(TrainerCallback):
+    """Периодические чекпоинты адаптера в фоновом потоке + продолжение после вытеснения"""
+
+    def __init__(self, every: int = None, keep: int = None, resume: bool = None):
+        self.every = every or config.CHECKPOINT_STEPS
+        self.keep = keep or config.CHECKPOINT_KEEP
+        self.resume = config.CHECKPOINT_RESUME if resume is None else resume
+        self.output_dir = None
+        self.preempted = False
+        self._stop_requested = False
+        self._previous_handler = None
+        self._last_saved = None
+        self._pool = ThreadPoolExecutor(max_workers=1)  # Один писатель: чекпоинты пишутся по порядку
+        self._pending = None
+
+    def latest(self, output_dir: str) -> str:
+        """Чекпоинт для trainer.train(resume_from_checkpoint=...)"""
+        if not self.resume:
+            return None
+        path = latest_checkpoint(output_dir)
+        if path:
+            print(f"[CHECKPOINT] Продолжаю с {path}")
+        return path
+
+    # ===== Снимок и запись =====
+
+    def _snapshot(self, state, model, optimizer, lr_scheduler) -> dict:
+        adapter_name = getattr(model, "active_adapter", "default")
+        peft_config = copy.deepcopy(model.peft_config[adapter_name])
+        peft_config.inference_mode = True  # Как PeftModel.save_pretrained
+        return {
+            "step": state.global_step,
+            "adapter": _to_cpu(get_peft_model_state_dict(model, adapter_name=adapter_name)),
+            "peft_config": peft_config,
+            "optimizer": _to_cpu(optimizer.state_dict()),
+            "scheduler": _to_cpu(lr_scheduler.state_dict()),
+            "state": json.dumps(dataclasses.asdict(state), indent=2, sort_keys=True) + "\n",
+            "rng": _rng_state(),
+        }
+
+    def _write(self, snapshot: dict):
+        start = time.perf_counter()
+        final_path = os.path.join(self.output_dir, f"{CHECKPOINT_PREFIX}-{snapshot['step']}")
+        tmp_path = f"{final_path}.tmp"
+        try:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            os.makedirs(tmp_path)
+            save_file(snapshot["adapter"], os.path.join(tmp_path, ADAPTER_WEIGHTS), metadata={"format": "pt"})
+            snapshot["peft_config"].save_pretrained(tmp_path)
+            torch.save(snapshot["optimizer"], os.path.join(tmp_path, OPTIMIZER_FILE))
+            torch.save(snapshot["scheduler"], os.path.join(tmp_path, SCHEDULER_FILE))
+            torch.save(snapshot["rng"], os.path.join(tmp_path, RNG_FILE))
+            with open(os.path.join(tmp_path, STATE_FILE), "w", encoding="utf-8") as f:
+                f.write(snapshot["state"])
+            _fsync_dir_files(tmp_path)
+
+            if os.path.isdir(final_path):  # Повторный шаг после продолжения
+                shutil.rmtree(final_path)
+            os.replace(tmp_path, final_path)
+            self._rotate()
+        except Exception as e:
+            # Обучение продолжается; предыдущие чекпоинты остаются целыми
+            print(f"[CHECKPOINT] Ошибка записи {final_path}: {e}")
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return
+        size_mb = sum(os.path.getsize(os.path.join(final_path, name)) for name in os.listdir(final_path)) / 1024 ** 2
+        print(f"[CHECKPOINT] {final_path} ({size_mb:.1f}MB, запись {time.perf_counter() - start:.1f}s)")
+
+    def _rotate(self):
+        for _, path in list_checkpoints(self.output_dir)[:-self.keep]:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def wait(self):
+        """Дождаться фоновой записи"""
+        if self._pending is not None:
+            self._pending.result()
+            self._pending = None
+
+    def save(self, state, model, optimizer, lr_scheduler, background: bool = True):
+        # Не больше одного снимка в памяти: ждем предыдущую запись
+        self.wait()
+        snapshot = self._snapshot(state, model, optimizer, lr_scheduler)
+        self._last_saved = state.global_step
+        if background:
+            self._pending = self._pool.submit(self._write, snapshot)
+        else:
+            self._write(snapshot)
+
+    # ===== SIGTERM =====
+
+    def _on_sigterm(self, signum, frame):
+        print("\n[CHECKPOINT] SIGTERM: сохраню чекпоинт после текущего шага и остановлюсь")
+        self._stop_requested = True
+
+    # ===== TrainerCallback =====
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        self.output_dir = args.output_dir
+        if not state.is_world_process_zero:
+            return
+        os.makedirs(self.output_dir, exist_ok=True)
+        for name in os.listdir(self.output_dir):
+            if name.startswith(f"{CHECKPOINT_PREFIX}-") and name.endswith(".tmp"):
+                shutil.rmtree(os.path.join(self.output_dir, name), ignore_errors=True)
+        previous = list_checkpoints(self.output_dir) if state.global_step == 0 else []
+        if previous:
+            # Новый прогон: чекпоинты старого иначе перемешаются по номерам шагов. Не удаляем -
+            # это может быть незавершенный прогон (CHECKPOINT_RESUME=False, увеличенный max_steps)
+            archive = os.path.join(self.output_dir, f"previous-{time.strftime('%Y%m%d-%H%M%S')}")
+            os.makedirs(archive, exist_ok=True)
+            for _, path in previous:
+                os.replace(path, os.path.join(archive, os.path.basename(path)))
+            print(f"[CHECKPOINT] Новый прогон: {len(previous)} чекпоинтов прошлого перенесены в {archive}")
+        try:
+            self._previous_handler = signal.signal(signal.SIGTERM, self._on_sigterm)
+        except ValueError:  # Не главный поток
+            self._previous_handler = None
+
+    def on_step_end(self, args, state, control, model=None, optimizer=None, lr_scheduler=None, **kwargs):
+        if not state.is_world_process_zero:
+            return
+        if self._stop_requested:
+            self.save(state, model, optimizer, lr_scheduler, background=False)
+            self.preempted = True
+            control.should_training_stop = True
+        elif state.global_step % self.every == 0:
+            self.save(state, model, optimizer, lr_scheduler)
+
+    def on_train_end(self, args, state, control, model=None, optimizer=None, lr_scheduler=None, **kwargs):
+        if state.is_world_process_zero and self._last_saved != state.global_step:
+            # Финальный чекпоинт: latest() по нему видит, что прогон завершен
+            self.save(state, model, optimizer, lr_scheduler, background=False)
+        self.wait()
+        if self._previous_handler is not None:
+            signal.signal(signal.SIGTERM, self._previous_handler)
+            self._previous_handler = None
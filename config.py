@@ -1,10 +1,83 @@
 # ===== API KEYS =====
 LEMONFOX_API_KEY = "WSvTyZwBLsUvIDf4BbFvyyzYPVNWZ7PN"
 
+# ===== LEMONFOX CLIENT =====
+LEMONFOX_BASE_URL = "https://api.lemonfox.ai"  # Для локальной проверки: "http://127.0.0.1:8765" (fake_lemonfox_server.py)
+LEMONFOX_POOL_SIZE = 8  # Keep-alive соединений в пуле
+LEMONFOX_ASYNC_CONCURRENCY = 4  # Одновременных загрузок в AsyncLemonfoxClient
+LEMONFOX_RATE_PER_SEC = 2.0  # Общий лимит запросов к API (token bucket на все воркеры)
+LEMONFOX_BREAKER_THRESHOLD = 5  # Подряд неудач до размыкания circuit breaker
+LEMONFOX_BREAKER_RESET = 60  # Секунд до пробного запроса после размыкания
+
 # ===== DIRECTORIES =====
 TEMP_DIR = "temp_audio"  # Временная папка для аудиодорожек
 OUTPUT_DIR = "input_data"  # Папка для сохранения транскрипций
 
 # ===== MODEL SETTINGS =====
 MODEL_PATH = "qwen2.5-7b-instruct"  # Папка со скачанной моделью
-FINETUNED_MODEL_PATH = "fine_tuned_model"  # Папка с дообученной моделью (LoRA)
\ No newline at end of file
+FINETUNED_MODEL_PATH = "fine_tuned_model"  # Папка с дообученной моделью (LoRA)
+MAX_SEQ_LENGTH = 16384  # Контекст обучения; при AUTO_SEQ_LENGTH - верхний предел (VRAM)
+AUTO_SEQ_LENGTH = True  # Брать max_seq_length из corpus_profile.json (profile_corpus.py), если он есть
+TARGET_COVERAGE = 0.85  # Доля историй, которые должны влезть целиком
+PACKING = False  # Упаковка примеров в последовательности MAX_SEQ_LENGTH (границы по position_ids; только flash_attention_2, иначе build_trainer падает)
+
+# ===== CHECKPOINTS (checkpointing.py) =====
+CHECKPOINT_STEPS = 10  # LoRA + optimizer/scheduler каждые N шагов (запись в фоне)
+CHECKPOINT_KEEP = 3  # Хранить последние N чекпоинтов
+CHECKPOINT_RESUME = True  # При перезапуске продолжать с последнего чекпоинта (вытеснение spot, OOM)
+
+# ===== DATASET (prepare_dataset.py --mode windows) =====
+WINDOW_OVERLAP_TOKENS = 256  # Перекрытие соседних окон
+WINDOW_CONTEXT_TOKENS = 512  # Предшествующий текст в промпте окна (без loss)
+
+# ===== DEDUP (dedup.py, MinHash + LSH) =====
+DEDUP_NUM_PERM = 128  # Длина сигнатуры MinHash
+DEDUP_BANDS = 16  # Полос LSH (порог срабатывания ~ (1/16)^(1/8) = 0.71)
+DEDUP_SHINGLE_WORDS = 5  # Шингл - k подряд идущих слов
+DEDUP_FILE_THRESHOLD = 0.8  # Jaccard для дубликатов транскрипций
+DEDUP_PARAGRAPH_THRESHOLD = 0.8  # Jaccard для дубликатов абзацев
+DEDUP_PARAGRAPH_WORDS = 120  # Размер "абзаца" (транскрипции без переносов строк)
+DEDUP_MIN_PARAGRAPH_WORDS = 40  # Короче - не сравнивается (ненадежная сигнатура)
+# ===== TRANSCRIPT CACHE =====
+CACHE_DIR = "transcript_cache"  # Кеш транскрипций/аудио по ID видео YouTube
+AUDIO_CACHE_MAX_MB = 2048  # Лимит кеша аудио (старые файлы вытесняются)
+
+# ===== LONG AUDIO =====
+LONG_AUDIO_THRESHOLD_SEC = 2700  # Длиннее - режем на сегменты (нужен ffmpeg)
+LONG_AUDIO_SEGMENT_SEC = 600  # Длина сегмента
+LONG_AUDIO_OVERLAP_SEC = 15  # Перекрытие соседних сегментов
+LONG_AUDIO_WORKERS = 4  # Сегментов транскрибируется одновременно
+
+# ===== AUDIO PREPROCESSING (--preprocess) =====
+PREPROCESS_SAMPLE_RATE = 16000  # Гц, для распознавания речи достаточно
+PREPROCESS_CODEC = "libopus"  # Речевой кодек ffmpeg
+PREPROCESS_BITRATE = "24k"
+PREPROCESS_TRIM_SILENCE = True  # Вырезать длинные паузы
+PREPROCESS_SILENCE_SEC = 2.0  # Пауза длиннее - вырезается
+PREPROCESS_SILENCE_DB = -45  # Порог тишины
+PREPROCESS_WORKERS = 2  # Процессов ffmpeg одновременно
+
+# ===== GENERATION (generate.py) =====
+GENERATE_MAX_NEW_TOKENS = 12000  # ~35-40K символов (безопасно для 12GB)
+GENERATE_OUTPUT = "generated_story.txt"  # Промпт + история, пишется по мере генерации
+GENERATE_FSYNC_SECONDS = 5  # Как часто сбрасывать файл на диск (fsync)
+
+# ===== LOOP DETECTOR (loop_detector.py) =====
+LOOP_NGRAM = 8  # Повтор - n-грамма из N токенов, уже встречавшаяся
+LOOP_LOOKBACK = 1024  # ...не дальше N токенов назад
+LOOP_WINDOW = 200  # Доля повторов считается по последним N токенам
+LOOP_STOP_RATIO = 0.6  # Доля повторов в окне -> остановка генерации
+LOOP_PENALTY = True  # Штрафовать продолжение петли до остановки
+LOOP_STEER_RATIO = 0.2  # С этой доли повторов включается штраф
+LOOP_MAX_PENALTY = 1.3  # Штраф у порога остановки (как repetition_penalty HF)
+
+# ===== INFERENCE SERVER (inference_server.py) =====
+INFERENCE_HOST = "127.0.0.1"
+INFERENCE_PORT = 8766
+INFERENCE_MAX_BATCH = 4  # Запросов в одном generate (KV cache 16K токенов 7B ~1GB на запрос)
+INFERENCE_BATCH_WAIT_MS = 50  # Сколько ждать попутные запросы после прихода первого
+INFERENCE_MAX_NEW_TOKENS = GENERATE_MAX_NEW_TOKENS  # Верхний предел max_new_tokens запроса
+
+# ===== METRICS =====
+METRICS_DIR = "metrics"  # События JSONL + снимок Prometheus (transcriber.prom)
+GPU_COST_PER_HOUR = 0.35  # $/час GPU для оценки стоимости обучения (RTX 3090 на RunPod)
@@ -0,0 +1,171 @@
+"""
+Шаблон промпта и кеш токенизированного датасета для обучения
+
+- build_prompt / formatting_func - общий шаблон для train.py и train_runpod.py
+- load_tokenized: шаблон и токенизатор Qwen применяются один раз, результат
+  (input_ids, attention_mask, labels) сохраняется в
+  warhammer_dataset_tokenized/<TEMPLATE_VERSION>-<хеш токенизатора>-<max_seq_length>/
+- Кеш пересобирается, если изменился warhammer_dataset (хеш Arrow файлов)
+- labels - маска loss: -100 на токенах промпта, loss только по ответу
+"""
+
+import os
+import json
+import hashlib
+
+
+# Меняется при любом изменении шаблона/токенизации - старый кеш не используется
+TEMPLATE_VERSION = "alpaca-v1"
+
+SOURCE_DATASET_DIR = "warhammer_dataset"
+TOKENIZED_DIR = "warhammer_dataset_tokenized"
+META_FILE = "pretokenize.json"
+
+IGNORE_INDEX = -100
+
+PROMPT_TEMPLATE = """### Instruction:
+{instruction}
+
+### Input:
+{input}
+
+### Response:
+"""
+
+
+def build_prompt(instruction: str, input_text: str) -> str:
+    return PROMPT_TEMPLATE.format(instruction=instruction, input=input_text)
+
+
+def formatting_func(examples):
+    # Unsloth требует список строк
+    return [
+        build_prompt(instruction, input_text) + output
+        for instruction, input_text, output in zip(examples['instruction'], examples['input'], examples['output'])
+    ]
+
+
+def tokenizer_hash(tokenizer) -> str:
+    """Хеш словаря, merges и спецтокенов токенизатора"""
+    h = hashlib.sha256()
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        h.update(backend.to_str().encode("utf-8"))
+    else:
+        h.update(json.dumps(sorted(tokenizer.get_vocab().items())).encode("utf-8"))
+    h.update(json.dumps(tokenizer.special_tokens_map, sort_keys=True, default=str).encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def source_fingerprint(source_dir: str = SOURCE_DATASET_DIR) -> str:
+    """Хеш содержимого Arrow файлов сохраненного датасета"""
+    h = hashlib.sha256()
+    for name in sorted(os.listdir(source_dir)):
+        if not name.endswith(".arrow"):
+            continue
+        h.update(name.encode("utf-8"))
+        with open(os.path.join(source_dir, name), "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(block)
+    return h.hexdigest()[:16]
+
+
+def tokenize_batch(examples, tokenizer, max_seq_length: int) -> dict:
+    """Batched map: промпт + ответ + EOS, обрезка до max_seq_length"""
+    prompts = [build_prompt(i, x) for i, x in zip(examples['instruction'], examples['input'])]
+    prompt_ids = tokenizer(prompts, add_special_tokens=False)["input_ids"]
+    response_ids = tokenizer(examples['output'], add_special_tokens=False)["input_ids"]
+
+    batch = {"input_ids": [], "attention_mask": [], "labels": []}
+    for prompt, response in zip(prompt_ids, response_ids):
+        response = response + [tokenizer.eos_token_id]
+        ids = (prompt + response)[:max_seq_length]
+        batch["input_ids"].append(ids)
+        batch["attention_mask"].append([1] * len(ids))
+        batch["labels"].append(([IGNORE_INDEX] * len(prompt) + response)[:max_seq_length])
+    return batch
+
+
+def tokenized_path(tokenizer, max_seq_length: int) -> str:
+    return os.path.join(TOKENIZED_DIR, f"{TEMPLATE_VERSION}-{tokenizer_hash(tokenizer)}-{max_seq_length}")
+
+
+def load_tokenized(tokenizer, max_seq_length: int, source_dir: str = SOURCE_DATASET_DIR,
+                   num_proc: int = None):
+    """
+    Токенизированный датасет из кеша (или токенизация и сохранение в кеш).
+
+    Args:
+        tokenizer: Токенизатор модели
+        max_seq_length: Длина обрезки
+        source_dir: Датасет от prepare_dataset.py
+        num_proc: Процессов для map (None на Windows)
+
+    Returns:
+        Dataset с колонками input_ids, attention_mask, labels
+    """
+    from datasets import load_from_disk
+
+    path = tokenized_path(tokenizer, max_seq_length)
+    meta_path = os.path.join(path, META_FILE)
+    fingerprint = source_fingerprint(source_dir)
+
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        meta = {}
+
+    if meta.get("source_fingerprint") == fingerprint:
+        print(f"[CACHE] Токенизированный датасет: {path}")
+        return load_from_disk(path)
+
+    print(f"[TOKENIZE] Токенизация {source_dir} -> {path}")
+    source = load_from_disk(source_dir)
+    tokenized = source.map(
+        tokenize_batch,
+        batched=True,
+        fn_kwargs={"tokenizer": tokenizer, "max_seq_length": max_seq_length},
+        remove_columns=source.column_names,
+        num_proc=num_proc,
+        desc="Tokenizing",
+    )
+    tokenized.save_to_disk(path)
+
+    lengths = [len(ids) for ids in tokenized["input_ids"]]
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "template_version": TEMPLATE_VERSION,
+            "tokenizer_hash": tokenizer_hash(tokenizer),
+            "max_seq_length": max_seq_length,
+            "source_fingerprint": fingerprint,
+            "examples": len(lengths),
+            "tokens": sum(lengths),
+            "truncated": sum(1 for n in lengths if n >= max_seq_length),
+        }, f, indent=1)
+
+    return load_from_disk(path)
+
+
+class PadCollator:
+    """Паддинг батча токенизированных примеров (labels -> -100 на паддинге)"""
+
+    def __init__(self, tokenizer, pad_to_multiple_of: int = 8):
+        self.pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def __call__(self, features: list) -> dict:
+        import torch
+
+        length = max(len(f["input_ids"]) for f in features)
+        if self.pad_to_multiple_of:
+            length = -(-length // self.pad_to_multiple_of) * self.pad_to_multiple_of
+
+        pad_values = {"input_ids": self.pad_token_id, "attention_mask": 0, "labels": IGNORE_INDEX}
+        batch = {}
+        for key, pad_value in pad_values.items():
+            batch[key] = torch.tensor(
+                [list(f[key]) + [pad_value] * (length - len(f[key])) for f in features],
+                dtype=torch.long,
+            )
+        return batch
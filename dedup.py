@@ -0,0 +1,360 @@
+"""
+Поиск почти-дубликатов в транскрипциях (MinHash + LSH) перед prepare_dataset.py
+
+- Уровень файлов: почти одинаковые транскрипции (перезаливы, компиляции) -
+  в кластере остается самая длинная, остальные исключаются
+- Уровень абзацев: повторяющиеся куски текста между файлами и внутри файла -
+  остается первое вхождение, повторы вырезаются
+- Транскрипции без переносов строк, поэтому "абзац" - подряд идущие
+  предложения примерно на DEDUP_PARAGRAPH_WORDS слов
+- Сигнатуры считаются в пуле процессов и кешируются по sha256 файла
+  (dataset_cache/minhash/) - пересчитываются только новые файлы
+- LSH: полосы сигнатур группируются через np.unique, в Python-цикл идут
+  только корзины из 2+ членов; внутри корзины сверяются все пары,
+  кластеры - union-find
+
+Результат - dataset_cache/dedup.json, его применяет prepare_dataset.py.
+
+Использование:
+    python dedup.py
+    python prepare_dataset.py
+"""
+
+import os
+import re
+import json
+import zlib
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import config
+
+
+SIGNATURES_DIR = os.path.join("dataset_cache", "minhash")
+REPORT_PATH = os.path.join("dataset_cache", "dedup.json")
+
+MINHASH_VERSION = "v2"
+MERSENNE = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint32(0xFFFFFFFF)
+
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+WORD = re.compile(r"\w+")
+
+
+def params_key() -> str:
+    return (f"{MINHASH_VERSION}-p{config.DEDUP_NUM_PERM}-k{config.DEDUP_SHINGLE_WORDS}"
+            f"-w{config.DEDUP_PARAGRAPH_WORDS}")
+
+
+def split_paragraphs(text: str, words: int) -> list:
+    """Границы абзацев (start, end) - предложения, набранные до words слов"""
+    spans = []
+    position = 0
+    start = 0
+    count = 0
+    for match in SENTENCE_END.finditer(text):
+        count += len(WORD.findall(text[position:match.start()]))
+        position = match.end()
+        if count >= words:
+            spans.append((start, match.start()))
+            start = match.end()
+            count = 0
+    if start < len(text):
+        spans.append((start, len(text)))
+    return spans
+
+
+def shingles(text: str, k: int) -> np.ndarray:
+    """crc32 от k-грамм слов (стабилен между процессами, в отличие от hash())"""
+    words = WORD.findall(text.lower())
+    if len(words) < k:
+        grams = [" ".join(words)] if words else []
+    else:
+        grams = [" ".join(words[i:i + k]) for i in range(len(words) - k + 1)]
+    return np.unique(np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams)))
+
+
+def permutations(num_perm: int, seed: int = 3407) -> tuple:
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 32, num_perm, dtype=np.uint64)
+    b = rng.integers(0, 1 << 32, num_perm, dtype=np.uint64)
+    return a, b
+
+
+def minhash(hashes: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Сигнатура: минимум (a * x + b) mod (2^61 - 1) по шинглам для каждой перестановки"""
+    if len(hashes) == 0:
+        return np.full(len(a), MAX_HASH, dtype=np.uint32)
+    # x, a < 2^32: произведение < 2^64, после mod < 2^61 - прибавление b не переполняет uint64
+    values = ((hashes[None, :] * a[:, None]) % MERSENNE + b[:, None]) % MERSENNE
+    return (values.min(axis=1) & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+
+
+def read_story(path: str) -> tuple[str, str]:
+    """(sha256, текст) - текст как в prepare_dataset.py (strip)"""
+    with open(path, "rb") as f:
+        raw = f.read()
+    return hashlib.sha256(raw).hexdigest(), raw.decode("utf-8").strip()
+
+
+def signature_path(sha: str) -> str:
+    return os.path.join(SIGNATURES_DIR, f"{sha}.{params_key()}.npz")
+
+
+def compute_signatures(path: str) -> str:
+    """
+    Сигнатуры файла и его абзацев (выполняется в процессе пула).
+
+    Returns:
+        sha256 файла (сигнатуры в signature_path(sha))
+    """
+    sha, text = read_story(path)
+    a, b = permutations(config.DEDUP_NUM_PERM)
+    k = config.DEDUP_SHINGLE_WORDS
+
+    spans = split_paragraphs(text, config.DEDUP_PARAGRAPH_WORDS)
+    paragraph_sigs = [minhash(shingles(text[s:e], k), a, b) for s, e in spans]
+
+    out = signature_path(sha)
+    tmp = f"{out}.tmp.npz"
+    np.savez(
+        tmp,
+        story=minhash(shingles(text, k), a, b),
+        spans=np.asarray(spans, dtype=np.int64).reshape(-1, 2),
+        paragraphs=np.asarray(paragraph_sigs, dtype=np.uint32).reshape(-1, config.DEDUP_NUM_PERM),
+        words=np.asarray([len(WORD.findall(text[s:e])) for s, e in spans], dtype=np.int64),
+    )
+    os.replace(tmp, out)
+    return sha
+
+
+class UnionFind:
+    def __init__(self, size: int):
+        self.parent = np.arange(size)
+
+    def find(self, x: int) -> int:
+        root = x
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[x] != root:
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, x: int, y: int):
+        rx, ry = self.find(x), self.find(y)
+        if rx != ry:
+            self.parent[max(rx, ry)] = min(rx, ry)
+
+
+def lsh_clusters(signatures: np.ndarray, bands: int, threshold: float) -> UnionFind:
+    """
+    Кластеры почти-дубликатов по LSH.
+
+    Args:
+        signatures: (n, num_perm) uint32
+        bands: Число полос (rows = num_perm / bands)
+        threshold: Минимальная оценка Jaccard для объединения
+
+    Returns:
+        UnionFind по индексам строк
+    """
+    n, num_perm = signatures.shape
+    rows = num_perm // bands
+    clusters = UnionFind(n)
+    if n < 2:
+        return clusters
+
+    for band in range(bands):
+        block = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+        keys = block.view(np.dtype((np.void, block.itemsize * rows))).ravel()
+        _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        inverse = inverse.ravel()
+        shared = counts[inverse] >= 2
+        if not shared.any():
+            continue
+        # Только строки из корзин с 2+ членами, сгруппированные по корзине
+        members = np.nonzero(shared)[0]
+        members = members[np.argsort(inverse[members], kind="stable")]
+        for group in np.split(members, np.cumsum(counts[counts >= 2])[:-1]):
+            # Все пары: B и C могут пройти порог друг с другом, но не с первым членом корзины
+            for i in range(len(group) - 1):
+                similarity = (signatures[group[i + 1:]] == signatures[group[i]]).mean(axis=1)
+                for other in group[i + 1:][similarity >= threshold]:
+                    clusters.union(int(group[i]), int(other))
+    return clusters
+
+
+def find_duplicates(txt_folder: str, workers: int = None) -> dict:
+    """
+    Поиск дубликатов файлов и абзацев.
+
+    Returns:
+        Отчет: drop_files, drop_spans {имя: [[start, end], ...]}, sha256 файлов, статистика
+    """
+    os.makedirs(SIGNATURES_DIR, exist_ok=True)
+    names = sorted(f for f in os.listdir(txt_folder) if f.endswith(".txt"))
+    paths = [os.path.join(txt_folder, name) for name in names]
+
+    shas = {}
+    missing = []
+    for name, path in zip(names, paths):
+        with open(path, "rb") as f:
+            sha = hashlib.sha256(f.read()).hexdigest()
+        shas[name] = sha
+        if not os.path.exists(signature_path(sha)):
+            missing.append(path)
+
+    print(f"Files: {len(names)} | cached signatures: {len(names) - len(missing)} | to hash: {len(missing)}")
+    if missing:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(compute_signatures, missing, chunksize=4))
+
+    loaded = {name: np.load(signature_path(shas[name])) for name in names}
+    sizes = {name: os.path.getsize(path) for name, path in zip(names, paths)}
+
+    # 1. Файлы: в кластере остается самая длинная транскрипция
+    file_sigs = np.stack([loaded[name]["story"] for name in names]) if names \
+        else np.zeros((0, config.DEDUP_NUM_PERM), dtype=np.uint32)
+    clusters = lsh_clusters(file_sigs, config.DEDUP_BANDS, config.DEDUP_FILE_THRESHOLD)
+    groups = {}
+    for index in range(len(names)):
+        groups.setdefault(clusters.find(index), []).append(index)
+
+    drop_files = []
+    file_clusters = []
+    for members in groups.values():
+        if len(members) < 2:
+            continue
+        keep = max(members, key=lambda i: (sizes[names[i]], -i))
+        file_clusters.append({"keep": names[keep], "drop": [names[i] for i in members if i != keep]})
+        drop_files += [names[i] for i in members if i != keep]
+    dropped = set(drop_files)
+
+    # 2. Абзацы оставшихся файлов: первое вхождение (порядок файлов, позиция) остается
+    owners = []
+    paragraph_sigs = []
+    for name in names:
+        if name in dropped:
+            continue
+        data = loaded[name]
+        for index, (span, words) in enumerate(zip(data["spans"], data["words"])):
+            if words >= config.DEDUP_MIN_PARAGRAPH_WORDS:
+                owners.append((name, int(span[0]), int(span[1])))
+                paragraph_sigs.append(data["paragraphs"][index])
+
+    drop_spans = {}
+    removed_chars = 0
+    if paragraph_sigs:
+        clusters = lsh_clusters(np.stack(paragraph_sigs), config.DEDUP_BANDS, config.DEDUP_PARAGRAPH_THRESHOLD)
+        seen = set()
+        for index, (name, start, end) in enumerate(owners):
+            root = clusters.find(index)
+            if root in seen:
+                drop_spans.setdefault(name, []).append([start, end])
+                removed_chars += end - start
+            seen.add(root)
+
+    total_chars = sum(sizes.values())
+    return {
+        "params": params_key(),
+        "drop_files": drop_files,
+        "drop_spans": drop_spans,
+        "file_clusters": file_clusters,
+        # Смещения drop_spans верны только для этой версии файла
+        "sha256": {name: shas[name] for name in sorted(dropped | set(drop_spans))},
+        "stats": {
+            "files": len(names),
+            "files_dropped": len(drop_files),
+            "paragraphs": len(owners),
+            "paragraphs_dropped": sum(len(spans) for spans in drop_spans.values()),
+            "chars_dropped": removed_chars + sum(sizes[name] for name in drop_files),
+            "chars_total": total_chars,
+        },
+    }
+
+
+def load_decisions(path: str = REPORT_PATH) -> dict:
+    """
+    Решения dedup из отчета (пусто, если dedup.py не запускался).
+
+    Returns:
+        {имя файла: {"sha256": sha файла при поиске, "action": "drop" или [[start, end], ...]}}
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    shas = report.get("sha256")
+    if shas is None:
+        print(f"[WARN] {path} без sha256 файлов (старый отчет) - dedup не применяется, перезапустите dedup.py")
+        return {}
+    actions = {name: "drop" for name in report.get("drop_files", [])}
+    actions.update(report.get("drop_spans", {}))
+    return {name: {"sha256": shas.get(name), "action": action} for name, action in actions.items()}
+
+
+def decision_tag(decision) -> str:
+    """Короткий хеш решения для ключа шарда (пусто - без изменений)"""
+    if not decision:
+        return ""
+    return hashlib.sha256(json.dumps(decision, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+def apply_decision(text: str, decision, sha: str, name: str = ""):
+    """
+    Текст без повторяющихся абзацев; None - файл исключен.
+
+    Args:
+        text: Текст файла (strip, как в read_story)
+        decision: Решение из load_decisions или None
+        sha: sha256 читаемого файла - решение для другой версии файла не применяется
+        name: Имя файла для предупреждения
+    """
+    if not decision:
+        return text
+    if decision["sha256"] != sha:
+        print(f"[WARN] {name or 'файл'} изменился после dedup.py - решение dedup пропущено, перезапустите dedup.py")
+        return text
+    if decision["action"] == "drop":
+        return None
+    pieces = []
+    position = 0
+    for start, end in sorted(decision["action"]):
+        pieces.append(text[position:start])
+        position = max(position, end)
+    pieces.append(text[position:])
+    # Пробелы чистятся только на стыках вырезанных абзацев, внутри текста не трогаются
+    return " ".join(piece for piece in (piece.strip() for piece in pieces) if piece)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Near-duplicate detection for transcripts (MinHash + LSH)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    args = parser.parse_args()
+
+    report = find_duplicates(config.OUTPUT_DIR, args.workers)
+    tmp = f"{REPORT_PATH}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, REPORT_PATH)
+
+    stats = report["stats"]
+    print("=" * 60)
+    for cluster in report["file_clusters"]:
+        print(f"[DUP] keep: {cluster['keep']}")
+        for name in cluster["drop"]:
+            print(f"      drop: {name}")
+    print(f"Files dropped: {stats['files_dropped']} / {stats['files']}")
+    print(f"Paragraphs dropped: {stats['paragraphs_dropped']} / {stats['paragraphs']}")
+    if stats["chars_total"]:
+        print(f"Text removed: {stats['chars_dropped'] / stats['chars_total']:.1%}")
+    print(f"Report: {REPORT_PATH} (applied by prepare_dataset.py)")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
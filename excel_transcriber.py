@@ -8,6 +8,7 @@ Excel-Based YouTube Audio Transcriber
 Использование:
     python excel_transcriber.py           # Автопоиск .xlsx
     python excel_transcriber.py file.xlsx  # Указать файл
+    python excel_transcriber.py file.xlsx --download-workers 2 --transcribe-workers 4  # Конвейер
 """
 
 import sys
@@ -23,14 +24,27 @@ if sys.platform == 'win32':
         sys.stdout = codecs.getwriter('utf-8')(sys.stdout.buffer, 'strict')
         sys.stderr = codecs.getwriter('utf-8')(sys.stderr.buffer, 'strict')
 
+import argparse
+import queue
+import threading
+import time
 import requests
 from pytubefix import YouTube
 import yt_dlp
 import re
-import socket
+import copy
 import hashlib
 import config
-from retry_handler import retry_with_backoff
+from retry_handler import retry_with_backoff, get_retry_stats, call_when_closed
+from row_journal import RowJournal
+from metrics import metrics, prom_label
+from lemonfox_client import get_client, rate_limiter, circuit_breaker
+from transcript_cache import TranscriptCache, extract_video_id, file_sha256
+from audio_stream import open_audio_stream, select_audio_format
+from resumable_download import download_resumable, find_partials
+from long_audio import probe_duration, transcribe_long_audio
+from audio_preprocess import preprocess_in_pool, shutdown_pool
+from youtube_metadata import extract_info, fresh_info, forget_info, prefetch_metadata
 from openpyxl import load_workbook
 from openpyxl.styles import PatternFill
 
@@ -38,6 +52,9 @@ from openpyxl.styles import PatternFill
 # Цвет для окраски ячеек
 GREEN_FILL = PatternFill(start_color="00FF00", end_color="00FF00", fill_type="solid")  # Успех
 
+# Кеш транскрипций и аудио по ID видео
+transcript_cache = TranscriptCache(config.CACHE_DIR, config.AUDIO_CACHE_MAX_MB)
+
 
 def clean_filename(filename):
     """Очистка имени файла от недопустимых символов"""
@@ -45,15 +62,6 @@ def clean_filename(filename):
     return cleaned.strip('. ')[:100]
 
 
-def check_dns_availability(hostname: str) -> bool:
-    """Проверка доступности DNS"""
-    try:
-        socket.gethostbyname(hostname)
-        return True
-    except socket.gaierror:
-        return False
-
-
 def is_row_processed(row) -> bool:
     """
     Проверка, обработана ли строка (окрашена в зеленый).
@@ -88,40 +96,162 @@ def color_row(worksheet, row_num: int, fill: PatternFill):
         cell.fill = fill
 
 
+class WorkbookWriter:
+    """
+    Пакетная окраска строк в таблице.
+    
+    Таблица на запись открывается лениво - только при первой окраске,
+    поиск необработанных строк идет через потоковое чтение (scan_rows).
+    """
+    
+    def __init__(self, workbook_path: str):
+        self.workbook_path = workbook_path
+        self.workbook = None
+    
+    def flush(self, journal: RowJournal) -> int:
+        """
+        Все обработанные, но ещё не окрашенные строки из журнала
+        окрашиваются в зеленый, затем таблица сохраняется ОДИН раз.
+        
+        Если файл занят (открыт в Excel), строки остаются в журнале
+        и будут окрашены при следующем сохранении.
+        
+        Returns:
+            Количество окрашенных строк
+        """
+        row_nums = journal.uncolored_rows()
+        if not row_nums:
+            return 0
+        
+        try:
+            if self.workbook is None:
+                self.workbook = load_workbook(self.workbook_path)
+            worksheet = self.workbook.active
+            for row_num in row_nums:
+                color_row(worksheet, row_num, GREEN_FILL)
+            with metrics.timer("workbook_save", rows=len(row_nums)):
+                self.workbook.save(self.workbook_path)
+        except Exception as e:
+            print(f"[WARNING] Не удалось сохранить таблицу ({e}) - повторю позже")
+            sys.stdout.flush()
+            return 0
+        
+        journal.mark_colored(row_nums)
+        metrics.write_prometheus()
+        print(f"[OK] Таблица сохранена, окрашено строк: {len(row_nums)}")
+        sys.stdout.flush()
+        return len(row_nums)
+
+
+def scan_rows(workbook_path: str, journal: RowJournal) -> tuple[list, int, int, int]:
+    """
+    Потоковый проход по таблице (read-only) для поиска необработанных строк.
+    
+    Не строит объектную модель всей книги - память и время старта
+    не зависят от стилей и размера таблицы. Зеленые строки переносятся
+    в журнал, пока перенос не завершен (флаг в журнале), дальше решает журнал.
+    
+    Args:
+        workbook_path: Путь к Excel файлу
+        journal: Журнал статусов строк
+        
+    Returns:
+        Tuple (pending, data_rows, skipped, empty), где pending -
+        список (row_num, video_name, video_url)
+    """
+    done_rows = journal.done_rows()
+    needs_import = journal.needs_import
+    pending = []
+    data_rows = 0
+    skipped = 0
+    empty = 0
+    
+    workbook = load_workbook(workbook_path, read_only=True)
+    try:
+        worksheet = workbook.active
+        # Начиная со 2-й строки (первая - заголовок)
+        for row_num, row in enumerate(worksheet.iter_rows(min_row=2, max_col=2), start=2):
+            row = list(row) + [None] * (2 - len(row))
+            data_rows += 1
+            
+            # Получаем данные
+            video_name = row[0].value if row[0] is not None else None  # Колонка A
+            video_url = row[1].value if row[1] is not None else None   # Колонка B
+            
+            # Журнал - источник истины. Зеленые строки из таблицы
+            # переносим в него, пока перенос не завершен ни разу
+            if needs_import and row[0] is not None and is_row_processed(row):
+                journal.import_processed(row_num, video_name, video_url)
+                done_rows[row_num] = video_url
+            
+            # Проверяем по журналу, не обработана ли уже строка
+            if row_num in done_rows and done_rows[row_num] == video_url:
+                skipped += 1
+                continue
+            
+            if not video_name or not video_url:
+                empty += 1
+                continue
+            
+            pending.append((row_num, video_name, video_url))
+    finally:
+        workbook.close()
+    
+    if needs_import:
+        journal.finish_import()
+    return pending, data_rows, skipped, empty
+
+
 @retry_with_backoff(operation_name="YouTube Download (yt-dlp)")
 def download_with_ytdlp_core(youtube_url: str, output_path: str, video_title: str) -> tuple[str, str]:
     """
     Скачивание аудио через yt-dlp с автоматическим retry.
+    
+    Info берется из памяти (потоковая попытка этой же строки) или одним запросом
+    через общий extractor и передается в скачивание без повторного extract_info.
+    Скачивание с докачкой: retry и перезапуск продолжают с места обрыва.
     """
-    ydl_info_opts = {
-        'quiet': True,
-        'no_warnings': True,
-    }
+    info = extract_info(youtube_url)
+    extracted_title = info.get('title', video_title)
     
-    with yt_dlp.YoutubeDL(ydl_info_opts) as ydl:
-        info = ydl.extract_info(youtube_url, download=False)
-        extracted_title = info.get('title', video_title)
-        
-        if video_title.startswith('video_'):
-            video_title = clean_filename(extracted_title)
+    if video_title.startswith('video_'):
+        video_title = clean_filename(extracted_title)
     
     audio_filename = f"{video_title}.mp4"
     audio_path = os.path.join(output_path, audio_filename)
     
+    # Прямая ссылка на аудио - своя докачка диапазонами, иначе yt-dlp
+    if select_audio_format(info) is not None:
+        try:
+            audio_path = download_resumable(info, output_path, audio_path)
+        except Exception:
+            # Ссылки на форматы могли устареть - при retry получим info заново
+            forget_info(info.get('id'))
+            raise
+        forget_info(info.get('id'))  # Скачано - полный info (все форматы) больше не нужен
+        return audio_path, video_title
+    
     ydl_opts = {
         'format': 'bestaudio[ext=m4a]/bestaudio/best',
         'outtmpl': audio_path,
         'noplaylist': True,
+        'continuedl': True,  # yt-dlp тоже докачивает свой .part
         'quiet': True,
         'no_warnings': True,
     }
     
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        ydl.download([youtube_url])
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            ydl.process_ie_result(copy.deepcopy(info), download=True)
+    except Exception:
+        # Ссылки на форматы могли устареть - при retry получим info заново
+        forget_info(info.get('id'))
+        raise
     
     if not os.path.exists(audio_path):
         raise Exception("Audio file was not created by yt-dlp")
     
+    forget_info(info.get('id'))
     return audio_path, video_title
 
 
@@ -140,6 +270,13 @@ def download_youtube_audio(youtube_url: str, output_dir: str, suggested_name: st
     video_title = None
     audio_path = None
     
+    # Info уже получен на этапе метаданных - сразу yt-dlp, без второго запроса.
+    # Недокачанный файл с прошлого запуска - тоже через yt-dlp (pytubefix не докачивает)
+    video_id = extract_video_id(youtube_url)
+    if fresh_info(video_id) is not None or (video_id and find_partials(output_dir, video_id)):
+        video_title = clean_filename(suggested_name) if suggested_name else f"video_{hashlib.md5(youtube_url.encode()).hexdigest()[:8]}"
+        return download_with_ytdlp_core(youtube_url, output_dir, video_title)
+    
     # METHOD 1: pytubefix (быстрее)
     try:
         yt = YouTube(youtube_url)
@@ -178,50 +315,224 @@ def download_youtube_audio(youtube_url: str, output_dir: str, suggested_name: st
             raise
 
 
-@retry_with_backoff(operation_name="Audio Transcription")
-def transcribe_audio_core(audio_path: str, api_key: str) -> dict:
+@retry_with_backoff(operation_name="Audio Transcription",
+                    rate_limiter=rate_limiter, circuit_breaker=circuit_breaker)
+def transcribe_audio_core(audio_path: str, api_key: str, response_format: str = "json") -> dict:
     """
     Транскрибация аудио через Lemonfox API (с автоматическим retry).
-    """
-    hostname = "api.lemonfox.ai"
-    
-    with open(audio_path, 'rb') as audio_file:
-        response = requests.post(
-            f"https://{hostname}/v1/audio/transcriptions",
-            headers={"Authorization": f"Bearer {api_key}"},
-            files={"file": audio_file},
-            data={"language": "en", "response_format": "json"},
-            timeout=(30, 300)
-        )
     
-    if response.status_code == 200:
-        return response.json()
-    else:
-        response.raise_for_status()
-        raise Exception(f"API error: {response.status_code} - {response.text}")
+    Общий клиент: keep-alive пул соединений и потоковая загрузка файла.
+    """
+    return get_client(api_key).transcribe(audio_path, response_format=response_format)
 
 
 def transcribe_audio_with_retry(audio_path: str, api_key: str) -> dict:
-    """Транскрибация с проверкой DNS и автоматическим retry."""
-    hostname = "api.lemonfox.ai"
+    """
+    Транскрибация с проверкой DNS (кешируется) и автоматическим retry.
     
-    if not check_dns_availability(hostname):
+    Длинные аудио (> LONG_AUDIO_THRESHOLD_SEC) режутся на сегменты
+    с перекрытием и транскрибируются параллельно - retry только у упавших сегментов.
+    Пока circuit breaker Lemonfox разомкнут, запрос ждет его восстановления,
+    а не проваливает строку (очередь аудио ограничена - скачивание тоже встает).
+    """
+    if not get_client(api_key).dns_ok():
         print("[WARNING] DNS resolution failed - will retry automatically")
         sys.stdout.flush()
     
-    return transcribe_audio_core(audio_path, api_key)
+    duration = probe_duration(audio_path)
+    with metrics.timer("transcribe", bytes=os.path.getsize(audio_path)) as fields:
+        if duration and duration > config.LONG_AUDIO_THRESHOLD_SEC:
+            result = transcribe_long_audio(
+                audio_path,
+                lambda segment_path: call_when_closed(
+                    circuit_breaker, transcribe_audio_core, segment_path, api_key, "verbose_json"),
+                duration
+            )
+        else:
+            result = call_when_closed(circuit_breaker, transcribe_audio_core, audio_path, api_key)
+        
+        # Длительность аудио - для real-time factor
+        audio_seconds = duration or result.get('duration')
+        if audio_seconds:
+            fields["audio_seconds"] = audio_seconds
+    
+    return result
 
 
-def process_video_row(worksheet, row_num: int, video_name: str, video_url: str, workbook_path: str) -> bool:
+@retry_with_backoff(max_retries=0, operation_name="Streaming Transcription",
+                    rate_limiter=rate_limiter, circuit_breaker=circuit_breaker)
+def stream_transcribe_core(reader, filename: str, file_size: int, api_key: str) -> dict:
+    """Одна попытка потоковой загрузки (при ошибке - откат на скачивание на диск)."""
+    return get_client(api_key).transcribe_stream(reader, filename, file_size)
+
+
+def save_transcript(result: dict, final_name: str) -> str:
+    """Сохранение текста транскрипции в OUTPUT_DIR. Возвращает путь к файлу."""
+    print("[3/3] Сохранение транскрипции...")
+    sys.stdout.flush()
+    
+    output_path = os.path.join(config.OUTPUT_DIR, f"{final_name}.txt")
+    with open(output_path, 'w', encoding='utf-8') as f:
+        f.write(result['text'])
+    
+    print(f"[OK] Транскрипция сохранена: {output_path}")
+    sys.stdout.flush()
+    
+    return output_path
+
+
+def load_cached_transcript(video_url: str, video_name: str):
+    """
+    Проверка кеша транскрипций ДО любой сетевой работы.
+    
+    Returns:
+        Путь к сохраненной транскрипции или None, если в кеше нет
+    """
+    video_id = extract_video_id(video_url)
+    result = transcript_cache.get(video_id)
+    if result is None:
+        return None
+    
+    print(f"[CACHE] Транскрипция найдена в кеше: {video_id}")
+    sys.stdout.flush()
+    metrics.incr("transcript_cache_hits")
+    return save_transcript(result, clean_filename(video_name))
+
+
+def download_audio_cached(video_url: str, video_name: str) -> tuple[str, str]:
+    """
+    Скачивание аудио с проверкой кеша аудио.
+    
+    Скачанный файл переносится в кеш (вытеснение по размеру).
+    
+    Returns:
+        Tuple (audio_path, video_title)
+    """
+    video_id = extract_video_id(video_url)
+    cached_path = transcript_cache.audio_path(video_id)
+    if cached_path:
+        print(f"[CACHE] Аудио найдено в кеше: {video_id}")
+        sys.stdout.flush()
+        metrics.incr("audio_cache_hits")
+        return cached_path, clean_filename(video_name)
+    
+    with metrics.timer("download") as fields:
+        audio_path, final_name = download_youtube_audio(video_url, config.TEMP_DIR, video_name)
+        fields["bytes"] = os.path.getsize(audio_path)
+    return transcript_cache.store_audio(video_id, audio_path), final_name
+
+
+def stream_and_save(video_url: str, video_name: str) -> str:
+    """
+    Потоковый режим: аудио идет с YouTube сразу в загрузку Lemonfox,
+    без временного файла в TEMP_DIR.
+    
+    Returns:
+        Путь к сохраненной транскрипции
+    """
+    info = extract_info(video_url)
+    reader, audio_format = open_audio_stream(info)
+    if reader is None:
+        raise Exception("No direct audio URL for streaming")
+    
+    video_id = info.get('id') or extract_video_id(video_url)
+    filename = f"{video_id}.{audio_format.get('ext') or 'mp4'}"
+    try:
+        with metrics.timer("stream_transcribe") as fields:
+            result = stream_transcribe_core(reader, filename, audio_format.get('filesize'), config.LEMONFOX_API_KEY)
+            fields["bytes"] = reader.position
+            if info.get('duration'):
+                fields["audio_seconds"] = info['duration']
+    finally:
+        reader.close()
+    
+    forget_info(info.get('id'))
+    transcript_cache.put(video_id, result, reader.hexdigest)
+    return save_transcript(result, clean_filename(video_name))
+
+
+def try_stream_and_save(video_url: str, video_name: str):
+    """
+    Попытка потокового режима.
+    
+    Returns:
+        Путь к транскрипции или None (тогда - обычное скачивание на диск)
+    """
+    try:
+        return stream_and_save(video_url, video_name)
+    except Exception as e:
+        print(f"[WARNING] Потоковый режим не удался ({e}) - скачиваю на диск")
+        sys.stdout.flush()
+        return None
+
+
+def transcribe_and_save(audio_path: str, final_name: str, video_id: str = None,
+                        preprocess: bool = False) -> str:
+    """
+    Транскрибация скачанного аудио и сохранение текста в OUTPUT_DIR.
+    
+    Перед отправкой в API проверяется кеш по хешу аудио,
+    ответ API сохраняется в кеш по ID видео и по хешу.
+    
+    Args:
+        audio_path: Путь к аудио файлу
+        final_name: Имя файла транскрипции (без расширения)
+        video_id: ID видео YouTube (для кеша)
+        preprocess: Сжать аудио (моно, 16 kHz, речевой кодек) перед загрузкой
+        
+    Returns:
+        Путь к сохраненной транскрипции
+    """
+    try:
+        audio_hash = file_sha256(audio_path)
+        result = transcript_cache.get_by_hash(audio_hash)
+        
+        if result is None:
+            if preprocess:
+                with metrics.timer("preprocess"):
+                    upload_path = preprocess_in_pool(audio_path)
+            else:
+                upload_path = audio_path
+            try:
+                result = transcribe_audio_with_retry(upload_path, config.LEMONFOX_API_KEY)
+            finally:
+                if upload_path != audio_path:
+                    os.remove(upload_path)
+        else:
+            print(f"[CACHE] Транскрипция найдена по хешу аудио: {audio_hash[:12]}")
+            sys.stdout.flush()
+            metrics.incr("audio_hash_cache_hits")
+        
+        transcript_cache.put(video_id, result, audio_hash)
+        output_path = save_transcript(result, final_name)
+    finally:
+        # Аудио из кеша больше не ждет транскрибации - снова может вытесняться
+        transcript_cache.release_audio(audio_path)
+    
+    # Удаляем временный аудио файл (закешированное аудио - оставляем)
+    if not transcript_cache.owns(audio_path):
+        try:
+            os.remove(audio_path)
+        except:
+            pass
+    
+    return output_path
+
+
+def process_video_row(journal: RowJournal, row_num: int, video_name: str, video_url: str,
+                      stream: bool = False, preprocess: bool = False) -> bool:
     """
     Обработка одной строки таблицы: скачивание + транскрибация.
     
+    Результат записывается в журнал, окраска таблицы - пакетно в main.
+    
     Args:
-        worksheet: Лист Excel
+        journal: Журнал статусов строк
         row_num: Номер строки
         video_name: Название видео из колонки A
         video_url: URL из колонки B
-        workbook_path: Путь к Excel файлу
+        stream: Потоковый режим (без временного файла, откат на диск при ошибке)
+        preprocess: Предобработка аудио перед загрузкой
         
     Returns:
         True если успешно, False если ошибка
@@ -233,11 +544,26 @@ def process_video_row(worksheet, row_num: int, video_name: str, video_url: str,
     sys.stdout.flush()
     
     try:
+        # Сначала - кеш транскрипций (без сети)
+        output_path = load_cached_transcript(video_url, video_name)
+        if output_path:
+            journal.mark_done(row_num, output_path)
+            return True
+        
+        if stream:
+            print("[1/3] Потоковая транскрибация (без временного файла)...")
+            sys.stdout.flush()
+            
+            output_path = try_stream_and_save(video_url, video_name)
+            if output_path:
+                journal.mark_done(row_num, output_path)
+                return True
+        
         # Скачиваем аудио
         print("[1/3] Скачивание аудио...")
         sys.stdout.flush()
         
-        audio_path, final_name = download_youtube_audio(video_url, config.TEMP_DIR, video_name)
+        audio_path, final_name = download_audio_cached(video_url, video_name)
         audio_size_mb = os.path.getsize(audio_path) / (1024 * 1024)
         print(f"[OK] Аудио скачано: {audio_size_mb:.1f} MB")
         sys.stdout.flush()
@@ -246,28 +572,10 @@ def process_video_row(worksheet, row_num: int, video_name: str, video_url: str,
         print("[2/3] Транскрибация через Lemonfox API...")
         sys.stdout.flush()
         
-        result = transcribe_audio_with_retry(audio_path, config.LEMONFOX_API_KEY)
-        
-        # Сохраняем транскрипцию
-        print("[3/3] Сохранение транскрипции...")
-        sys.stdout.flush()
+        output_path = transcribe_and_save(audio_path, final_name, extract_video_id(video_url), preprocess)
         
-        output_path = os.path.join(config.OUTPUT_DIR, f"{final_name}.txt")
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(result['text'])
-        
-        print(f"[OK] Транскрипция сохранена: {output_path}")
-        sys.stdout.flush()
-        
-        # Удаляем временный аудио файл
-        try:
-            os.remove(audio_path)
-        except:
-            pass
-        
-        # Окрашиваем в зеленый ТОЛЬКО при успехе
-        color_row(worksheet, row_num, GREEN_FILL)
-        worksheet.parent.save(workbook_path)
+        # Отмечаем успех в журнале (окраска в зеленый - пакетно)
+        journal.mark_done(row_num, output_path)
         
         return True
         
@@ -276,9 +584,213 @@ def process_video_row(worksheet, row_num: int, video_name: str, video_url: str,
         sys.stdout.flush()
         
         # НЕ окрашиваем при ошибке - оставляем белым
+        journal.mark_failed(row_num, str(e))
         return False
 
 
+def download_worker(jobs: queue.Queue, audio_queue: queue.Queue, results: queue.Queue,
+                    stream: bool = False):
+    """
+    Воркер стадии скачивания: берет строки из jobs, кладет аудио в audio_queue.
+    
+    audio_queue ограничена по размеру - если транскрибация не успевает,
+    скачивание блокируется и не забивает диск. В потоковом режиме воркер
+    сам транскрибирует без файла, а в очередь попадают только откаты на диск.
+    """
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        
+        row_num, video_name, video_url = job
+        
+        try:
+            # Сначала - кеш транскрипций (без сети)
+            output_path = load_cached_transcript(video_url, video_name)
+            if output_path:
+                results.put((row_num, True, output_path))
+                continue
+            
+            if stream:
+                print(f"[Строка {row_num}] [1/3] Потоковая транскрибация: {video_name}")
+                sys.stdout.flush()
+                
+                output_path = try_stream_and_save(video_url, video_name)
+                if output_path:
+                    results.put((row_num, True, output_path))
+                    continue
+            
+            print(f"[Строка {row_num}] [1/3] Скачивание аудио: {video_name}")
+            sys.stdout.flush()
+            
+            audio_path, final_name = download_audio_cached(video_url, video_name)
+            audio_size_mb = os.path.getsize(audio_path) / (1024 * 1024)
+            print(f"[Строка {row_num}] [OK] Аудио скачано: {audio_size_mb:.1f} MB")
+            sys.stdout.flush()
+        except Exception as e:
+            print(f"[Строка {row_num}] [ERROR] Ошибка скачивания: {e}")
+            sys.stdout.flush()
+            results.put((row_num, False, str(e)))
+            continue
+        
+        audio_queue.put((row_num, audio_path, final_name, extract_video_id(video_url)))
+
+
+def transcribe_worker(audio_queue: queue.Queue, results: queue.Queue, preprocess: bool = False):
+    """
+    Воркер стадии транскрибации: берет аудио из audio_queue и сохраняет текст.
+    
+    Предобработка идет в пуле процессов - поток только ждет результат.
+    """
+    while True:
+        item = audio_queue.get()
+        if item is None:
+            break
+        
+        row_num, audio_path, final_name, video_id = item
+        print(f"[Строка {row_num}] [2/3] Транскрибация через Lemonfox API...")
+        sys.stdout.flush()
+        
+        try:
+            output_path = transcribe_and_save(audio_path, final_name, video_id, preprocess)
+            results.put((row_num, True, output_path))
+        except Exception as e:
+            print(f"[Строка {row_num}] [ERROR] Ошибка транскрибации: {e}")
+            sys.stdout.flush()
+            results.put((row_num, False, str(e)))
+
+
+def run_pipeline(writer: WorkbookWriter, pending: list, journal: RowJournal,
+                 download_workers: int, transcribe_workers: int, queue_size: int,
+                 save_every: int, stream: bool = False, preprocess: bool = False) -> tuple[int, int]:
+    """
+    Конвейерная обработка: пул скачивания -> ограниченная очередь -> пул транскрибации.
+    
+    Стадии работают одновременно, поэтому общее время близко к времени
+    самой медленной стадии, а не к их сумме. Workbook и журнал трогает
+    только главный поток (openpyxl и sqlite3 не потокобезопасны).
+    
+    Args:
+        writer: Пакетная запись окраски в таблицу
+        pending: Список (row_num, video_name, video_url) для обработки
+        journal: Журнал статусов строк
+        download_workers: Количество потоков скачивания
+        transcribe_workers: Количество потоков транскрибации
+        queue_size: Максимум скачанных, но еще не транскрибированных файлов
+        save_every: Сохранять таблицу каждые N успешных строк
+        stream: Потоковый режим в воркерах скачивания
+        preprocess: Предобработка аудио перед загрузкой
+        
+    Returns:
+        Tuple (successful, failed)
+    """
+    jobs = queue.Queue()
+    audio_queue = queue.Queue(maxsize=queue_size)
+    results = queue.Queue()
+    started = {}
+    
+    for job in pending:
+        journal.mark_pending(*job)
+        started[job[0]] = time.perf_counter()
+        jobs.put(job)
+    for _ in range(download_workers):
+        jobs.put(None)
+    
+    downloaders = [
+        threading.Thread(target=download_worker, args=(jobs, audio_queue, results, stream), daemon=True)
+        for _ in range(download_workers)
+    ]
+    transcribers = [
+        threading.Thread(target=transcribe_worker, args=(audio_queue, results, preprocess), daemon=True)
+        for _ in range(transcribe_workers)
+    ]
+    for thread in downloaders + transcribers:
+        thread.start()
+    
+    # Когда скачивание закончено - останавливаем транскрибацию
+    def close_audio_queue():
+        for thread in downloaders:
+            thread.join()
+        for _ in range(transcribe_workers):
+            audio_queue.put(None)
+    
+    threading.Thread(target=close_audio_queue, daemon=True).start()
+    
+    successful = 0
+    failed = 0
+    for _ in range(len(pending)):
+        row_num, ok, detail = results.get()
+        
+        # Латентность строки (с момента постановки в очередь) и глубина очередей
+        metrics.observe("row", time.perf_counter() - started.pop(row_num), ok, row=row_num)
+        metrics.gauge("jobs_queue_depth", jobs.qsize())
+        metrics.gauge("audio_queue_depth", audio_queue.qsize())
+        
+        if ok:
+            # Окрашиваем в зеленый ТОЛЬКО при успехе (пакетно)
+            journal.mark_done(row_num, detail)
+            successful += 1
+            if successful % save_every == 0:
+                writer.flush(journal)
+        else:
+            journal.mark_failed(row_num, detail)
+            failed += 1
+    
+    for thread in transcribers:
+        thread.join()
+    
+    return successful, failed
+
+
+def retry_stats_prometheus() -> list:
+    """Счетчики retry_handler в формате Prometheus"""
+    lines = ["# TYPE transcriber_retry_total counter"]
+    for operation, counters in get_retry_stats().items():
+        for result, value in counters.items():
+            lines.append(f'transcriber_retry_total{{operation="{prom_label(operation)}",'
+                         f'result="{prom_label(result)}"}} {value}')
+    return lines
+
+
+def print_metrics_summary():
+    """p50/p95 по стадиям, пропускная способность скачивания и real-time factor"""
+    summary = metrics.summary()
+    if not summary:
+        return
+    
+    print("Метрики стадий:")
+    for stage, data in summary.items():
+        line = (f"  {stage:18} n={data['count']:<5} ошибок={data['errors']:<3} "
+                f"p50={data['p50']:.2f}s p95={data['p95']:.2f}s всего={data['total']:.0f}s")
+        if data.get('bytes') and data['total']:
+            line += f" | {data['bytes'] / data['total'] / 1024 / 1024:.2f} MB/s"
+        if data.get('audio_seconds') and data['total']:
+            line += f" | RTF={data['total'] / data['audio_seconds']:.3f}"
+        print(line)
+    print(f"Метрики: {metrics.events_path}, {metrics.prom_path}")
+
+
+def parse_args():
+    """Разбор аргументов командной строки"""
+    parser = argparse.ArgumentParser(description="Excel-Based YouTube Audio Transcriber")
+    parser.add_argument("excel_file", nargs="?", help="Путь к .xlsx (по умолчанию - автопоиск)")
+    parser.add_argument("--download-workers", type=int, default=None,
+                        help="Потоков скачивания (включает конвейерный режим)")
+    parser.add_argument("--transcribe-workers", type=int, default=None,
+                        help="Потоков транскрибации (включает конвейерный режим)")
+    parser.add_argument("--queue-size", type=int, default=None,
+                        help="Максимум скачанных файлов в очереди (по умолчанию 2 x transcribe-workers)")
+    parser.add_argument("--save-every", type=int, default=25,
+                        help="Сохранять .xlsx каждые N успешных строк (и всегда в конце)")
+    parser.add_argument("--prefetch-workers", type=int, default=0,
+                        help="Заранее получить метаданные всех видео в N потоков (длинные видео - первыми)")
+    parser.add_argument("--stream", action="store_true",
+                        help="Потоковый режим: аудио сразу в загрузку без временного файла (откат на диск при ошибке)")
+    parser.add_argument("--preprocess", action="store_true",
+                        help="Сжимать аудио перед загрузкой: моно, 16 kHz, речевой кодек, без длинных пауз (нужен ffmpeg)")
+    return parser.parse_args()
+
+
 def find_excel_file() -> str:
     """
     Поиск Excel файла в текущей директории.
@@ -316,9 +828,12 @@ def find_excel_file() -> str:
 def main():
     """Главная функция"""
     
+    args = parse_args()
+    pipeline_mode = args.download_workers is not None or args.transcribe_workers is not None
+    
     # Если файл указан в аргументах - используем его
-    if len(sys.argv) >= 2:
-        excel_file = sys.argv[1]
+    if args.excel_file:
+        excel_file = args.excel_file
         if not os.path.exists(excel_file):
             print(f"[ERROR] Файл не найден: {excel_file}")
             sys.exit(1)
@@ -332,58 +847,77 @@ def main():
     print(f"Файл: {excel_file}\n")
     sys.stdout.flush()
     
+    save_every = max(1, args.save_every)
+    metrics.configure(config.METRICS_DIR, extra_prom=retry_stats_prometheus)
+    journal = RowJournal(excel_file)
+    writer = WorkbookWriter(excel_file)
+    
     try:
         # Создаем необходимые папки
         os.makedirs(config.TEMP_DIR, exist_ok=True)
         os.makedirs(config.OUTPUT_DIR, exist_ok=True)
         
-        # Загружаем Excel файл
-        print("[STEP 1] Загрузка Excel таблицы...")
+        # Потоковый поиск необработанных строк
+        print("[STEP 1] Чтение Excel таблицы...")
         sys.stdout.flush()
         
-        workbook = load_workbook(excel_file)
-        worksheet = workbook.active
-        
-        # Подсчитываем строки (пропускаем заголовок)
-        total_rows = worksheet.max_row
-        data_rows = total_rows - 1  # Минус заголовок
+        pending, data_rows, skipped, empty = scan_rows(excel_file, journal)
         
         print(f"[OK] Найдено строк: {data_rows}")
+        print(f"[OK] К обработке: {len(pending)} | Уже обработаны: {skipped} | Пустые: {empty}")
+        print(f"[OK] Журнал статусов: {journal.path}")
+        
+        partials = find_partials(config.TEMP_DIR)
+        if partials:
+            partial_mb = sum(os.path.getsize(path) for path in partials) / (1024 * 1024)
+            print(f"[RESUME] Недокачанных файлов: {len(partials)} ({partial_mb:.1f} MB) - будут докачаны")
+        
+        # Метаданные всех видео заранее: длинные видео ставим первыми,
+        # чтобы они не оказались в хвосте очереди
+        if args.prefetch_workers > 0 and pending:
+            print(f"\n[STEP 1.5] Получение метаданных ({args.prefetch_workers} потоков)...")
+            sys.stdout.flush()
+            
+            metadata = prefetch_metadata([url for _, _, url in pending], args.prefetch_workers)
+            pending.sort(key=lambda job: -((metadata.get(job[2]) or {}).get('duration') or 0))
+            total_hours = sum((m.get('duration') or 0) for m in metadata.values()) / 3600
+            
+            print(f"[OK] Метаданные: {len(metadata)}/{len(pending)} | Общая длительность: {total_hours:.1f} ч")
+        
         print(f"\n[STEP 2] Начинаю обработку видео...")
         sys.stdout.flush()
         
         # Статистика
         successful = 0
         failed = 0
-        skipped = 0
         
-        # Обрабатываем каждую строку (начиная со 2-й, первая - заголовок)
-        for row_num in range(2, total_rows + 1):
-            row = list(worksheet[row_num])
-            
-            # Проверяем, не обработана ли уже строка
-            if is_row_processed(row):
-                video_name = row[0].value
-                print(f"\n[Строка {row_num}] Пропускаю (уже обработана): {video_name}")
-                sys.stdout.flush()
-                skipped += 1
-                continue
+        if pipeline_mode and pending:
+            download_workers = max(1, args.download_workers or 1)
+            transcribe_workers = max(1, args.transcribe_workers or 1)
+            queue_size = max(1, args.queue_size or transcribe_workers * 2)
             
-            # Получаем данные
-            video_name = row[0].value  # Колонка A
-            video_url = row[1].value   # Колонка B
-            
-            if not video_name or not video_url:
-                print(f"\n[Строка {row_num}] Пропускаю (пустые данные)")
-                sys.stdout.flush()
-                skipped += 1
-                continue
+            print(f"\n[PIPELINE] Видео в очереди: {len(pending)}")
+            print(f"[PIPELINE] Скачивание: {download_workers} | Транскрибация: {transcribe_workers} | Буфер: {queue_size}")
+            sys.stdout.flush()
             
-            # Обрабатываем видео
-            if process_video_row(worksheet, row_num, video_name, video_url, excel_file):
-                successful += 1
-            else:
-                failed += 1
+            successful, failed = run_pipeline(
+                writer, pending, journal,
+                download_workers, transcribe_workers, queue_size, save_every,
+                args.stream, args.preprocess
+            )
+        else:
+            # Обрабатываем строки по одной
+            for row_num, video_name, video_url in pending:
+                journal.mark_pending(row_num, video_name, video_url)
+                row_start = time.perf_counter()
+                ok = process_video_row(journal, row_num, video_name, video_url, args.stream, args.preprocess)
+                metrics.observe("row", time.perf_counter() - row_start, ok, row=row_num)
+                if ok:
+                    successful += 1
+                    if successful % save_every == 0:
+                        writer.flush(journal)
+                else:
+                    failed += 1
         
         # Финальный отчет
         print(f"\n{'='*60}")
@@ -392,7 +926,11 @@ def main():
         print(f"Успешно обработано: {successful}")
         print(f"Ошибок: {failed}")
         print(f"Пропущено (уже обработаны): {skipped}")
+        print(f"Пропущено (пустые данные): {empty}")
         print(f"Транскрипции сохранены в: {config.OUTPUT_DIR}/")
+        for operation, counters in get_retry_stats().items():
+            print(f"[RETRY STATS] {operation}: {counters}")
+        print_metrics_summary()
         print(f"{'='*60}")
         sys.stdout.flush()
         
@@ -401,6 +939,13 @@ def main():
         import traceback
         traceback.print_exc()
         sys.exit(1)
+    
+    finally:
+        # Финальная пакетная окраска (в т.ч. при ошибке или Ctrl+C)
+        writer.flush(journal)
+        journal.close()
+        shutdown_pool()
+        metrics.write_prometheus()
 
 
 if __name__ == "__main__":
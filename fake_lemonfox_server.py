@@ -0,0 +1,142 @@
+"""
+Локальная замена Lemonfox API для проверки транскрибера без сети и оплаты
+
+Имитирует POST /v1/audio/transcriptions: принимает multipart
+(Content-Length или chunked), отвечает JSON с text и segments.
+
+Использование:
+    python fake_lemonfox_server.py                       # http://127.0.0.1:8765
+    python fake_lemonfox_server.py --delay 2 --fail-rate 0.2
+
+В config.py: LEMONFOX_BASE_URL = "http://127.0.0.1:8765"
+"""
+
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeLemonfoxHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, как у настоящего API
+
+    # Настройки сервера (задаются в run_server)
+    delay = 0.0
+    fail_rate = 0.0
+    bytes_per_second = 16000  # "длительность" аудио по размеру файла
+
+    stats = {"requests": 0, "connections": 0, "bytes": 0}
+    stats_lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with self.stats_lock:
+            self.stats["connections"] += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self) -> bytes:
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            body = b""
+            while True:
+                size = int(self.rfile.readline().strip().split(b";")[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                body += self.rfile.read(size)
+                self.rfile.readline()
+            return body
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def send_json(self, status: int, data: dict):
+        payload = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        body = self.read_body()
+
+        if self.path != "/v1/audio/transcriptions":
+            self.send_json(404, {"error": "not found"})
+            return
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            self.send_json(401, {"error": "missing api key"})
+            return
+
+        file_part = body.find(b'name="file"')
+        headers_end = body.find(b"\r\n\r\n", file_part)
+        if file_part < 0 or headers_end < 0:
+            self.send_json(400, {"error": "missing file"})
+            return
+        boundary_end = body.rfind(b"\r\n--")
+        audio = body[headers_end + 4:boundary_end]
+
+        with self.stats_lock:
+            self.stats["requests"] += 1
+            self.stats["bytes"] += len(audio)
+
+        if self.delay:
+            time.sleep(self.delay)
+        if random.random() < self.fail_rate:
+            self.send_json(503, {"error": "fake outage"})
+            return
+
+        duration = len(audio) / self.bytes_per_second
+        segments = []
+        start = 0.0
+        index = 0
+        while start < duration:
+            end = min(start + 5.0, duration)
+            segments.append({"id": index, "start": start, "end": end,
+                             "text": f" segment {index} at {start:.1f}s."})
+            start = end
+            index += 1
+
+        self.send_json(200, {
+            "text": "".join(seg["text"] for seg in segments).strip() or f"fake transcript of {len(audio)} bytes",
+            "duration": duration,
+            "segments": segments,
+        })
+
+
+def run_server(host: str = "127.0.0.1", port: int = 8765, delay: float = 0.0,
+               fail_rate: float = 0.0) -> ThreadingHTTPServer:
+    """
+    Запуск сервера в фоновом потоке.
+
+    Returns:
+        Сервер (server.shutdown() для остановки, адрес - server.server_address)
+    """
+    FakeLemonfoxHandler.delay = delay
+    FakeLemonfoxHandler.fail_rate = fail_rate
+    server = ThreadingHTTPServer((host, port), FakeLemonfoxHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Lemonfox transcription server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=0.0, help="Задержка ответа, сек")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Доля ответов 503")
+    args = parser.parse_args()
+
+    server = run_server(args.host, args.port, args.delay, args.fail_rate)
+    print(f"[OK] Fake Lemonfox: http://{args.host}:{server.server_address[1]}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(f"\n[STATS] {FakeLemonfoxHandler.stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,20 @@
+import argparse
+
 from unsloth import FastLanguageModel
 import torch
 import config
+from metrics import Metrics
+from loop_detector import LoopDetector
+from story_streamer import StoryStreamer, resume_story, story_completion
+
+parser = argparse.ArgumentParser(description="Generate a Warhammer 40,000 story (streamed to stdout and file)")
+parser.add_argument("--output", default=config.GENERATE_OUTPUT, help="Story file (prompt + text)")
+parser.add_argument("--resume", action="store_true", help="Continue a partially written story from --output")
+parser.add_argument("--max-new-tokens", type=int, default=config.GENERATE_MAX_NEW_TOKENS,
+                    help="Token budget for the whole story (already written tokens count on --resume)")
+parser.add_argument("--no-loop-penalty", action="store_true",
+                    help="Only stop on a repetition loop, do not penalize loop continuations")
+args = parser.parse_args()
 
 # ===== ОПТИМИЗАЦИЯ ДЛЯ RTX 3060 TI 12GB =====
 print("🔧 Загрузка модели для RTX 3060 Ti 12GB...")
@@ -27,37 +41,78 @@ Style: Epic, dramatic, with detailed combat scenes.
 Length: Extended narrative, minimum 5000 words.
 
 Story:"""
+
+max_new_tokens = args.max_new_tokens
+completed = story_completion(args.output) if args.resume else None
+if completed in ("eos", "loop"):
+    print(f"✅ История {args.output} уже завершена ({completed}) - продолжать нечего")
+    raise SystemExit(0)
+if args.resume:
+    # Весь записанный текст становится промптом, бюджет - то, что осталось
+    prompt, written = resume_story(args.output, prompt)
+    done_tokens = len(tokenizer(written, add_special_tokens=False)["input_ids"])
+    max_new_tokens -= done_tokens
+    print(f"↪️  Продолжение {args.output}: уже {len(written)} символов (~{done_tokens} токенов), осталось {max(max_new_tokens, 0)}")
+    if max_new_tokens <= 0:
+        print("✅ История уже дописана до лимита токенов")
+        raise SystemExit(0)
 inputs = tokenizer([prompt], return_tensors="pt").to("cuda")
 
 print("📝 Генерация истории Warhammer 40,000...")
 print("⏱️  Ожидаемое время: 5-15 минут (зависит от длины)")
-print(f"🎯 Максимум токенов: 12000 (~35-40K символов)")
-print("")
-
-outputs = model.generate(
-    **inputs, 
-    max_new_tokens=12000,   # ✅ ~35-40K символов (безопасно для 12GB)
-    temperature=0.8,        # Креативность
-    top_p=0.95,            # Разнообразие
-    do_sample=True,
-    use_cache=True         # ✅ Кешировать для скорости
-)
-story = tokenizer.decode(outputs[0])
-
-# Очистка памяти после генерации
-torch.cuda.empty_cache()
-
+print(f"🎯 Максимум токенов: {max_new_tokens} (~35-40K символов на 12000)")
+print(f"💾 Текст пишется в {args.output} по мере генерации (Ctrl+C - потом --resume)")
 print("\n" + "="*60)
 print("GENERATED STORY")
 print("="*60 + "\n")
-print(story)
 
-# Сохранение в файл
-with open("generated_story.txt", "w", encoding="utf-8") as f:
-    f.write(story)
+# Новая история - файл начинается с промпта; продолжение - дописываем в конец
+streamer = StoryStreamer(tokenizer, args.output, prompt=None if args.resume else prompt)
+# Петля повторов: штраф продолжения, затем остановка раньше лимита токенов
+detector = LoopDetector(prompt_length=inputs["input_ids"].shape[1])
+eos_ids = model.generation_config.eos_token_id
+eos_ids = set(eos_ids if isinstance(eos_ids, list) else [eos_ids]) | {tokenizer.eos_token_id}
+reason = None  # Ctrl+C / ошибка - история не завершена, --resume продолжит
+try:
+    outputs = model.generate(
+        **inputs,
+        max_new_tokens=max_new_tokens,   # ✅ ~35-40K символов на 12000 (безопасно для 12GB)
+        temperature=0.8,        # Креативность
+        top_p=0.95,            # Разнообразие
+        do_sample=True,
+        use_cache=True,         # ✅ Кешировать для скорости
+        streamer=streamer,      # ✅ Токены сразу в stdout и файл
+        **detector.generate_kwargs(penalty=False if args.no_loop_penalty else None),
+    )
+    if outputs[0, -1].item() in eos_ids:
+        reason = "eos"
+    elif detector.report(max_new_tokens)["loop_detected"]:
+        reason = "loop"
+    else:
+        reason = "max_new_tokens"
+except KeyboardInterrupt:
+    print(f"\n⏸️  Остановлено. Продолжить: python generate.py --resume --output {args.output}")
+finally:
+    stats = streamer.finish(reason)
+loop = detector.report(max_new_tokens)
+
+# Итог истории -> metrics/generation_events.jsonl
+metrics = Metrics(prefix="generation")
+metrics.configure(config.METRICS_DIR)
+metrics.observe("story", stats["seconds"], tokens=stats["tokens"], saved_tokens=loop["saved_tokens"],
+                steered=loop["steered"], loop=loop["loop_detected"], output=args.output)
+
+# Очистка памяти после генерации
+torch.cuda.empty_cache()
 
 print("\n" + "="*60)
-print(f"✅ История сохранена: generated_story.txt")
-print(f"📊 Длина: {len(story)} символов")
+print(f"✅ История сохранена: {args.output}")
+print(f"📊 Сгенерировано: {stats['chars']} символов, {stats['tokens']} токенов")
+if stats["ttft_seconds"] is not None:
+    print(f"⚡ Первый токен: {stats['ttft_seconds']:.1f}s | {stats['tokens_per_sec']:.1f} токенов/сек")
+if loop["loop_detected"]:
+    print(f"🔁 Зацикливание на токене {loop['loop_at']}: остановлено, сэкономлено {loop['saved_tokens']} токенов")
+print(f"🔁 Детектор повторов: макс. доля {loop['max_repeat_ratio']:.2f}, штрафов {loop['steered']}, "
+      f"{loop['overhead_us_per_token']:.1f} мкс/токен")
 print(f"💾 Использовано VRAM: {torch.cuda.max_memory_allocated()/1024**3:.2f}GB")
-print("="*60)
\ No newline at end of file
+print("="*60)
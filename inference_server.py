@@ -0,0 +1,337 @@
+"""
+Постоянный сервер генерации с динамическим батчингом
+
+generate.py загружает 4-bit модель заново ради одной истории, и GPU
+большую часть времени простаивает. Сервер загружает FINETUNED_MODEL_PATH
+один раз и принимает запросы от любого числа клиентов:
+
+- Запросы копятся в очереди; поток батчера берет до INFERENCE_MAX_BATCH
+  совместимых запросов (одинаковые temperature/top_p и полоса max_new_tokens)
+  и генерирует их одним model.generate (left padding). Окно сбора - INFERENCE_BATCH_WAIT_MS от
+  прихода самого старого запроса: если GPU был занят, батч собирается сразу
+- Несовместимые запросы ждут следующего батча, порядок сохраняется
+- max_new_tokens у батча - максимум запросов, ответ каждого обрезается до своего;
+  полосы по степеням двойки: короткий запрос не ждет генерации длинного
+- Статистика: очередь, генерация, полная задержка (p50/p95), размер батча,
+  токены/сек - GET /stats и METRICS_DIR/inference.prom (Metrics из metrics.py)
+
+API:
+    POST /generate  {"prompt": "..."} или {"instruction": "...", "input": "..."}
+                    + необязательно max_new_tokens, temperature, top_p
+                    -> {"text", "tokens", "batch_size", "queue_seconds", "latency_seconds"}
+    GET  /stats
+    GET  /health
+
+Использование:
+    python inference_server.py                  # модель из config.FINETUNED_MODEL_PATH (unsloth, CUDA)
+    python inference_server.py --tiny           # крошечная случайная Qwen2 на CPU (проверка батчинга)
+    curl -s localhost:8766/generate -d '{"instruction": "Write a Warhammer 40,000 story.", "max_new_tokens": 200}'
+"""
+
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import torch
+
+import config
+from metrics import Metrics
+from dataset_format import build_prompt
+
+
+class GenerationRequest:
+    """Запрос в очереди батчера; handler ждет done"""
+
+    def __init__(self, prompt: str, max_new_tokens: int, temperature: float, top_p: float):
+        self.prompt = prompt
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.enqueued = time.perf_counter()
+        self.started = None
+        self.batch_size = None
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    @property
+    def key(self) -> tuple:
+        """Запросы с одинаковым ключом генерируются одним вызовом"""
+        # Полоса (2^(k-1), 2^k]: батч генерирует не больше чем вдвое лишних токенов
+        band = (self.max_new_tokens - 1).bit_length()
+        return (self.temperature, self.top_p, band)
+
+
+class DynamicBatcher:
+    """Очередь запросов + поток, который генерирует их батчами"""
+
+    def __init__(self, model, tokenizer, max_batch: int = None, wait_ms: float = None, metrics: Metrics = None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch = max_batch or config.INFERENCE_MAX_BATCH
+        self.wait = (config.INFERENCE_BATCH_WAIT_MS if wait_ms is None else wait_ms) / 1000
+        self.metrics = metrics or Metrics(prefix="inference")
+        self.pending = []
+        self.cond = threading.Condition()
+        self.batches = 0
+        self.requests = 0
+        self.generated_tokens = 0
+        self.generate_seconds = 0.0
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def submit(self, request: GenerationRequest) -> GenerationRequest:
+        """Поставить запрос в очередь и дождаться результата (вызывается из потока handler)"""
+        with self.cond:
+            self.pending.append(request)
+            self.cond.notify()
+        request.done.wait()
+        return request
+
+    def queue_depth(self) -> int:
+        with self.cond:
+            return len(self.pending)
+
+    def _next_batch(self) -> list:
+        with self.cond:
+            while not self.pending:
+                self.cond.wait()
+            # Окно считается от самого старого запроса: после долгой генерации батч уходит сразу
+            deadline = self.pending[0].enqueued + self.wait
+            while True:
+                key = self.pending[0].key
+                batch = [r for r in self.pending if r.key == key][:self.max_batch]
+                remaining = deadline - time.perf_counter()
+                if len(batch) >= self.max_batch or remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            for request in batch:
+                self.pending.remove(request)
+            return batch
+
+    def _generate(self, batch: list):
+        tokenizer = self.tokenizer
+        inputs = tokenizer([r.prompt for r in batch], return_tensors="pt", padding=True,
+                           return_token_type_ids=False).to(self.model.device)
+        first = batch[0]
+        sampling = {"do_sample": True, "temperature": first.temperature, "top_p": first.top_p} \
+            if first.temperature > 0 else {"do_sample": False}
+        with torch.inference_mode():
+            outputs = self.model.generate(
+                **inputs,
+                max_new_tokens=max(r.max_new_tokens for r in batch),
+                pad_token_id=tokenizer.pad_token_id,
+                use_cache=True,
+                **sampling,
+            )
+        new_tokens = outputs[:, inputs["input_ids"].shape[1]:].tolist()
+        results = []
+        for request, tokens in zip(batch, new_tokens):
+            tokens = tokens[:request.max_new_tokens]
+            if tokenizer.eos_token_id in tokens:  # Дальше - паддинг завершившейся строки
+                tokens = tokens[:tokens.index(tokenizer.eos_token_id)]
+            results.append((tokenizer.decode(tokens, skip_special_tokens=True), len(tokens)))
+        return results
+
+    def _run_batch(self, batch: list):
+        start = time.perf_counter()
+        for request in batch:
+            request.started = start
+            request.batch_size = len(batch)
+            self.metrics.observe("queue", start - request.enqueued)
+        self.metrics.gauge("queue_depth", self.queue_depth())
+
+        try:
+            results = self._generate(batch)
+        except Exception:
+            self.metrics.observe("generate", time.perf_counter() - start, ok=False, batch_size=len(batch))
+            raise
+
+        seconds = time.perf_counter() - start
+        tokens = sum(count for _, count in results)
+        self.metrics.observe("generate", seconds, batch_size=len(batch), tokens=tokens)
+        with self.cond:
+            self.batches += 1
+            self.requests += len(batch)
+            self.generated_tokens += tokens
+            self.generate_seconds += seconds
+        for request, result in zip(batch, results):
+            request.result = result
+            self.metrics.observe("request", time.perf_counter() - request.enqueued)
+            request.done.set()
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self._run_batch(batch)
+            except Exception as e:  # OOM и т.п. - ошибка всем запросам батча, сервер работает дальше
+                for request in batch:
+                    if not request.done.is_set():
+                        request.error = f"{type(e).__name__}: {e}"
+                        request.done.set()
+                print(f"[ERROR] Батч из {len(batch)}: {type(e).__name__}: {e}")
+            try:
+                self.metrics.write_prometheus()
+            except OSError as e:  # Полный диск и т.п. не должен останавливать батчер
+                print(f"[WARN] Не удалось записать метрики: {e}")
+
+    def stats(self) -> dict:
+        with self.cond:
+            data = {
+                "queue_depth": len(self.pending),
+                "batches": self.batches,
+                "requests": self.requests,
+                "avg_batch_size": self.requests / self.batches if self.batches else 0.0,
+                "generated_tokens": self.generated_tokens,
+                "tokens_per_sec": self.generated_tokens / self.generate_seconds if self.generate_seconds else 0.0,
+            }
+        data["stages"] = {
+            stage: {"count": s["count"], "errors": s["errors"], "p50": s["p50"], "p95": s["p95"]}
+            for stage, s in self.metrics.summary().items()
+        }
+        return data
+
+
+class InferenceHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    batcher = None  # Задается в run_server
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status: int, data: dict):
+        payload = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(200, {"status": "ok"})
+        elif self.path == "/stats":
+            self.send_json(200, self.batcher.stats())
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path != "/generate":
+            self.send_json(404, {"error": "not found"})
+            return
+        try:
+            data = json.loads(body or b"{}")
+            if not isinstance(data, dict):
+                raise ValueError("expected a JSON object")
+            text = data["prompt"] if "prompt" in data else data["instruction"]
+            if not isinstance(text, str) or not text.strip():
+                raise ValueError("prompt (or instruction) must be a non-empty string")
+            prompt = text if "prompt" in data else build_prompt(text, str(data.get("input", "")))
+            max_new_tokens = int(data.get("max_new_tokens", config.INFERENCE_MAX_NEW_TOKENS))
+            if max_new_tokens < 1:
+                raise ValueError("max_new_tokens must be >= 1")
+            request = GenerationRequest(
+                prompt,
+                max_new_tokens=min(max_new_tokens, config.INFERENCE_MAX_NEW_TOKENS),
+                temperature=float(data.get("temperature", 0.8)),
+                top_p=float(data.get("top_p", 0.95)),
+            )
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json(400, {"error": f"bad request: {e}"})
+            return
+
+        self.batcher.submit(request)
+        if request.error:
+            self.send_json(500, {"error": request.error})
+            return
+        text, tokens = request.result
+        self.send_json(200, {
+            "text": text,
+            "tokens": tokens,
+            "batch_size": request.batch_size,
+            "queue_seconds": round(request.started - request.enqueued, 4),
+            "latency_seconds": round(time.perf_counter() - request.enqueued, 4),
+        })
+
+
+def load_model(path: str = None, tiny: bool = False):
+    """
+    Модель и токенизатор для генерации (left padding для батчей).
+
+    Args:
+        path: Папка дообученной модели (по умолчанию config.FINETUNED_MODEL_PATH)
+        tiny: Случайная tiny Qwen2 с токенизатором config.MODEL_PATH (CPU, проверка сервера)
+    """
+    if tiny:
+        from transformers import AutoTokenizer
+        from smoke_train import tiny_qwen2
+        tokenizer = AutoTokenizer.from_pretrained(config.MODEL_PATH, local_files_only=True)
+        model = tiny_qwen2(tokenizer, max_seq_length=4096)
+    else:
+        from unsloth import FastLanguageModel
+        model, tokenizer = FastLanguageModel.from_pretrained(
+            path or config.FINETUNED_MODEL_PATH,
+            max_seq_length=config.MAX_SEQ_LENGTH,
+            dtype=None,
+            load_in_4bit=True,
+        )
+        FastLanguageModel.for_inference(model)
+    model.eval()
+    tokenizer.padding_side = "left"  # Генерация продолжает последний токен каждой строки
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    return model, tokenizer
+
+
+def run_server(model, tokenizer, host: str = None, port: int = None, max_batch: int = None,
+               wait_ms: float = None) -> ThreadingHTTPServer:
+    """
+    Запуск батчера и HTTP сервера в фоновых потоках.
+
+    Returns:
+        Сервер (server.shutdown() для остановки, батчер - server.batcher)
+    """
+    metrics = Metrics(prefix="inference")
+    metrics.configure(config.METRICS_DIR)
+    batcher = DynamicBatcher(model, tokenizer, max_batch, wait_ms, metrics).start()
+    handler = type("BoundInferenceHandler", (InferenceHandler,), {"batcher": batcher})
+    server = ThreadingHTTPServer((host or config.INFERENCE_HOST, config.INFERENCE_PORT if port is None else port), handler)
+    server.daemon_threads = True
+    server.batcher = batcher
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Warhammer story inference server with dynamic batching")
+    parser.add_argument("--model", default=None, help="Model folder (default: config.FINETUNED_MODEL_PATH)")
+    parser.add_argument("--tiny", action="store_true", help="Random tiny Qwen2 on CPU for testing")
+    parser.add_argument("--host", default=config.INFERENCE_HOST)
+    parser.add_argument("--port", type=int, default=config.INFERENCE_PORT)
+    parser.add_argument("--max-batch", type=int, default=config.INFERENCE_MAX_BATCH)
+    parser.add_argument("--wait-ms", type=float, default=config.INFERENCE_BATCH_WAIT_MS)
+    args = parser.parse_args()
+
+    print("🔧 Загрузка модели...")
+    model, tokenizer = load_model(args.model, args.tiny)
+    server = run_server(model, tokenizer, args.host, args.port, args.max_batch, args.wait_ms)
+    print(f"✅ Сервер генерации: http://{args.host}:{server.server_address[1]} "
+          f"(батч до {args.max_batch}, окно {args.wait_ms:.0f}ms)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(f"\n[STATS] {json.dumps(server.batcher.stats(), ensure_ascii=False)}")
+
+
+if __name__ == "__main__":
+    main()
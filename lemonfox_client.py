@@ -0,0 +1,223 @@
+"""
+Общий HTTP клиент Lemonfox API
+
+- Один requests.Session на процесс: пул keep-alive соединений (без TLS handshake на каждый файл)
+- Кеш DNS проверки с TTL (вместо socket.gethostbyname на каждый вызов)
+- Потоковая multipart загрузка: файл читается блоками, целиком в память не попадает
+- AsyncLemonfoxClient: много загрузок одновременно с ограничением конкурентности
+
+Для локальной проверки: python fake_lemonfox_server.py и
+LEMONFOX_BASE_URL = "http://127.0.0.1:8765" в config.py
+"""
+
+import os
+import time
+import uuid
+import socket
+import asyncio
+import threading
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+from retry_handler import RateLimiter, CircuitBreaker, async_retry_with_backoff
+
+
+TRANSCRIPTIONS_PATH = "/v1/audio/transcriptions"
+CHUNK_SIZE = 256 * 1024
+DNS_TTL = 300  # секунд
+
+# Общие на все воркеры (sync и async): лимит запросов и circuit breaker
+rate_limiter = RateLimiter(config.LEMONFOX_RATE_PER_SEC, capacity=config.LEMONFOX_POOL_SIZE)
+circuit_breaker = CircuitBreaker(config.LEMONFOX_BREAKER_THRESHOLD, config.LEMONFOX_BREAKER_RESET, name="Lemonfox API")
+
+_dns_cache = {}
+_dns_lock = threading.Lock()
+
+
+def check_dns_cached(hostname: str, ttl: float = DNS_TTL) -> bool:
+    """
+    Проверка DNS с кешированием результата на ttl секунд.
+
+    Неудачные проверки не кешируются - следующий вызов проверит снова.
+    """
+    now = time.monotonic()
+    with _dns_lock:
+        cached_at = _dns_cache.get(hostname)
+        if cached_at is not None and now - cached_at < ttl:
+            return True
+
+    try:
+        socket.getaddrinfo(hostname, 443)
+    except socket.gaierror:
+        return False
+
+    with _dns_lock:
+        _dns_cache[hostname] = now
+    return True
+
+
+class MultipartStream:
+    """
+    Тело multipart/form-data, которое отдается блоками.
+
+    requests видит итерируемый объект с атрибутом len: при известном
+    размере ставит Content-Length, при неизвестном (len = None) -
+    шлет Transfer-Encoding: chunked.
+    """
+
+    def __init__(self, fields: dict, file_obj, filename: str, file_size: int = None,
+                 content_type: str = "application/octet-stream"):
+        self.boundary = uuid.uuid4().hex
+        self.file_obj = file_obj
+
+        head = b""
+        for name, value in fields.items():
+            head += (
+                f"--{self.boundary}\r\n"
+                f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+                f"{value}\r\n"
+            ).encode("utf-8")
+        safe_name = filename.replace('"', "")
+        head += (
+            f"--{self.boundary}\r\n"
+            f'Content-Disposition: form-data; name="file"; filename="{safe_name}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n"
+        ).encode("utf-8")
+
+        self.head = head
+        self.tail = f"\r\n--{self.boundary}--\r\n".encode("utf-8")
+        self.len = len(head) + file_size + len(self.tail) if file_size is not None else None
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __iter__(self):
+        yield self.head
+        while True:
+            chunk = self.file_obj.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+        yield self.tail
+
+
+class LemonfoxClient:
+    """
+    Синхронный клиент с пулом соединений. Потокобезопасен
+    (requests.Session + urllib3 пул), один экземпляр на все воркеры.
+    """
+
+    def __init__(self, api_key: str, base_url: str = None, pool_size: int = None,
+                 timeout: tuple = (30, 300)):
+        self.api_key = api_key
+        self.base_url = (base_url or config.LEMONFOX_BASE_URL).rstrip("/")
+        self.hostname = urlparse(self.base_url).hostname
+        self.timeout = timeout
+
+        pool_size = pool_size or config.LEMONFOX_POOL_SIZE
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers["Authorization"] = f"Bearer {api_key}"
+
+    def dns_ok(self) -> bool:
+        return check_dns_cached(self.hostname)
+
+    def transcribe_stream(self, file_obj, filename: str, file_size: int = None,
+                          language: str = "en", response_format: str = "json") -> dict:
+        """
+        Транскрибация из открытого файла / потока байт.
+
+        Args:
+            file_obj: Объект с методом read(n)
+            filename: Имя файла для multipart
+            file_size: Размер в байтах (None - chunked загрузка)
+            language: Язык аудио
+            response_format: "json" или "verbose_json" (с таймкодами сегментов)
+
+        Returns:
+            JSON ответ API
+        """
+        body = MultipartStream(
+            {"language": language, "response_format": response_format},
+            file_obj, filename, file_size
+        )
+        response = self.session.post(
+            f"{self.base_url}{TRANSCRIPTIONS_PATH}",
+            headers={"Content-Type": body.content_type},
+            data=body,
+            timeout=self.timeout
+        )
+
+        if response.status_code == 200:
+            return response.json()
+        else:
+            response.raise_for_status()
+            raise Exception(f"API error: {response.status_code} - {response.text}")
+
+    def transcribe(self, audio_path: str, language: str = "en", response_format: str = "json") -> dict:
+        """Транскрибация файла с потоковой загрузкой"""
+        with open(audio_path, "rb") as audio_file:
+            return self.transcribe_stream(
+                audio_file, os.path.basename(audio_path),
+                os.path.getsize(audio_path), language, response_format
+            )
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncLemonfoxClient:
+    """
+    asyncio вариант: до max_concurrency загрузок одновременно.
+
+    Загрузки выполняются в потоках поверх общего пула соединений
+    LemonfoxClient, event loop не блокируется.
+    """
+
+    def __init__(self, client: LemonfoxClient, max_concurrency: int = None):
+        self.client = client
+        self.max_concurrency = max_concurrency or config.LEMONFOX_ASYNC_CONCURRENCY
+        self._semaphore = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # Семафор создается внутри работающего event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    @async_retry_with_backoff(operation_name="Audio Transcription (async)",
+                              rate_limiter=rate_limiter, circuit_breaker=circuit_breaker)
+    async def transcribe(self, audio_path: str, language: str = "en") -> dict:
+        async with self.semaphore:
+            return await asyncio.to_thread(self.client.transcribe, audio_path, language)
+
+    async def transcribe_many(self, audio_paths: list, language: str = "en") -> list:
+        """
+        Транскрибация списка файлов.
+
+        Returns:
+            Список результатов в том же порядке (dict или Exception)
+        """
+        tasks = [self.transcribe(path, language) for path in audio_paths]
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(api_key: str) -> LemonfoxClient:
+    """Общий клиент на процесс (по одному на API ключ)"""
+    with _clients_lock:
+        client = _clients.get(api_key)
+        if client is None:
+            client = LemonfoxClient(api_key)
+            _clients[api_key] = client
+        return client
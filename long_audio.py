@@ -0,0 +1,189 @@
+"""
+Параллельная транскрибация длинных аудио (многочасовые компиляции)
+
+Аудио режется ffmpeg на сегменты с перекрытием, сегменты транскрибируются
+одновременно, результаты склеиваются по таймкодам:
+из зоны перекрытия берутся фразы того сегмента, к середине которого они ближе.
+Если таймкодов нет - перекрытие убирается по совпадению слов.
+
+Результат каждого сегмента сохраняется на диск, поэтому при повторном
+запуске заново отправляются только упавшие сегменты.
+"""
+
+import os
+import json
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from transcript_cache import file_sha256
+
+
+def ffmpeg_available() -> bool:
+    return shutil.which("ffmpeg") is not None and shutil.which("ffprobe") is not None
+
+
+def probe_duration(audio_path: str):
+    """Длительность аудио в секундах через ffprobe или None"""
+    if not ffmpeg_available():
+        return None
+    try:
+        output = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration",
+             "-of", "default=noprint_wrappers=1:nokey=1", audio_path],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+        return float(output)
+    except (subprocess.CalledProcessError, ValueError):
+        return None
+
+
+def plan_segments(duration: float, segment_sec: float, overlap_sec: float) -> list:
+    """
+    Границы сегментов [(start, end), ...] с перекрытием overlap_sec.
+
+    Последний короткий хвост (меньше перекрытия) присоединяется к предыдущему сегменту.
+    """
+    segments = []
+    start = 0.0
+    step = segment_sec - overlap_sec
+    while start < duration:
+        end = min(start + segment_sec, duration)
+        segments.append((start, end))
+        if end >= duration:
+            break
+        start += step
+
+    if len(segments) > 1 and segments[-1][1] - segments[-1][0] <= overlap_sec:
+        segments.pop()
+        segments[-1] = (segments[-1][0], duration)
+    return segments
+
+
+def cut_segment(audio_path: str, start: float, end: float, output_path: str):
+    """Вырезать сегмент без перекодирования"""
+    subprocess.run(
+        ["ffmpeg", "-v", "error", "-y", "-ss", f"{start:.3f}", "-i", audio_path,
+         "-t", f"{end - start:.3f}", "-vn", "-c", "copy", output_path],
+        check=True
+    )
+
+
+def merge_words(previous: str, current: str, max_overlap_words: int = 80) -> str:
+    """
+    Склейка текстов без таймкодов: убирает самое длинное совпадение
+    конца previous с началом current (до max_overlap_words слов).
+    """
+    prev_words = previous.split()
+    curr_words = current.split()
+    normalize = lambda words: [w.strip('.,!?;:"\'').lower() for w in words]
+    prev_norm = normalize(prev_words[-max_overlap_words:])
+    curr_norm = normalize(curr_words[:max_overlap_words])
+
+    for size in range(min(len(prev_norm), len(curr_norm)), 0, -1):
+        if prev_norm[-size:] == curr_norm[:size]:
+            curr_words = curr_words[size:]
+            break
+
+    return " ".join(prev_words + curr_words)
+
+
+def stitch_results(parts: list, overlap_sec: float) -> dict:
+    """
+    Склейка результатов сегментов.
+
+    Args:
+        parts: [(start, end, result), ...] по порядку
+        overlap_sec: Длина перекрытия
+
+    Returns:
+        Ответ в формате Lemonfox: text, segments (таймкоды от начала файла), duration
+    """
+    if all(result.get('segments') for _, _, result in parts):
+        stitched = []
+        for index, (start, end, result) in enumerate(parts):
+            # Середина зоны перекрытия - граница между соседними сегментами
+            low = start + overlap_sec / 2 if index > 0 else float('-inf')
+            high = end - overlap_sec / 2 if index < len(parts) - 1 else float('inf')
+            for segment in result['segments']:
+                seg_start = start + segment.get('start', 0.0)
+                seg_end = start + segment.get('end', 0.0)
+                middle = (seg_start + seg_end) / 2
+                if low <= middle < high:
+                    stitched.append(dict(segment, id=len(stitched), start=seg_start, end=seg_end))
+
+        text = " ".join(seg.get('text', '').strip() for seg in stitched).strip()
+        return {'text': text, 'segments': stitched, 'duration': parts[-1][1]}
+
+    text = ""
+    for _, _, result in parts:
+        text = merge_words(text, result.get('text', '')) if text else result.get('text', '')
+    return {'text': text, 'duration': parts[-1][1]}
+
+
+def transcribe_long_audio(audio_path: str, transcribe_segment, duration: float = None,
+                          segment_sec: float = None, overlap_sec: float = None,
+                          workers: int = None) -> dict:
+    """
+    Транскрибация длинного аудио по сегментам.
+
+    Args:
+        audio_path: Путь к аудио
+        transcribe_segment: Функция(path) -> dict ответа API (со своим retry)
+        duration: Длительность (None - ffprobe)
+        segment_sec / overlap_sec / workers: По умолчанию из config
+
+    Returns:
+        Склеенный ответ в формате Lemonfox
+    """
+    segment_sec = segment_sec or config.LONG_AUDIO_SEGMENT_SEC
+    overlap_sec = overlap_sec if overlap_sec is not None else config.LONG_AUDIO_OVERLAP_SEC
+    workers = workers or config.LONG_AUDIO_WORKERS
+    duration = duration or probe_duration(audio_path)
+    if duration is None:
+        raise Exception("Cannot determine audio duration (ffprobe)")
+
+    # Рабочая папка по хешу аудио - сегменты и их результаты переживают перезапуск
+    work_dir = os.path.join(config.TEMP_DIR, "segments", file_sha256(audio_path)[:16])
+    os.makedirs(work_dir, exist_ok=True)
+    ext = os.path.splitext(audio_path)[1] or ".mp4"
+    plan = plan_segments(duration, segment_sec, overlap_sec)
+
+    print(f"[LONG] {duration / 60:.0f} мин -> {len(plan)} сегментов по {segment_sec / 60:.0f} мин "
+          f"(перекрытие {overlap_sec:.0f}с, потоков {workers})")
+
+    def run(index):
+        start, end = plan[index]
+        result_path = os.path.join(work_dir, f"seg_{index:04d}.json")
+        if os.path.exists(result_path):
+            with open(result_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+
+        segment_path = os.path.join(work_dir, f"seg_{index:04d}{ext}")
+        cut_segment(audio_path, start, end, segment_path)
+        result = transcribe_segment(segment_path)
+
+        with open(result_path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False)
+        os.remove(segment_path)
+        print(f"[LONG] Сегмент {index + 1}/{len(plan)} готов")
+        return result
+
+    results = [None] * len(plan)
+    errors = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run, index): index for index in range(len(plan))}
+        for future, index in futures.items():
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                errors.append((index, e))
+
+    if errors:
+        failed = ", ".join(str(index + 1) for index, _ in errors)
+        raise Exception(f"{len(errors)}/{len(plan)} segments failed ({failed}): {errors[0][1]}")
+
+    stitched = stitch_results([(start, end, result) for (start, end), result in zip(plan, results)], overlap_sec)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    return stitched
@@ -0,0 +1,173 @@
+"""
+Детектор зацикливания длинной генерации (n-граммы, инкрементально)
+
+На 12000 новых токенов модель, попавшая в петлю повторов, минутами
+генерирует мусор - раньше генерацию останавливал только лимит токенов.
+
+- LoopDetector - состояние по каждой строке батча, O(1) на токен:
+  n-грамма из LOOP_NGRAM последних токенов считается повтором, если
+  встречалась не дальше LOOP_LOOKBACK токенов назад. Доля повторов в
+  скользящем окне LOOP_WINDOW токенов - мера зацикливания (в обычном
+  тексте повтор 8 токенов подряд редкость, в петле - каждый токен)
+- LoopStoppingCriteria - остановка при доле >= LOOP_STOP_RATIO
+- AdaptiveRepetitionPenalty (LOOP_PENALTY) - с доли LOOP_STEER_RATIO штрафует
+  токен, который продолжил бы повторяющуюся n-грамму; штраф растет с долей
+  повторов до LOOP_MAX_PENALTY (как repetition_penalty HF, но только для
+  продолжения петли, а не для всех встречавшихся токенов)
+- report() - сколько токенов сэкономлено остановкой, сколько раз был штраф,
+  накладные расходы на токен
+
+Использование (см. generate.py):
+    detector = LoopDetector(prompt_length=inputs["input_ids"].shape[1])
+    model.generate(..., **detector.generate_kwargs())
+    detector.report(max_new_tokens)
+"""
+
+import time
+from collections import deque
+
+import torch
+from transformers import LogitsProcessor, LogitsProcessorList, StoppingCriteria, StoppingCriteriaList
+
+import config
+
+
+class _RowState:
+    """Состояние одной строки батча (только сгенерированные токены)"""
+
+    __slots__ = ("tokens", "last_seen", "next_token", "hits", "hit_count", "loop_at", "max_ratio", "steered")
+
+    def __init__(self, window: int):
+        self.tokens = []
+        self.last_seen = {}  # n-грамма -> позиция ее конца
+        self.next_token = {}  # (n-1)-грамма -> токен, который шел за ней последним
+        self.hits = deque(maxlen=window)
+        self.hit_count = 0
+        self.loop_at = None  # Токен, на котором обнаружена петля
+        self.max_ratio = 0.0
+        self.steered = 0
+
+
+class LoopDetector:
+    """Инкрементальная доля повторяющихся n-грамм по строкам батча"""
+
+    def __init__(self, prompt_length: int, ngram: int = None, window: int = None, lookback: int = None,
+                 stop_ratio: float = None, steer_ratio: float = None, max_penalty: float = None):
+        """
+        Args:
+            prompt_length: Длина промпта (input_ids.shape[1]) - его токены не анализируются
+            Остальное - по умолчанию из config.LOOP_*
+        """
+        self.seen = prompt_length
+        self.ngram = ngram or config.LOOP_NGRAM
+        self.window = window or config.LOOP_WINDOW
+        self.lookback = lookback or config.LOOP_LOOKBACK
+        self.stop_ratio = stop_ratio or config.LOOP_STOP_RATIO
+        self.steer_ratio = steer_ratio or config.LOOP_STEER_RATIO
+        self.max_penalty = max_penalty or config.LOOP_MAX_PENALTY
+        self.rows = None
+        self.seconds = 0.0
+
+    def _push(self, row: _RowState, token: int):
+        tokens = row.tokens
+        tokens.append(token)
+        position = len(tokens)
+        hit = False
+        if position >= self.ngram:
+            gram = tuple(tokens[-self.ngram:])
+            previous = row.last_seen.get(gram)
+            hit = previous is not None and position - previous <= self.lookback
+            row.last_seen[gram] = position
+            row.next_token[gram[:-1]] = token
+        if len(row.hits) == self.window:
+            row.hit_count -= row.hits[0]
+        row.hits.append(hit)
+        row.hit_count += hit
+
+        # Делим на все окно: первые токены истории не дают ложной доли 1.0
+        ratio = row.hit_count / self.window
+        row.max_ratio = max(row.max_ratio, ratio)
+        if row.loop_at is None and ratio >= self.stop_ratio:
+            row.loop_at = position
+
+    def update(self, input_ids: torch.Tensor):
+        """Учесть новые токены (вызывается из processor и criteria; повторный вызов - no-op)"""
+        start = time.perf_counter()
+        if self.rows is None:
+            self.rows = [_RowState(self.window) for _ in range(input_ids.shape[0])]
+        if input_ids.shape[1] > self.seen:
+            for row, tokens in zip(self.rows, input_ids[:, self.seen:].tolist()):
+                for token in tokens:
+                    self._push(row, token)
+            self.seen = input_ids.shape[1]
+        self.seconds += time.perf_counter() - start
+
+    def ratio(self, index: int = 0) -> float:
+        return self.rows[index].hit_count / self.window if self.rows else 0.0
+
+    def continuation(self, index: int = 0):
+        """Токен, который продолжит уже встречавшуюся n-грамму (или None)"""
+        row = self.rows[index]
+        if len(row.tokens) < self.ngram - 1:
+            return None
+        return row.next_token.get(tuple(row.tokens[-(self.ngram - 1):]))
+
+    def generate_kwargs(self, penalty: bool = None) -> dict:
+        """stopping_criteria (+ logits_processor при LOOP_PENALTY) для model.generate"""
+        penalty = config.LOOP_PENALTY if penalty is None else penalty
+        kwargs = {"stopping_criteria": StoppingCriteriaList([LoopStoppingCriteria(self)])}
+        if penalty:
+            kwargs["logits_processor"] = LogitsProcessorList([AdaptiveRepetitionPenalty(self)])
+        return kwargs
+
+    def report(self, max_new_tokens: int, index: int = 0) -> dict:
+        """Итог по строке: петля, сэкономленные токены, штрафы, накладные расходы"""
+        row = self.rows[index] if self.rows else _RowState(self.window)
+        generated = len(row.tokens)
+        total_tokens = sum(len(r.tokens) for r in self.rows or [])
+        return {
+            "generated_tokens": generated,
+            "loop_detected": row.loop_at is not None,
+            "loop_at": row.loop_at,
+            "saved_tokens": max_new_tokens - generated if row.loop_at is not None else 0,
+            "steered": row.steered,
+            "max_repeat_ratio": round(row.max_ratio, 3),
+            "overhead_us_per_token": self.seconds / total_tokens * 1e6 if total_tokens else 0.0,
+        }
+
+
+class LoopStoppingCriteria(StoppingCriteria):
+    """Остановить строку, в которой доля повторов достигла LOOP_STOP_RATIO"""
+
+    def __init__(self, detector: LoopDetector):
+        self.detector = detector
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        self.detector.update(input_ids)
+        return torch.tensor([row.loop_at is not None for row in self.detector.rows],
+                            dtype=torch.bool, device=input_ids.device)
+
+
+class AdaptiveRepetitionPenalty(LogitsProcessor):
+    """Штраф продолжения петли, растущий с долей повторов (до остановки)"""
+
+    def __init__(self, detector: LoopDetector):
+        self.detector = detector
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        detector = self.detector
+        detector.update(input_ids)
+        for index, row in enumerate(detector.rows):
+            ratio = row.hit_count / detector.window
+            if ratio <= detector.steer_ratio:
+                continue
+            token = detector.continuation(index)
+            if token is None:
+                continue
+            strength = min(1.0, (ratio - detector.steer_ratio) / (detector.stop_ratio - detector.steer_ratio))
+            penalty = 1.0 + (detector.max_penalty - 1.0) * strength
+            score = scores[index, token]
+            # Как RepetitionPenaltyLogitsProcessor: отрицательный логит умножается, положительный делится
+            scores[index, token] = score * penalty if score < 0 else score / penalty
+            row.steered += 1
+        return scores
@@ -0,0 +1,150 @@
+"""
+Метрики транскрибера: таймеры стадий, счетчики, gauge
+
+- Каждое событие пишется строкой JSON в METRICS_DIR/transcriber_events.jsonl
+- Снимок в формате Prometheus (text exposition) - METRICS_DIR/transcriber.prom
+- summary() - p50/p95 по стадиям для отчета в конце запуска
+
+Использование:
+    with metrics.timer("download", row=5) as fields:
+        ...
+        fields["bytes"] = size
+"""
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+def percentile(values: list, q: float) -> float:
+    """Перцентиль (линейная интерполяция), q от 0 до 1"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def prom_label(value) -> str:
+    """Значение метки Prometheus: экранирование \\, " и перевода строки"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """Потокобезопасный сборщик метрик (воркеры конвейера пишут одновременно)"""
+
+    def __init__(self, prefix: str = "transcriber"):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.events_lock = threading.Lock()  # Только запись в events_path: диск не держит self.lock
+        self.durations = {}  # stage -> [seconds]
+        self.errors = {}  # stage -> count
+        self.totals = {}  # stage -> {field: sum} для числовых полей (bytes, audio_seconds)
+        self.counters = {}
+        self.gauges = {}
+        self.events_path = None
+        self.prom_path = None
+        self.extra_prom = None  # функция -> список строк (например, счетчики retry)
+
+    def configure(self, metrics_dir: str, extra_prom=None):
+        """Включить запись событий и Prometheus файла в metrics_dir"""
+        os.makedirs(metrics_dir, exist_ok=True)
+        self.events_path = os.path.join(metrics_dir, f"{self.prefix}_events.jsonl")
+        self.prom_path = os.path.join(metrics_dir, f"{self.prefix}.prom")
+        self.extra_prom = extra_prom
+
+    def _event(self, data: dict):
+        if not self.events_path:
+            return
+        line = json.dumps({"ts": round(time.time(), 3), **data}, ensure_ascii=False, default=str) + "\n"
+        with self.events_lock:
+            with open(self.events_path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def observe(self, stage: str, seconds: float, ok: bool = True, **fields):
+        with self.lock:
+            self.durations.setdefault(stage, []).append(seconds)
+            if not ok:
+                self.errors[stage] = self.errors.get(stage, 0) + 1
+            totals = self.totals.setdefault(stage, {})
+            for key, value in fields.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool) and key != "row":
+                    totals[key] = totals.get(key, 0) + value
+        self._event({"type": "timing", "stage": stage, "seconds": round(seconds, 4), "ok": ok, **fields})
+
+    @contextmanager
+    def timer(self, stage: str, **fields):
+        """Таймер стадии; в yield-словарь можно дописать поля (bytes, audio_seconds...)"""
+        start = time.perf_counter()
+        ok = True
+        try:
+            yield fields
+        except BaseException:
+            ok = False
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - start, ok, **fields)
+
+    def incr(self, name: str, value: int = 1):
+        with self.lock:
+            self.counters[name] = total = self.counters.get(name, 0) + value
+        self._event({"type": "counter", "name": name, "value": total})
+
+    def gauge(self, name: str, value: float):
+        with self.lock:
+            self.gauges[name] = value
+        self._event({"type": "gauge", "name": name, "value": value})
+
+    def summary(self) -> dict:
+        """{stage: {count, errors, p50, p95, total, <суммы полей>}}"""
+        with self.lock:
+            return {
+                stage: {
+                    "count": len(values),
+                    "errors": self.errors.get(stage, 0),
+                    "p50": percentile(values, 0.5),
+                    "p95": percentile(values, 0.95),
+                    "total": sum(values),
+                    **self.totals.get(stage, {}),
+                }
+                for stage, values in self.durations.items()
+            }
+
+    def write_prometheus(self):
+        """Снимок всех метрик в Prometheus text format (атомарная запись)"""
+        if not self.prom_path:
+            return
+
+        p = self.prefix
+        lines = [f"# TYPE {p}_stage_seconds summary"]
+        for stage, data in self.summary().items():
+            stage = prom_label(stage)
+            lines.append(f'{p}_stage_seconds{{stage="{stage}",quantile="0.5"}} {data["p50"]:.6f}')
+            lines.append(f'{p}_stage_seconds{{stage="{stage}",quantile="0.95"}} {data["p95"]:.6f}')
+            lines.append(f'{p}_stage_seconds_sum{{stage="{stage}"}} {data["total"]:.6f}')
+            lines.append(f'{p}_stage_seconds_count{{stage="{stage}"}} {data["count"]}')
+            lines.append(f'{p}_stage_errors_total{{stage="{stage}"}} {data["errors"]}')
+
+        with self.lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+        lines.append(f"# TYPE {p}_events_total counter")
+        lines += [f'{p}_events_total{{name="{prom_label(name)}"}} {value}' for name, value in counters.items()]
+        lines.append(f"# TYPE {p}_gauge gauge")
+        lines += [f'{p}_gauge{{name="{prom_label(name)}"}} {value}' for name, value in gauges.items()]
+        if self.extra_prom:
+            lines += self.extra_prom()
+
+        # Свой tmp у каждого потока: одновременные снимки не пишут в один файл
+        tmp_path = f"{self.prom_path}.tmp.{threading.get_ident()}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.prom_path)
+
+
+# Общий сборщик для транскрибера
+metrics = Metrics()
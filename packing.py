@@ -0,0 +1,213 @@
+"""
+Упаковка примеров в последовательности полной длины (packing)
+
+- pack_lengths: best-fit decreasing - примеры по убыванию длины кладутся
+  в самый заполненный бин, куда они помещаются (O(n log n))
+- PackedDataset: ленивая склейка токенизированных примеров по бинам;
+  position_ids начинаются с 0 у каждого примера, первый токен примера без loss
+- PackedCollator: без attention_mask - flash attention по сбросам position_ids
+  разделяет примеры (varlen); block_mask=True - явная 4D блочно-диагональная
+  маска для eager/sdpa (CPU, tiny модель; включается и автоматически,
+  если у модели не flash_attention_2 - см. trainer_setup.check_packing_attention)
+- padding_report: доля паддинга и реальных токенов на шаг с packing и без
+
+Отчет без GPU:
+    python packing.py
+"""
+
+import bisect
+
+from dataset_format import IGNORE_INDEX
+
+
+def pack_lengths(lengths: list, max_len: int) -> list:
+    """
+    Разбиение примеров по бинам емкостью max_len.
+
+    Args:
+        lengths: Длины примеров (в токенах)
+        max_len: Емкость бина (max_seq_length)
+
+    Returns:
+        Список бинов - списков индексов примеров
+    """
+    bins = []
+    free = []  # Отсортированные (свободно, номер бина)
+
+    for index in sorted(range(len(lengths)), key=lambda i: -lengths[i]):
+        length = min(lengths[index], max_len)
+        position = bisect.bisect_left(free, (length, -1))
+        if position < len(free):
+            space, bin_id = free.pop(position)
+        else:
+            space, bin_id = max_len, len(bins)
+            bins.append([])
+        bins[bin_id].append(index)
+        if space - length > 0:
+            bisect.insort(free, (space - length, bin_id))
+
+    return bins
+
+
+def padded_slots(lengths: list, batch_size: int, pad_to_multiple_of: int = 8) -> int:
+    """Токенов с паддингом при батчах в исходном порядке (как PadCollator)"""
+    total = 0
+    for start in range(0, len(lengths), batch_size):
+        batch = lengths[start:start + batch_size]
+        longest = -(-max(batch) // pad_to_multiple_of) * pad_to_multiple_of
+        total += longest * len(batch)
+    return total
+
+
+def padding_report(lengths: list, max_len: int, batch_size: int, grad_accum: int = 1) -> dict:
+    """
+    Сравнение паддинга без packing и с packing.
+
+    Returns:
+        Словарь со слотами, долей паддинга, последовательностями и реальными токенами на шаг
+    """
+    lengths = [min(n, max_len) for n in lengths]
+    real = sum(lengths)
+    bins = pack_lengths(lengths, max_len)
+    sequences_per_step = batch_size * grad_accum
+
+    plain_slots = padded_slots(lengths, batch_size)
+    packed_slots = len(bins) * max_len
+
+    report = {
+        "examples": len(lengths),
+        "real_tokens": real,
+        "max_len": max_len,
+        "plain": {
+            "sequences": len(lengths),
+            "slots": plain_slots,
+            "padding_ratio": 1 - real / plain_slots if plain_slots else 0.0,
+            "real_tokens_per_step": real / len(lengths) * sequences_per_step if lengths else 0.0,
+            "steps_per_epoch": -(-len(lengths) // sequences_per_step),
+        },
+        "packed": {
+            "sequences": len(bins),
+            "slots": packed_slots,
+            "padding_ratio": 1 - real / packed_slots if packed_slots else 0.0,
+            "real_tokens_per_step": real / len(bins) * sequences_per_step if bins else 0.0,
+            "steps_per_epoch": -(-len(bins) // sequences_per_step),
+        },
+    }
+    plain_rate = report["plain"]["real_tokens_per_step"]
+    report["tokens_per_step_gain"] = report["packed"]["real_tokens_per_step"] / plain_rate if plain_rate else 0.0
+    return report
+
+
+def print_padding_report(report: dict):
+    print("=" * 60)
+    print(f"Примеров: {report['examples']} | реальных токенов: {report['real_tokens']:,} | "
+          f"max_len: {report['max_len']:,}")
+    for name in ("plain", "packed"):
+        data = report[name]
+        print(f"{name:>7}: {data['sequences']} посл. | паддинг {data['padding_ratio']:.1%} | "
+              f"{data['real_tokens_per_step']:,.0f} токенов/шаг | {data['steps_per_epoch']} шагов/эпоха")
+    print(f"Выигрыш токенов на шаг: x{report['tokens_per_step_gain']:.2f}")
+    print("=" * 60)
+
+
+class PackedDataset:
+    """
+    Упакованный датасет поверх токенизированного (без копирования на диск).
+
+    Элемент: input_ids, labels, position_ids (с 0 у каждого примера), seq_lengths.
+    """
+
+    def __init__(self, dataset, max_len: int):
+        self.dataset = dataset
+        self.max_len = max_len
+        self.lengths = [min(len(ids), max_len) for ids in dataset["input_ids"]]
+        self.bins = pack_lengths(self.lengths, max_len)
+
+    def __len__(self) -> int:
+        return len(self.bins)
+
+    def __getitem__(self, index: int) -> dict:
+        input_ids, labels, position_ids, seq_lengths = [], [], [], []
+        for example_index in self.bins[index]:
+            example = self.dataset[example_index]
+            length = self.lengths[example_index]
+            example_labels = list(example["labels"][:length])
+            example_labels[0] = IGNORE_INDEX  # Нет предсказания через границу примеров
+            input_ids += list(example["input_ids"][:length])
+            labels += example_labels
+            position_ids += range(length)
+            seq_lengths.append(length)
+        return {"input_ids": input_ids, "labels": labels,
+                "position_ids": position_ids, "seq_lengths": seq_lengths}
+
+
+def block_causal_mask(seq_lengths: list, total: int, dtype=None):
+    """4D маска (1, 1, total, total): причинная внутри примера, запрет между примерами и на паддинг"""
+    import torch
+
+    dtype = dtype or torch.float32
+    allowed = torch.zeros(total, total, dtype=torch.bool)
+    start = 0
+    for length in seq_lengths:
+        end = start + length
+        allowed[start:end, start:end] = torch.ones(length, length, dtype=torch.bool).tril()
+        start = end
+    # Паддинг смотрит только на себя (иначе строки из -inf дают NaN)
+    for i in range(start, total):
+        allowed[i, i] = True
+
+    mask = torch.zeros(total, total, dtype=dtype)
+    mask.masked_fill_(~allowed, torch.finfo(dtype).min)
+    return mask[None, None]
+
+
+class PackedCollator:
+    """Паддинг упакованных последовательностей до общей длины батча"""
+
+    def __init__(self, tokenizer, block_mask: bool = False, dtype=None):
+        self.pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+        self.block_mask = block_mask
+        self.dtype = dtype
+
+    def __call__(self, features: list) -> dict:
+        import torch
+
+        length = max(len(f["input_ids"]) for f in features)
+        batch = {"input_ids": [], "labels": [], "position_ids": []}
+        masks = []
+        for f in features:
+            pad = length - len(f["input_ids"])
+            batch["input_ids"].append(list(f["input_ids"]) + [self.pad_token_id] * pad)
+            batch["labels"].append(list(f["labels"]) + [IGNORE_INDEX] * pad)
+            # Паддинг - отдельный "пример" со своими position_ids
+            batch["position_ids"].append(list(f["position_ids"]) + list(range(pad)))
+            if self.block_mask:
+                masks.append(block_causal_mask(f["seq_lengths"], length, self.dtype))
+
+        batch = {key: torch.tensor(value, dtype=torch.long) for key, value in batch.items()}
+        if self.block_mask:
+            batch["attention_mask"] = torch.cat(masks)
+        return batch
+
+
+def main():
+    import argparse
+    from transformers import AutoTokenizer
+
+    import config
+    from dataset_format import load_tokenized
+
+    parser = argparse.ArgumentParser(description="Padding report: packing vs plain batches")
+    parser.add_argument("--max-seq-length", type=int, default=config.MAX_SEQ_LENGTH)
+    parser.add_argument("--batch-size", type=int, default=2)
+    parser.add_argument("--grad-accum", type=int, default=4)
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(config.MODEL_PATH, local_files_only=True)
+    dataset = load_tokenized(tokenizer, args.max_seq_length)
+    lengths = [len(ids) for ids in dataset["input_ids"]]
+    print_padding_report(padding_report(lengths, args.max_seq_length, args.batch_size, args.grad_accum))
+
+
+if __name__ == "__main__":
+    main()
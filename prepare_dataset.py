@@ -1,41 +1,403 @@
-import json
+"""
+Инкрементальная сборка датасета из транскрипций
+
+- Манифест (размер, mtime, sha256) в dataset_cache/manifest.json:
+  неизмененные файлы не перечитываются
+- Новые/измененные файлы обрабатываются параллельно в процессах
+- Примеры каждого файла - Arrow шард dataset_cache/shards/<sha256>.<режим>.arrow
+  (без промежуточного dataset.jsonl), неизмененные шарды переиспользуются
+- Итоговый датасет: warhammer_dataset/ (load_from_disk)
+- Если есть dataset_cache/dedup.json (dedup.py) - дубликаты файлов
+  исключаются, повторяющиеся абзацы вырезаются до построения примеров
+
+Режимы:
+- split   - первые 500 символов - промпт, остальное - ответ (хвост режется тренером)
+- windows - история режется на окна по токенам под контекст обучения
+  с перекрытием; каждое окно получает в промпт предшествующий контекст,
+  поэтому обучение идет на всех токенах корпуса
+
+Использование:
+    python dedup.py                        # (опционально) поиск дубликатов
+    python prepare_dataset.py              # Инкрементально
+    python prepare_dataset.py --full       # Пересобрать все шарды
+    python prepare_dataset.py --workers 8
+    python prepare_dataset.py --mode windows --overlap 256 --context 512
+    python prepare_dataset.py --tokenize   # + кеш токенизированного датасета для обучения
+    python prepare_dataset.py --export-corpus   # + token_corpus/ (memmap uint32, token_corpus.py)
+"""
+
 import os
-from datasets import Dataset
+import json
+import hashlib
+import argparse
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+import pyarrow as pa
+from datasets import Dataset, concatenate_datasets
+
 import config
+from dataset_format import build_prompt
+from dedup import load_decisions, decision_tag, apply_decision
+from profile_corpus import pick_max_seq_length
+
+
+DATASET_DIR = "warhammer_dataset"
+CACHE_DIR = "dataset_cache"
+SHARDS_DIR = os.path.join(CACHE_DIR, "shards")
+MANIFEST_PATH = os.path.join(CACHE_DIR, "manifest.json")
+
+# Меняется при изменении логики build_examples - старые шарды становятся недействительны
+BUILDER_VERSION = "split-500-v1"
+WINDOWS_VERSION = "windows-v2"
+
+# Запас на расхождение длины при повторной токенизации текста окна
+WINDOW_MARGIN_TOKENS = 16
+
+CONTINUE_INSTRUCTION = "Write a continuation of a Warhammer 40,000 story."
+BEGIN_INSTRUCTION = "Write a Warhammer 40,000 story."
+CONTINUE_SUFFIX = "\nContinue this Warhammer 40,000 story:"
+
+SCHEMA = pa.schema([
+    ("instruction", pa.string()),
+    ("input", pa.string()),
+    ("output", pa.string()),
+])
+
+_tokenizer = None
+
+
+def build_examples(story: str) -> list:
+    """Примеры из одной истории: начало - prompt, продолжение - completion"""
+    # Split into prompt (beginning) and completion (continuation)
+    if len(story) <= 1000:  # Only long stories
+        return []
+    prompt = story[:500] + CONTINUE_SUFFIX
+    completion = story[500:]
+    return [{
+        "instruction": CONTINUE_INSTRUCTION,
+        "input": prompt,
+        "output": completion
+    }]
+
+
+def window_starts(total: int, window: int, overlap: int) -> list:
+    """
+    Начала окон с шагом window - overlap.
+
+    Окно берется, только если дает новые токены сверх перекрытия с предыдущим;
+    последнее окно - более короткий хвост на следующем шаге (не сдвигается назад
+    к концу истории, иначе почти повторяет предыдущее окно).
+    """
+    if total <= window:
+        return [0]
+    stride = max(1, window - overlap)
+    return list(range(0, total - overlap, stride))
+
+
+def build_window_examples(story: str, tokenizer, max_seq_length: int,
+                          overlap: int, context: int) -> tuple[list, dict]:
+    """
+    Примеры-окна по токенам из одной истории.
+
+    Текст окна и контекста режется по offsets токенизатора (без decode),
+    поэтому символы не ломаются на границах.
+
+    Returns:
+        Tuple (examples, stats) - stats: story_tokens, window_tokens, duplicate_tokens, example_tokens
+    """
+    stats = {"story_tokens": 0, "window_tokens": 0, "duplicate_tokens": 0, "example_tokens": 0}
+    if len(story) <= 1000:  # Only long stories
+        return [], stats
+
+    offsets = tokenizer(story, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+    total = len(offsets)
+    stats["story_tokens"] = total
+
+    # Промпт занимает шаблон + контекст, ответ - окно + EOS
+    overhead = len(tokenizer(build_prompt(CONTINUE_INSTRUCTION, CONTINUE_SUFFIX), add_special_tokens=False)["input_ids"])
+    window = max_seq_length - overhead - context - 1 - WINDOW_MARGIN_TOKENS
+    if window <= overlap:
+        raise ValueError(f"max_seq_length {max_seq_length} too small for context {context} and overlap {overlap}")
+
+    examples = []
+    previous_end = 0
+    for start in window_starts(total, window, overlap):
+        end = min(start + window, total)
+        output = story[offsets[start][0]:offsets[end - 1][1]]
+        if start == 0:
+            instruction, input_text = BEGIN_INSTRUCTION, ""
+        else:
+            context_start = max(0, start - context)
+            instruction = CONTINUE_INSTRUCTION
+            input_text = story[offsets[context_start][0]:offsets[start][0]].strip() + CONTINUE_SUFFIX
+
+        prompt_tokens = len(tokenizer(build_prompt(instruction, input_text), add_special_tokens=False)["input_ids"])
+        stats["window_tokens"] += end - start
+        stats["duplicate_tokens"] += min(previous_end - start, end - start) if examples else 0
+        previous_end = end
+        stats["example_tokens"] += min(prompt_tokens + end - start + 1, max_seq_length)
+        examples.append({"instruction": instruction, "input": input_text, "output": output})
+
+    return examples, stats
+
+
+def _init_worker(options: dict):
+    """Загрузка токенизатора в процессе пула (только для режима windows)"""
+    global _tokenizer
+    if options["mode"] == "windows":
+        from transformers import AutoTokenizer
+        _tokenizer = AutoTokenizer.from_pretrained(config.MODEL_PATH, local_files_only=True)
+
+
+def process_file(path: str, decision, options: dict) -> tuple[str, str, list, dict]:
+    """
+    Чтение и обработка одного файла (выполняется в процессе пула).
+
+    Args:
+        path: Файл транскрипции
+        decision: Решение dedup - "drop", вырезаемые абзацы или None
+
+    Returns:
+        Tuple (path, sha256, examples, stats)
+    """
+    with open(path, "rb") as f:
+        raw = f.read()
+    sha = hashlib.sha256(raw).hexdigest()
+    story = apply_decision(raw.decode("utf-8").strip(), decision, sha, os.path.basename(path))
+
+    if story is None:
+        examples, stats = [], {}
+    elif options["mode"] == "windows":
+        examples, stats = build_window_examples(
+            story, _tokenizer, options["max_seq_length"], options["overlap"], options["context"])
+    else:
+        examples, stats = build_examples(story), {}
+    return path, sha, examples, stats
+
+
+def builder_key(options: dict) -> str:
+    """Версия сборщика + параметры режима (ключ шардов и манифеста)"""
+    if options["mode"] != "windows":
+        return BUILDER_VERSION
+    from transformers import AutoTokenizer
+    from dataset_format import tokenizer_hash
+
+    tokenizer = AutoTokenizer.from_pretrained(config.MODEL_PATH, local_files_only=True)
+    return (f"{WINDOWS_VERSION}-{tokenizer_hash(tokenizer)}"
+            f"-{options['max_seq_length']}-{options['overlap']}-{options['context']}")
+
+
+def shard_path(sha: str, key: str = BUILDER_VERSION, dedup: str = "") -> str:
+    name = f"{sha}-{dedup}" if dedup else sha
+    return os.path.join(SHARDS_DIR, f"{name}.{key}.arrow")
+
+
+def write_shard(path: str, examples: list):
+    """Запись примеров в Arrow stream файл (формат Dataset.from_file)"""
+    table = pa.Table.from_pylist(examples, schema=SCHEMA)
+    tmp_path = f"{path}.tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_stream(sink, SCHEMA) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+
+def load_manifest(key: str = BUILDER_VERSION) -> dict:
+    try:
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("builder_version") != key:
+        return {}
+    return manifest.get("files", {})
+
+
+def save_manifest(files: dict, key: str = BUILDER_VERSION, window_seq_length: int = None):
+    tmp_path = f"{MANIFEST_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"builder_version": key, "window_seq_length": window_seq_length, "files": files},
+                  f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+def window_seq_length() -> int:
+    """max_seq_length, под который нарезаны окна текущего датасета (None - режим split)"""
+    try:
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            return json.load(f).get("window_seq_length")
+    except (OSError, ValueError):
+        return None
+
+
+def build_dataset(txt_folder: str, workers: int = None, full: bool = False,
+                  options: dict = None, decisions: dict = None) -> tuple[Dataset, dict]:
+    """
+    Инкрементальная сборка датасета.
+
+    Args:
+        txt_folder: Папка с транскрипциями .txt
+        workers: Процессов для чтения (None - по числу CPU)
+        full: Игнорировать манифест и пересобрать все шарды
+        options: mode (split/windows), max_seq_length, overlap, context
+        decisions: Решения dedup по именам файлов (dedup.load_decisions)
+
+    Returns:
+        Tuple (Dataset, записи манифеста по файлам)
+    """
+    options = options or {"mode": "split"}
+    decisions = decisions or {}
+    key = builder_key(options)
+    os.makedirs(SHARDS_DIR, exist_ok=True)
+    manifest = {} if full else load_manifest(key)
+
+    names = sorted(f for f in os.listdir(txt_folder) if f.endswith(".txt"))
+    files = {}
+    to_process = []
+
+    for name in names:
+        path = os.path.join(txt_folder, name)
+        stat = os.stat(path)
+        entry = manifest.get(name)
+        tag = decision_tag(decisions.get(name))
+        # Размер, mtime и решение dedup не изменились - файл не читаем
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime \
+                and entry.get("dedup", "") == tag \
+                and (entry["examples"] == 0 or os.path.exists(shard_path(entry["sha256"], key, tag))):
+            files[name] = entry
+        else:
+            to_process.append(path)
+
+    print(f"Files: {len(names)} | unchanged: {len(files)} | to process: {len(to_process)}")
+
+    if to_process:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(options,)) as pool:
+            file_decisions = [decisions.get(os.path.basename(path)) for path in to_process]
+            results = pool.map(partial(process_file, options=options), to_process, file_decisions, chunksize=8)
+            for path, sha, examples, stats in results:
+                name = os.path.basename(path)
+                stat = os.stat(path)
+                tag = decision_tag(decisions.get(name))
+                # Содержимое не изменилось (например, только mtime) - шард уже есть
+                if examples and not os.path.exists(shard_path(sha, key, tag)):
+                    write_shard(shard_path(sha, key, tag), examples)
+                files[name] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": sha,
+                               "dedup": tag, "examples": len(examples), **stats}
+
+    save_manifest(files, key, options["max_seq_length"] if options["mode"] == "windows" else None)
+
+    shards = [Dataset.from_file(shard_path(files[name]["sha256"], key, files[name].get("dedup", "")))
+              for name in names if files[name]["examples"]]
+    if not shards:
+        raise SystemExit(f"No stories found in {txt_folder}")
+
+    return concatenate_datasets(shards), files
+
+
+def print_window_report(files: dict, max_seq_length: int):
+    """Число окон и использование токенов контекста"""
+    windows = sum(entry["examples"] for entry in files.values())
+    story_tokens = sum(entry.get("story_tokens", 0) for entry in files.values())
+    window_tokens = sum(entry.get("window_tokens", 0) for entry in files.values())
+    duplicate_tokens = sum(entry.get("duplicate_tokens", 0) for entry in files.values())
+    example_tokens = sum(entry.get("example_tokens", 0) for entry in files.values())
+
+    print(f"Windows: {windows} from {sum(1 for e in files.values() if e['examples'])} stories")
+    print(f"Corpus tokens: {story_tokens:,} (all trained on)")
+    if story_tokens:
+        print(f"Overlap duplication: {window_tokens / story_tokens:.2f}x "
+              f"({duplicate_tokens:,} tokens trained on twice)")
+    if windows:
+        print(f"Token utilization: {example_tokens / (windows * max_seq_length):.1%} "
+              f"of {windows} x {max_seq_length:,} slots")
+
+
+def export_token_corpus(txt_folder: str, files: dict, out_dir: str, decisions: dict = None):
+    """Экспорт длинных историй в memmap корпус (пропуск, если истории и токенизатор не изменились)"""
+    from transformers import AutoTokenizer
+    from dataset_format import tokenizer_hash
+    from token_corpus import export_corpus, load_meta
+
+    tokenizer = AutoTokenizer.from_pretrained(config.MODEL_PATH, local_files_only=True)
+    names = sorted(name for name, entry in files.items() if entry["examples"])
+    # sha256 исходного файла + решение dedup
+    expected = [{"name": name, "sha256": files[name]["sha256"] + files[name].get("dedup", "")} for name in names]
+
+    meta = load_meta(out_dir)
+    if meta.get("tokenizer_hash") == tokenizer_hash(tokenizer) and meta.get("stories") == expected:
+        print(f"Token corpus up to date: {out_dir}/ ({meta['tokens']:,} tokens)")
+        return
+
+    stories = []
+    for name in names:
+        with open(os.path.join(txt_folder, name), "rb") as f:
+            raw = f.read()
+        story = apply_decision(raw.decode("utf-8").strip(), (decisions or {}).get(name),
+                               hashlib.sha256(raw).hexdigest(), name)
+        stories.append((name, files[name]["sha256"] + files[name].get("dedup", ""), story))
+    meta = export_corpus(stories, tokenizer, out_dir)
+    print(f"Token corpus saved to: {out_dir}/ ({len(names)} stories, {meta['tokens']:,} tokens)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build warhammer_dataset from transcripts")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--full", action="store_true", help="Ignore manifest, rebuild every shard")
+    parser.add_argument("--mode", choices=["split", "windows"], default="split",
+                        help="split: 500-char prompt + rest; windows: token windows sized to the context")
+    parser.add_argument("--overlap", type=int, default=config.WINDOW_OVERLAP_TOKENS,
+                        help="Tokens shared by neighbouring windows")
+    parser.add_argument("--context", type=int, default=config.WINDOW_CONTEXT_TOKENS,
+                        help="Preceding tokens given to each window as prompt")
+    parser.add_argument("--no-dedup", action="store_true", help="Ignore dataset_cache/dedup.json")
+    parser.add_argument("--tokenize", action="store_true",
+                        help="Also pre-tokenize with the model tokenizer (warhammer_dataset_tokenized/)")
+    parser.add_argument("--max-seq-length", type=int, default=None,
+                        help="Window size / tokenize length (default: same as the trainers, "
+                             "profile_corpus.pick_max_seq_length)")
+    parser.add_argument("--export-corpus", nargs="?", const="token_corpus", default=None, metavar="DIR",
+                        help="Also export stories to a memory-mapped uint32 token corpus")
+    args = parser.parse_args()
+    if args.max_seq_length is None:
+        # Та же длина, что возьмет тренер: окна длиннее были бы обрезаны токенизацией
+        args.max_seq_length = pick_max_seq_length()
+
+    options = {"mode": args.mode, "max_seq_length": args.max_seq_length,
+               "overlap": args.overlap, "context": args.context}
+
+    # TXT folder with transcriptions
+    txt_folder = config.OUTPUT_DIR  # From config.py
+
+    print(f"Preparing dataset from: {txt_folder}")
+    print("Loading stories...")
+
+    decisions = {} if args.no_dedup else load_decisions()
+    if decisions:
+        dropped = sum(1 for decision in decisions.values() if decision["action"] == "drop")
+        print(f"Dedup: {dropped} files dropped, {len(decisions) - dropped} files with repeated paragraphs cut")
+
+    dataset, files = build_dataset(txt_folder, args.workers, args.full, options, decisions)
+    print(f"Total examples: {len(dataset)}")
+    if args.mode == "windows":
+        print_window_report(files, args.max_seq_length)
+
+    dataset.save_to_disk(DATASET_DIR)
+
+    print(f"Dataset saved to: {DATASET_DIR}/")
+    print(f"Ready for training with {len(dataset)} examples!")
+
+    if args.tokenize:
+        from transformers import AutoTokenizer
+        from dataset_format import load_tokenized
+
+        tokenizer = AutoTokenizer.from_pretrained(config.MODEL_PATH, local_files_only=True)
+        tokenized = load_tokenized(tokenizer, args.max_seq_length, DATASET_DIR, num_proc=args.workers)
+        print(f"Pre-tokenized: {len(tokenized)} examples")
+
+    if args.export_corpus:
+        export_token_corpus(txt_folder, files, args.export_corpus, decisions)
+
 
-# TXT folder with transcriptions
-txt_folder = config.OUTPUT_DIR  # From config.py
-data = []
-
-print(f"Preparing dataset from: {txt_folder}")
-print("Loading stories...")
-
-for file in os.listdir(txt_folder):
-    if file.endswith(".txt"):
-        with open(os.path.join(txt_folder, file), "r", encoding="utf-8") as f:
-            story = f.read().strip()
-            # Split into prompt (beginning) and completion (continuation)
-            if len(story) > 1000:  # Only long stories
-                prompt = story[:500] + "\nContinue this Warhammer 40,000 story:"
-                completion = story[500:]
-                data.append({
-                    "instruction": "Write a continuation of a Warhammer 40,000 story.",
-                    "input": prompt,
-                    "output": completion
-                })
-
-print(f"Total stories processed: {len(data)}")
-
-# Save as JSONL
-with open("dataset.jsonl", "w", encoding="utf-8") as f:
-    for item in data:
-        f.write(json.dumps(item, ensure_ascii=False) + "\n")
-
-print("Saved: dataset.jsonl")
-
-# Load into Hugging Face Dataset
-dataset = Dataset.from_json("dataset.jsonl")
-dataset.save_to_disk("warhammer_dataset")
-
-print("Dataset saved to: warhammer_dataset/")
-print(f"Ready for training with {len(dataset)} examples!")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+Профиль длин корпуса в токенах (вместо ручных цифр из analysis_results.txt)
+
+- input_data/ токенизируется настоящим токенизатором Qwen в пуле процессов
+- Кеш длин по sha256 файла и хешу токенизатора (dataset_cache/token_lengths.json):
+  пересчитываются только новые/измененные транскрипции
+- Отчет corpus_profile.json: распределение длин, покрытие и потерянные токены
+  для каждого кандидата max_seq_length, доля паддинга с packing и без
+- recommended_max_seq_length - наименьший кандидат с покрытием
+  >= config.TARGET_COVERAGE (не больше config.MAX_SEQ_LENGTH - предел по VRAM);
+  train.py / train_runpod.py берут его через pick_max_seq_length()
+
+Использование:
+    python profile_corpus.py
+    python profile_corpus.py --batch-size 1 --grad-accum 8
+"""
+
+import os
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import config
+from metrics import percentile
+from packing import padding_report
+
+
+REPORT_PATH = "corpus_profile.json"
+CACHE_PATH = os.path.join("dataset_cache", "token_lengths.json")
+
+CANDIDATES = [2048, 4096, 8192, 12288, 16384, 24576, 32768]
+
+_tokenizer = None
+
+
+def load_tokenizer():
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(config.MODEL_PATH, local_files_only=True)
+
+
+def _init_worker():
+    global _tokenizer
+    _tokenizer = load_tokenizer()
+
+
+def count_tokens(path: str) -> tuple[str, str, int, int]:
+    """
+    Токены одной транскрипции (выполняется в процессе пула).
+
+    Returns:
+        Tuple (path, sha256, tokens, chars)
+    """
+    with open(path, "rb") as f:
+        raw = f.read()
+    story = raw.decode("utf-8").strip()
+    tokens = len(_tokenizer(story, add_special_tokens=False)["input_ids"])
+    return path, hashlib.sha256(raw).hexdigest(), tokens, len(story)
+
+
+def template_overhead(tokenizer) -> int:
+    """Токены шаблона промпта + EOS сверх текста истории (режим split)"""
+    from dataset_format import build_prompt
+    from prepare_dataset import CONTINUE_INSTRUCTION, CONTINUE_SUFFIX
+
+    return len(tokenizer(build_prompt(CONTINUE_INSTRUCTION, CONTINUE_SUFFIX), add_special_tokens=False)["input_ids"]) + 1
+
+
+def profile(txt_folder: str, workers: int = None, batch_size: int = 2, grad_accum: int = 4) -> dict:
+    """
+    Профиль длин корпуса.
+
+    Args:
+        txt_folder: Папка с транскрипциями
+        workers: Процессов токенизации (None - по числу CPU)
+        batch_size, grad_accum: Батч тренера (для оценки паддинга и шагов на эпоху)
+
+    Returns:
+        Отчет (записывается в corpus_profile.json)
+    """
+    from dataset_format import tokenizer_hash
+
+    tokenizer = load_tokenizer()
+    key = tokenizer_hash(tokenizer)
+
+    try:
+        with open(CACHE_PATH, "r", encoding="utf-8") as f:
+            cache = json.load(f).get(key, {})
+    except (OSError, ValueError):
+        cache = {}
+
+    names = sorted(f for f in os.listdir(txt_folder) if f.endswith(".txt"))
+    entries = {}
+    missing = []
+    for name in names:
+        path = os.path.join(txt_folder, name)
+        with open(path, "rb") as f:
+            sha = hashlib.sha256(f.read()).hexdigest()
+        if sha in cache:
+            entries[name] = cache[sha]
+        else:
+            missing.append(path)
+
+    print(f"Files: {len(names)} | cached: {len(entries)} | to tokenize: {len(missing)}")
+    if missing:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            for path, sha, tokens, chars in pool.map(count_tokens, missing, chunksize=4):
+                cache[sha] = {"tokens": tokens, "chars": chars}
+                entries[os.path.basename(path)] = cache[sha]
+
+    os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+    with open(CACHE_PATH, "w", encoding="utf-8") as f:
+        json.dump({key: cache}, f)
+
+    # Как prepare_dataset.py: только истории длиннее 1000 символов
+    stories = [entry for entry in entries.values() if entry["chars"] > 1000]
+    overhead = template_overhead(tokenizer)
+    lengths = [entry["tokens"] + overhead for entry in stories]
+    total = sum(lengths)
+
+    candidates = []
+    for max_len in CANDIDATES:
+        padding = padding_report(lengths, max_len, batch_size, grad_accum) if lengths else None
+        candidates.append({
+            "max_seq_length": max_len,
+            "coverage": sum(1 for n in lengths if n <= max_len) / len(lengths) if lengths else 0.0,
+            "tokens_lost": sum(max(0, n - max_len) for n in lengths) / total if total else 0.0,
+            "padding_ratio": padding["plain"]["padding_ratio"] if padding else 0.0,
+            "padding_ratio_packed": padding["packed"]["padding_ratio"] if padding else 0.0,
+            "steps_per_epoch": padding["plain"]["steps_per_epoch"] if padding else 0,
+            "steps_per_epoch_packed": padding["packed"]["steps_per_epoch"] if padding else 0,
+        })
+
+    allowed = [c for c in candidates if c["max_seq_length"] <= config.MAX_SEQ_LENGTH]
+    covering = [c for c in allowed if c["coverage"] >= config.TARGET_COVERAGE]
+    recommended = (covering[0] if covering else allowed[-1] if allowed else candidates[0])["max_seq_length"]
+
+    return {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "tokenizer_hash": key,
+        "files": len(names),
+        "stories": len(lengths),
+        "template_overhead": overhead,
+        "batch_size": batch_size,
+        "grad_accum": grad_accum,
+        "distribution": {
+            "min": min(lengths, default=0),
+            "max": max(lengths, default=0),
+            "mean": total / len(lengths) if lengths else 0.0,
+            "p50": percentile(lengths, 0.5),
+            "p90": percentile(lengths, 0.9),
+            "p95": percentile(lengths, 0.95),
+            "p99": percentile(lengths, 0.99),
+            "total_tokens": total,
+            "chars_per_token": sum(e["chars"] for e in stories) / total if total else 0.0,
+        },
+        "candidates": candidates,
+        "target_coverage": config.TARGET_COVERAGE,
+        "recommended_max_seq_length": recommended,
+    }
+
+
+def load_report(path: str = REPORT_PATH) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def pick_max_seq_length(path: str = REPORT_PATH) -> int:
+    """
+    max_seq_length для тренера: из отчета профилировщика (config.AUTO_SEQ_LENGTH)
+    или config.MAX_SEQ_LENGTH, если отчета нет.
+    """
+    report = load_report(path)
+    if not config.AUTO_SEQ_LENGTH or not report.get("recommended_max_seq_length"):
+        return config.MAX_SEQ_LENGTH
+
+    max_len = min(report["recommended_max_seq_length"], config.MAX_SEQ_LENGTH)
+    candidate = next((c for c in report["candidates"] if c["max_seq_length"] == max_len), None)
+    coverage = f", покрытие {candidate['coverage']:.1%}" if candidate else ""
+    print(f"[PROFILE] max_seq_length = {max_len:,} из {path} ({report['created']}{coverage})")
+    return max_len
+
+
+def print_report(report: dict):
+    dist = report["distribution"]
+    print("=" * 60)
+    print(f"Историй: {report['stories']} | токенов: {dist['total_tokens']:,} | "
+          f"{dist['chars_per_token']:.2f} символа/токен")
+    print(f"Длина (токены): min {dist['min']:,} | p50 {dist['p50']:,.0f} | p90 {dist['p90']:,.0f} | "
+          f"p95 {dist['p95']:,.0f} | max {dist['max']:,}")
+    print("-" * 60)
+    print(f"{'max_len':>8} {'покрытие':>9} {'потеряно':>9} {'паддинг':>8} {'packed':>7} {'шагов/эп':>9}")
+    for c in report["candidates"]:
+        print(f"{c['max_seq_length']:>8} {c['coverage']:>9.1%} {c['tokens_lost']:>9.1%} "
+              f"{c['padding_ratio']:>8.1%} {c['padding_ratio_packed']:>7.1%} "
+              f"{c['steps_per_epoch']:>4}/{c['steps_per_epoch_packed']:<4}")
+    print("-" * 60)
+    print(f"Рекомендуемый max_seq_length: {report['recommended_max_seq_length']:,} "
+          f"(покрытие >= {report['target_coverage']:.0%}, предел {config.MAX_SEQ_LENGTH:,})")
+    print("=" * 60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Token-length profile of input_data/")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--batch-size", type=int, default=2)
+    parser.add_argument("--grad-accum", type=int, default=4)
+    args = parser.parse_args()
+
+    report = profile(config.OUTPUT_DIR, args.workers, args.batch_size, args.grad_accum)
+    with open(REPORT_PATH, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+
+    print_report(report)
+    print(f"Report: {REPORT_PATH}")
+
+
+if __name__ == "__main__":
+    main()
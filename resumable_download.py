@@ -0,0 +1,167 @@
+"""
+Докачка аудио YouTube после обрыва, retry или падения скрипта
+
+Аудио качается диапазонами в TEMP_DIR/<video_id>.<format_id>.part, рядом -
+.part.json с форматом и ожидаемым размером. Имя не зависит от названия
+строки, поэтому недокачанный файл подхватывается при следующем запуске main.
+
+Проверки целостности:
+- формат и размер в .part.json должны совпадать с текущим info, иначе качаем заново
+- перед докачкой последние VERIFY_BYTES сверяются с сервером
+- не прошедшая проверку пара .part/.part.json удаляется, как и .part этого
+  видео от другого формата (иначе они копятся в TEMP_DIR)
+- итоговый размер должен совпасть с ожидаемым
+"""
+
+import os
+import re
+import json
+
+from audio_stream import select_audio_format, CHUNK_SIZE, http_session
+
+
+PART_SUFFIX = ".part"
+VERIFY_BYTES = 64 * 1024
+
+
+def part_paths(output_dir: str, video_id: str, format_id: str) -> tuple[str, str]:
+    """Пути (part_file, meta_file) для видео и формата"""
+    base = os.path.join(output_dir, f"{video_id}.{format_id}")
+    return base + PART_SUFFIX, base + PART_SUFFIX + ".json"
+
+
+def find_partials(output_dir: str, video_id: str = None) -> list:
+    """Недокачанные файлы в папке (для одного видео или все)"""
+    if not os.path.isdir(output_dir):
+        return []
+    return [
+        os.path.join(output_dir, name) for name in os.listdir(output_dir)
+        if name.endswith(PART_SUFFIX) and (video_id is None or name.startswith(f"{video_id}."))
+    ]
+
+
+def remove_partial(part_path: str):
+    """Удаление пары .part / .part.json"""
+    for path in (part_path, part_path + ".json"):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _request_range(url: str, headers: dict, start: int, end: int = None):
+    headers = dict(headers or {})
+    headers['Range'] = f"bytes={start}-{'' if end is None else end}"
+    response = http_session.get(url, headers=headers, stream=True, timeout=(30, 120))
+    response.raise_for_status()
+    return response
+
+
+def _total_from_response(response):
+    match = re.search(r'/(\d+)$', response.headers.get('Content-Range', ''))
+    if match:
+        return int(match.group(1))
+    if response.status_code == 200 and response.headers.get('Content-Length'):
+        return int(response.headers['Content-Length'])
+    return None
+
+
+def _tail_matches(part_path: str, url: str, headers: dict, position: int) -> bool:
+    """Сверка последних байт локального файла с сервером"""
+    start = max(0, position - VERIFY_BYTES)
+    with open(part_path, 'rb') as f:
+        f.seek(start)
+        local = f.read()
+    response = _request_range(url, headers, start, position - 1)
+    try:
+        if response.status_code != 206:
+            return False
+        return response.content == local
+    finally:
+        response.close()
+
+
+def download_resumable(info: dict, output_dir: str, final_path: str) -> str:
+    """
+    Скачивание аудио формата с докачкой.
+
+    Args:
+        info: Info видео от yt-dlp (с форматами и прямыми ссылками)
+        output_dir: Папка для .part файлов
+        final_path: Куда переместить готовый файл
+
+    Returns:
+        final_path
+    """
+    audio_format = select_audio_format(info)
+    if audio_format is None:
+        raise Exception("No direct audio URL for resumable download")
+
+    url = audio_format['url']
+    headers = audio_format.get('http_headers')
+    total = audio_format.get('filesize')
+    part_path, meta_path = part_paths(output_dir, info.get('id'), audio_format.get('format_id'))
+
+    # .part того же видео от другого формата уже не докачать
+    for stale_path in find_partials(output_dir, info.get('id')):
+        if os.path.abspath(stale_path) != os.path.abspath(part_path):
+            print(f"[RESUME] Удаляю недокачанный файл другого формата: {os.path.basename(stale_path)}")
+            remove_partial(stale_path)
+
+    # Проверка, что .part от того же формата
+    position = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if position:
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = {}
+        same_format = meta.get('format_id') == audio_format.get('format_id')
+        same_size = total is None or meta.get('filesize') in (None, total)
+        if not (same_format and same_size) or (total and position > total) \
+                or not _tail_matches(part_path, url, headers, position):
+            print("[RESUME] Недокачанный файл не прошел проверку - удаляю и качаю заново")
+            remove_partial(part_path)
+            position = 0
+        else:
+            print(f"[RESUME] Докачка с {position / 1024 / 1024:.1f} MB")
+
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump({'video_id': info.get('id'), 'format_id': audio_format.get('format_id'),
+                   'filesize': total}, f)
+
+    with open(part_path, 'r+b' if position else 'wb') as out:
+        out.truncate(position)
+        out.seek(position)
+
+        while total is None or position < total:
+            end = min(position + CHUNK_SIZE, total) - 1 if total else None
+            response = _request_range(url, headers, position, end)
+            try:
+                if response.status_code == 200 and position:
+                    # Сервер не поддерживает Range - пишем с нуля
+                    out.seek(0)
+                    out.truncate(0)
+                    position = 0
+                if total is None:
+                    total = _total_from_response(response)
+
+                received = 0
+                for chunk in response.iter_content(chunk_size=256 * 1024):
+                    out.write(chunk)
+                    position += len(chunk)
+                    received += len(chunk)
+            finally:
+                response.close()
+
+            out.flush()
+            os.fsync(out.fileno())
+            if total is None or received == 0:
+                break
+
+    if total is not None and position != total:
+        raise Exception(f"Size mismatch after download: {position} != {total} bytes")
+
+    os.replace(part_path, final_path)
+    os.remove(meta_path)
+    return final_path
@@ -1,68 +1,437 @@
 """
 Universal Retry Handler with Exponential Backoff
 
-Provides decorator for automatic retry with progressive backoff delays.
+Provides decorators for automatic retry with progressive backoff delays.
 Handles transient errors: network issues, rate limits, temporary API failures.
+
+- Errors are classified as retryable or fatal (400/401/403/404... are never retried)
+- Delays use decorrelated jitter and honour Retry-After on 429/503
+- RateLimiter (token bucket) and CircuitBreaker can be shared across workers
+- async_retry_with_backoff wraps coroutines
+- get_retry_stats() exposes per-operation counters for monitoring
 """
 
 import time
 import sys
+import random
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
 from functools import wraps
-from requests.exceptions import RequestException, Timeout, ConnectionError
+from requests.exceptions import RequestException, Timeout, ConnectionError, HTTPError
+
+
+# HTTP statuses that are worth retrying; every other 4xx is fatal
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+# Upper bound for a server-provided Retry-After
+MAX_RETRY_AFTER = 300
+
+
+class FatalError(Exception):
+    """Raise from wrapped code to stop retrying immediately."""
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because the circuit breaker is open."""
+
+
+def get_status_code(error):
+    """HTTP status code of a requests error, or None."""
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def classify_error(error) -> bool:
+    """
+    Decide whether an error is worth retrying.
+
+    Returns:
+        True for transient errors (network, timeouts, 429, 5xx),
+        False for errors that will never succeed (bad request, auth, missing file)
+    """
+    if isinstance(error, (FatalError, CircuitOpenError)):
+        return False
+    if isinstance(error, (FileNotFoundError, PermissionError)):
+        return False
+
+    status = get_status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+
+    if isinstance(error, (Timeout, ConnectionError)):
+        return True
+    if isinstance(error, HTTPError):
+        return False
+
+    # Unknown errors (yt-dlp, pytubefix, ...) keep the old behaviour
+    return True
+
+
+def get_retry_after(error):
+    """Seconds from the Retry-After header of a requests error, or None."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER)
+
+
+def next_delay(previous_delay, base_delay, max_delay):
+    """Decorrelated jitter: random between base and 3x the previous delay."""
+    return min(max_delay, random.uniform(base_delay, max(base_delay, previous_delay * 3)))
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket shared by all workers.
+
+    Args:
+        rate: Tokens added per second
+        capacity: Maximum burst size
+    """
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Take a token; return how long the caller must wait before using it."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+            return max(wait, self.paused_until - now)
+
+    def acquire(self):
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Hold every worker back, e.g. after a 429 with Retry-After."""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker shared by all workers.
+
+    After failure_threshold consecutive retryable failures the circuit opens
+    and calls fail fast for reset_timeout seconds. Then one trial call is let
+    through (half-open): success closes the circuit, failure re-opens it.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60, name: str = "circuit"):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.name = name
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self.lock:
+            if self.opened_at is None:
+                return "closed"
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def before_call(self) -> bool:
+        """
+        Admit or reject a call.
+
+        Returns:
+            True if this call is the half-open trial (release it with
+            record_success, record_failure or abort_trial)
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return False
+            if time.monotonic() - self.opened_at < self.reset_timeout or self.trial_in_flight:
+                raise CircuitOpenError(f"{self.name} is open after {self.failures} failures")
+            self.trial_in_flight = True
+            return True
+
+    def abort_trial(self):
+        """The trial call was interrupted (KeyboardInterrupt, cancellation): let another one through."""
+        with self.lock:
+            self.trial_in_flight = False
+
+    def retry_in(self) -> float:
+        """Seconds until a call may be admitted again (0 when closed or half-open)."""
+        with self.lock:
+            if self.opened_at is None:
+                return 0.0
+            remaining = self.reset_timeout - (time.monotonic() - self.opened_at)
+            if remaining > 0:
+                return remaining
+            # Half-open with a trial in flight: check again shortly
+            return 1.0 if self.trial_in_flight else 0.0
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+def call_when_closed(circuit_breaker, func, *args, **kwargs):
+    """
+    Call func; while the circuit rejects it, wait for reset_timeout and try again.
+
+    For work that must not be dropped just because the service is down for a
+    while (e.g. a queued transcription), unlike CircuitOpenError fail-fast.
+    """
+    while True:
+        try:
+            return func(*args, **kwargs)
+        except CircuitOpenError:
+            wait = max(circuit_breaker.retry_in(), 1.0)
+            print(f"[CIRCUIT] {circuit_breaker.name} is open - waiting {wait:.0f}s before retrying")
+            sys.stdout.flush()
+            time.sleep(wait)
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _count(operation_name, key):
+    with _stats_lock:
+        counters = _stats.setdefault(operation_name, {
+            "calls": 0, "successes": 0, "retries": 0, "failures": 0, "fatal": 0, "rejected": 0
+        })
+        counters[key] += 1
+
+
+def get_retry_stats() -> dict:
+    """Per-operation counters: calls, successes, retries, failures, fatal, rejected."""
+    with _stats_lock:
+        return {name: dict(counters) for name, counters in _stats.items()}
+
+
+class _RetryState:
+    """Shared retry bookkeeping for the sync and async decorators."""
+
+    def __init__(self, max_retries, base_delay, max_delay, operation_name,
+                 rate_limiter, circuit_breaker, classify):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.operation_name = operation_name
+        self.rate_limiter = rate_limiter
+        self.circuit_breaker = circuit_breaker
+        self.classify = classify
+
+    def before_attempt(self) -> bool:
+        """Returns True if this attempt is the circuit breaker's half-open trial."""
+        if self.circuit_breaker:
+            try:
+                return self.circuit_breaker.before_call()
+            except CircuitOpenError:
+                _count(self.operation_name, "rejected")
+                raise
+        return False
+
+    def on_abort(self, trial: bool):
+        """The attempt ended with a BaseException (KeyboardInterrupt, SystemExit, cancellation)."""
+        if trial:
+            self.circuit_breaker.abort_trial()
+
+    def on_success(self):
+        if self.circuit_breaker:
+            self.circuit_breaker.record_success()
+        _count(self.operation_name, "successes")
+
+    def on_error(self, error, retries, delay):
+        """
+        Book-keeping after a failed attempt.
+
+        Returns:
+            Seconds to sleep before the next attempt, or None to re-raise
+        """
+        if isinstance(error, CircuitOpenError):
+            return None
+
+        if not self.classify(error):
+            # A fatal client error still proves the service is answering
+            if self.circuit_breaker:
+                self.circuit_breaker.record_success()
+            _count(self.operation_name, "fatal")
+            print(f"[ERROR] {self.operation_name} failed with non-retryable error: {error}")
+            sys.stdout.flush()
+            return None
+
+        if self.circuit_breaker:
+            self.circuit_breaker.record_failure()
+
+        if retries > self.max_retries:
+            _count(self.operation_name, "failures")
+            print(f"[ERROR] {self.operation_name} failed after {self.max_retries} retries")
+            sys.stdout.flush()
+            return None
+
+        retry_after = get_retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+            if self.rate_limiter:
+                self.rate_limiter.pause(retry_after)
+
+        _count(self.operation_name, "retries")
+        print(f"[RETRY] {self.operation_name} failed (attempt {retries}/{self.max_retries})")
+        print(f"        Error: {str(error)}")
+        print(f"        Retrying in {delay:.1f}s...")
+        sys.stdout.flush()
+        return delay
 
 
 def retry_with_backoff(
     max_retries=3,
     base_delay=5,
     max_delay=30,
-    operation_name="Operation"
+    operation_name="Operation",
+    rate_limiter=None,
+    circuit_breaker=None,
+    classify=classify_error
 ):
     """
     Decorator for automatic retry with exponential backoff.
-    
+
     Args:
         max_retries: Maximum number of retry attempts (default: 3)
         base_delay: Initial delay in seconds (default: 5)
         max_delay: Maximum delay cap in seconds (default: 30)
         operation_name: Human-readable operation name for logs
-        
+        rate_limiter: Optional shared RateLimiter, one token per attempt
+        circuit_breaker: Optional shared CircuitBreaker
+        classify: Function(error) -> bool, True if the error is retryable
+
     Returns:
         Decorated function with retry logic
-        
+
     Usage:
         @retry_with_backoff(operation_name="API Call")
         def my_api_call():
             # Your code here
             pass
     """
+    state = _RetryState(max_retries, base_delay, max_delay, operation_name,
+                        rate_limiter, circuit_breaker, classify)
+
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
             retries = 0
-            
-            while retries <= max_retries:
+            delay = base_delay
+            _count(operation_name, "calls")
+
+            while True:
+                trial = False
                 try:
-                    return func(*args, **kwargs)
-                    
+                    trial = state.before_attempt()
+                    if rate_limiter:
+                        rate_limiter.acquire()
+                    result = func(*args, **kwargs)
+                    state.on_success()
+                    return result
+
                 except Exception as e:
                     retries += 1
-                    
-                    # If we've exhausted all retries, raise the error
-                    if retries > max_retries:
-                        print(f"[ERROR] {operation_name} failed after {max_retries} retries")
-                        sys.stdout.flush()
+                    delay = next_delay(delay, base_delay, max_delay)
+                    sleep_for = state.on_error(e, retries, delay)
+                    if sleep_for is None:
                         raise
-                    
-                    # Calculate delay with exponential backoff
-                    delay = min(base_delay * (2 ** (retries - 1)), max_delay)
-                    
-                    print(f"[RETRY] {operation_name} failed (attempt {retries}/{max_retries})")
-                    print(f"        Error: {str(e)}")
-                    print(f"        Retrying in {delay}s...")
-                    sys.stdout.flush()
-                    
-                    time.sleep(delay)
-            
+                    time.sleep(sleep_for)
+
+                except BaseException:
+                    state.on_abort(trial)
+                    raise
+
         return wrapper
     return decorator
 
+
+def async_retry_with_backoff(
+    max_retries=3,
+    base_delay=5,
+    max_delay=30,
+    operation_name="Operation",
+    rate_limiter=None,
+    circuit_breaker=None,
+    classify=classify_error
+):
+    """
+    Same as retry_with_backoff, for `async def` functions.
+
+    Usage:
+        @async_retry_with_backoff(operation_name="API Call")
+        async def my_api_call():
+            ...
+    """
+    state = _RetryState(max_retries, base_delay, max_delay, operation_name,
+                        rate_limiter, circuit_breaker, classify)
+
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            retries = 0
+            delay = base_delay
+            _count(operation_name, "calls")
+
+            while True:
+                trial = False
+                try:
+                    trial = state.before_attempt()
+                    if rate_limiter:
+                        await rate_limiter.acquire_async()
+                    result = await func(*args, **kwargs)
+                    state.on_success()
+                    return result
+
+                except Exception as e:
+                    retries += 1
+                    delay = next_delay(delay, base_delay, max_delay)
+                    sleep_for = state.on_error(e, retries, delay)
+                    if sleep_for is None:
+                        raise
+                    await asyncio.sleep(sleep_for)
+
+                except BaseException:  # asyncio.CancelledError, KeyboardInterrupt
+                    state.on_abort(trial)
+                    raise
+
+        return wrapper
+    return decorator
@@ -0,0 +1,132 @@
+"""
+Журнал статусов строк Excel таблицы (SQLite рядом с .xlsx)
+
+Хранит состояние каждой строки: pending / done / failed, путь к транскрипции,
+время и текст ошибки. Журнал - источник истины при перезапуске, а зеленая
+заливка в таблице применяется пачками (одно сохранение .xlsx на много строк).
+"""
+
+import sqlite3
+from datetime import datetime
+
+
+STATUS_PENDING = "pending"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+META_IMPORT_DONE = "import_done"
+
+
+def journal_path_for(workbook_path: str) -> str:
+    """Путь к журналу для указанной таблицы: file.xlsx -> file.xlsx.journal.db"""
+    return f"{workbook_path}.journal.db"
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec='seconds')
+
+
+class RowJournal:
+    """
+    Журнал статусов строк.
+
+    Используется из одного потока (главного) - воркеры конвейера
+    передают результаты через очередь.
+    """
+
+    def __init__(self, workbook_path: str):
+        self.path = journal_path_for(workbook_path)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS rows (
+                row_num INTEGER PRIMARY KEY,
+                title TEXT,
+                url TEXT,
+                status TEXT NOT NULL,
+                output_path TEXT,
+                error TEXT,
+                colored INTEGER NOT NULL DEFAULT 0,
+                started_at TEXT,
+                updated_at TEXT
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        """)
+        self.conn.commit()
+
+    @property
+    def needs_import(self) -> bool:
+        """
+        Зеленые строки таблицы ещё не перенесены в журнал.
+
+        Флаг в meta, а не наличие файла: журнал, созданный прерванным
+        запуском (падение посреди переноса), перенос повторит.
+        """
+        cursor = self.conn.execute("SELECT 1 FROM meta WHERE key = ?", (META_IMPORT_DONE,))
+        return cursor.fetchone() is None
+
+    def finish_import(self):
+        """Перенос окрашенных строк завершен - дальше решает только журнал"""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            (META_IMPORT_DONE, _now())
+        )
+        self.conn.commit()
+
+    def _upsert(self, row_num: int, **fields):
+        fields['updated_at'] = _now()
+        columns = ", ".join(fields)
+        placeholders = ", ".join("?" for _ in fields)
+        updates = ", ".join(f"{col}=excluded.{col}" for col in fields)
+        self.conn.execute(
+            f"INSERT INTO rows (row_num, {columns}) VALUES (?, {placeholders}) "
+            f"ON CONFLICT(row_num) DO UPDATE SET {updates}",
+            (row_num, *fields.values())
+        )
+        self.conn.commit()
+
+    def mark_pending(self, row_num: int, title: str, url: str):
+        """Строка взята в работу"""
+        self._upsert(row_num, title=title, url=url, status=STATUS_PENDING,
+                     error=None, colored=0, started_at=_now())
+
+    def mark_done(self, row_num: int, output_path: str):
+        """Строка успешно обработана (ещё не окрашена в таблице)"""
+        self._upsert(row_num, status=STATUS_DONE, output_path=output_path, error=None, colored=0)
+
+    def mark_failed(self, row_num: int, error: str):
+        """Ошибка обработки строки"""
+        self._upsert(row_num, status=STATUS_FAILED, error=error)
+
+    def import_processed(self, row_num: int, title: str, url: str):
+        """Перенос строки, уже окрашенной в таблице (пока needs_import)"""
+        self._upsert(row_num, title=title, url=url, status=STATUS_DONE, colored=1)
+
+    def done_rows(self) -> dict:
+        """Словарь {row_num: url} успешно обработанных строк"""
+        cursor = self.conn.execute("SELECT row_num, url FROM rows WHERE status = ?", (STATUS_DONE,))
+        return dict(cursor.fetchall())
+
+    def uncolored_rows(self) -> list:
+        """Обработанные строки, которые ещё не окрашены в таблице"""
+        cursor = self.conn.execute(
+            "SELECT row_num FROM rows WHERE status = ? AND colored = 0 ORDER BY row_num",
+            (STATUS_DONE,)
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+    def mark_colored(self, row_nums: list):
+        """Отметить строки как окрашенные после сохранения .xlsx"""
+        self.conn.executemany(
+            "UPDATE rows SET colored = 1, updated_at = ? WHERE row_num = ?",
+            [(_now(), row_num) for row_num in row_nums]
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
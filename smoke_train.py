@@ -0,0 +1,135 @@
+"""
+Smoke/benchmark обучения на CPU без GPU и весов 7B
+
+Тот же путь, что в train.py / train_runpod.py: шаблон и токенизация
+(dataset_format.py, настоящий токенизатор Qwen из config.MODEL_PATH),
+packing, LoRA с LORA_KWARGS, SFTTrainer из trainer_setup.build_trainer,
+телеметрия. Вместо Qwen 2.5 7B - крошечная случайно инициализированная
+модель архитектуры Qwen2, вместо unsloth - peft (unsloth требует CUDA).
+
+Отчет: скорость загрузки данных (токенизация/кеш, батчи коллатора)
+и скорость шагов (TrainingTelemetry).
+
+Использование:
+    python smoke_train.py
+    python smoke_train.py --steps 20 --seq-len 1024 --packing
+    python smoke_train.py --steps 20 --checkpoint-steps 5 [--resume]
+"""
+
+import os
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+import time
+import argparse
+
+import torch
+from peft import LoraConfig, get_peft_model
+from transformers import AutoTokenizer, Qwen2Config, Qwen2ForCausalLM
+
+import config
+from training_telemetry import TrainingTelemetry
+from checkpointing import AdapterCheckpointer
+from trainer_setup import LORA_KWARGS, load_training_data, build_trainer
+
+
+def tiny_qwen2(tokenizer, max_seq_length: int, hidden_size: int = 64, layers: int = 2):
+    """Случайная Qwen2 с тем же словарем (для проверки пайплайна, не качества)"""
+    model_config = Qwen2Config(
+        vocab_size=len(tokenizer),
+        hidden_size=hidden_size,
+        intermediate_size=hidden_size * 2,
+        num_hidden_layers=layers,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=max_seq_length,
+        tie_word_embeddings=True,
+        pad_token_id=tokenizer.pad_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+    )
+    torch.manual_seed(3407)
+    return Qwen2ForCausalLM(model_config)
+
+
+def benchmark_dataloader(trainer, batches: int) -> dict:
+    """Скорость выдачи батчей (sampler + коллатор) без модели"""
+    # Коллатор без обертки телеметрии: эти батчи не должны попасть в счетчики шага
+    wrapped = trainer.data_collator
+    trainer.data_collator = getattr(wrapped, "collator", wrapped)
+    try:
+        loader = trainer.get_train_dataloader()
+        start = time.perf_counter()
+        count = tokens = 0
+        for batch in loader:
+            count += 1
+            tokens += batch["input_ids"].numel()
+            if count >= batches:
+                break
+        seconds = time.perf_counter() - start
+    finally:
+        trainer.data_collator = wrapped
+    return {"batches": count, "seconds": seconds,
+            "batches_per_sec": count / seconds if seconds else 0.0,
+            "tokens_per_sec": tokens / seconds if seconds else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU smoke/benchmark run with a tiny Qwen2 model")
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--seq-len", type=int, default=1024)
+    parser.add_argument("--batch-size", type=int, default=2)
+    parser.add_argument("--grad-accum", type=int, default=2)
+    parser.add_argument("--examples", type=int, default=32, help="First N examples of the dataset")
+    parser.add_argument("--packing", action="store_true", help="Pack examples (4D block mask on CPU)")
+    parser.add_argument("--hidden-size", type=int, default=64)
+    parser.add_argument("--layers", type=int, default=2)
+    parser.add_argument("--checkpoint-steps", type=int, default=0, help="Adapter checkpoint every N steps (0 = off)")
+    parser.add_argument("--resume", action="store_true", help="Resume from the latest checkpoint in outputs_smoke/")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("SMOKE: tiny Qwen2 на CPU")
+    print("=" * 60)
+
+    tokenizer = AutoTokenizer.from_pretrained(config.MODEL_PATH, local_files_only=True)
+
+    start = time.perf_counter()
+    dataset, collator = load_training_data(
+        tokenizer, args.seq_len, args.batch_size, args.grad_accum,
+        packing=args.packing, block_mask=True, limit=args.examples,
+        allow_truncation=True,  # Короткий контекст smoke режет окна намеренно
+    )
+    data_seconds = time.perf_counter() - start
+
+    model = tiny_qwen2(tokenizer, args.seq_len, args.hidden_size, args.layers)
+    model = get_peft_model(model, LoraConfig(**LORA_KWARGS, task_type="CAUSAL_LM"))
+    model.print_trainable_parameters()
+
+    telemetry = TrainingTelemetry(run_name="smoke", gpu_cost_per_hour=0.0)
+    checkpoints = None
+    if args.checkpoint_steps:
+        checkpoints = AdapterCheckpointer(every=args.checkpoint_steps, resume=args.resume)
+    trainer = build_trainer(
+        model, tokenizer, dataset, collator, args.seq_len, telemetry,
+        batch_size=args.batch_size,
+        grad_accum=args.grad_accum,
+        max_steps=args.steps,
+        optim="adamw_torch",  # bitsandbytes 8-bit требует CUDA
+        output_dir="outputs_smoke",
+        checkpointer=checkpoints,
+        use_cpu=True,
+        report_to="none",
+    )
+
+    loader = benchmark_dataloader(trainer, batches=args.steps * args.grad_accum)
+    trainer.train(resume_from_checkpoint=checkpoints.latest(trainer.args.output_dir) if checkpoints else None)
+
+    print("=" * 60)
+    print(f"Данные: {len(dataset)} {'упакованных последовательностей' if args.packing else 'примеров'} "
+          f"за {data_seconds:.2f}s (load_tokenized + отчет паддинга)")
+    print(f"DataLoader: {loader['batches_per_sec']:.1f} батчей/сек, {loader['tokens_per_sec']:,.0f} токенов/сек")
+    print(f"Шаги: см. телеметрию выше ({telemetry.summary_path})")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+Потоковый вывод длинной генерации: stdout + файл с fsync, продолжение истории
+
+generate.py раньше декодировал и сохранял историю только после всех
+12000 токенов (5-15 минут): не было видно первого токена, а падение или
+Ctrl+C теряли все.
+
+- StoryStreamer (streamer= для model.generate) печатает текст по мере
+  генерации и дописывает его в файл; flush после каждого куска, os.fsync не
+  чаще раза в GENERATE_FSYNC_SECONDS. finish() дописывает хвост (в т.ч. после
+  Ctrl+C) и возвращает время до первого токена и скорость
+- Декодируется окно последних токенов, а не вся строка: TextStreamer
+  сбрасывает кеш только на переводе строки, а в транскрипциях их нет -
+  на 12000 токенах это квадратичная работа
+- resume_story: файл = промпт + уже сгенерированный текст; при продолжении
+  весь файл становится промптом, генерируется оставшийся бюджет токенов
+- Завершение генерации (EOS, петля, лимит токенов) записывается рядом с
+  историей (<файл>.complete); прерванная история его не имеет, а законченную
+  на EOS или петле --resume не продолжает
+"""
+
+import os
+import json
+import time
+
+from transformers import TextStreamer
+
+import config
+
+
+def completion_path(path: str) -> str:
+    return f"{path}.complete"
+
+
+def story_completion(path: str):
+    """Причина завершения истории ("eos", "loop", "max_new_tokens") или None - прервана/не начата"""
+    try:
+        with open(completion_path(path), encoding="utf-8") as f:
+            return json.load(f).get("reason")
+    except (OSError, ValueError):
+        return None
+
+
+def resume_story(path: str, prompt: str) -> tuple:
+    """
+    Промпт для продолжения частично записанной истории.
+
+    Args:
+        path: Файл истории (промпт + текст, как пишет StoryStreamer)
+        prompt: Исходный промпт
+
+    Returns:
+        Tuple (prompt для generate, уже сгенерированный текст)
+    """
+    if not os.path.exists(path):
+        return prompt, ""
+    with open(path, encoding="utf-8", newline="") as f:
+        text = f.read()
+    if text.startswith(prompt):
+        return text, text[len(prompt):]
+    # Файл без промпта (например, сохранен старым generate.py после обрезки вручную)
+    return prompt + text, text
+
+
+class StoryStreamer(TextStreamer):
+    """Печать + запись в файл по мере генерации (batch 1)"""
+
+    FLUSH_TOKENS = 64  # Окно декодирования
+    KEEP_TOKENS = 4  # Хвост окна: последние токены еще могут дополнить символ UTF-8
+    MAX_CACHE_TOKENS = 4 * FLUSH_TOKENS  # Окно сбрасывается и при незаконченном символе
+
+    def __init__(self, tokenizer, path: str, prompt: str = None, fsync_seconds: float = None, echo: bool = True):
+        """
+        Args:
+            tokenizer: Токенизатор модели
+            path: Файл истории
+            prompt: Новая история - файл перезаписывается и начинается с промпта;
+                None - дописывать в конец (продолжение)
+            fsync_seconds: Период fsync (по умолчанию config.GENERATE_FSYNC_SECONDS)
+            echo: Печатать в stdout
+        """
+        super().__init__(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        self.fsync_seconds = config.GENERATE_FSYNC_SECONDS if fsync_seconds is None else fsync_seconds
+        self.echo = echo
+        self.path = path
+        # Пока пишем, история не завершена (в т.ч. при продолжении)
+        if os.path.exists(completion_path(path)):
+            os.remove(completion_path(path))
+        self.file = open(path, "w" if prompt is not None else "a", encoding="utf-8", newline="")
+        if prompt is not None:
+            self.file.write(prompt)
+            self._sync()
+        self.start = time.perf_counter()
+        self.first_token_at = None
+        self.generated = 0
+        self.written_chars = 0
+        self.last_sync = self.start
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_sync = time.perf_counter()
+
+    def put(self, value):
+        if len(value.shape) > 1:
+            if value.shape[0] > 1:
+                raise ValueError("StoryStreamer only supports batch size 1")
+            value = value[0]
+        if self.skip_prompt and self.next_tokens_are_prompt:
+            self.next_tokens_are_prompt = False
+            return
+
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.generated += value.numel()
+        self.token_cache.extend(value.tolist())
+
+        if len(self.token_cache) >= self.FLUSH_TOKENS:
+            head = self.tokenizer.decode(self.token_cache[:-self.KEEP_TOKENS], **self.decode_kwargs)
+            # Не резать посреди многобайтного символа; если \ufffd не уходит (невалидные
+            # байты от модели), кеш все равно сбрасывается - иначе декодирование квадратичное
+            if not head.endswith("\ufffd") or len(self.token_cache) >= self.MAX_CACHE_TOKENS:
+                self.token_cache = self.token_cache[-self.KEEP_TOKENS:]
+                # Часть хвоста могла быть уже напечатана (до пробела)
+                printable, self.print_len = head[self.print_len:], max(0, self.print_len - len(head))
+                self.on_finalized_text(printable)
+
+        text = self.tokenizer.decode(self.token_cache, **self.decode_kwargs)
+        if text.endswith("\n"):
+            printable = text[self.print_len:]
+            self.token_cache = []
+            self.print_len = 0
+        else:
+            # До последнего пробела: незаконченное слово может измениться
+            printable = text[self.print_len:text.rfind(" ") + 1]
+            self.print_len += len(printable)
+        self.on_finalized_text(printable)
+
+    def on_finalized_text(self, text: str, stream_end: bool = False):
+        if text:
+            if self.echo:
+                print(text, flush=True, end="")
+            self.file.write(text)
+            self.written_chars += len(text)
+        if stream_end:
+            if self.echo:
+                print(flush=True)
+            self._sync()
+        elif text:
+            self.file.flush()  # Дешево; fsync - реже
+            if time.perf_counter() - self.last_sync >= self.fsync_seconds:
+                self._sync()
+
+    def finish(self, reason: str = None) -> dict:
+        """
+        Дописать хвост, fsync, закрыть файл; вызывать и после исключения/Ctrl+C.
+
+        Args:
+            reason: Почему генерация закончилась ("eos", "loop", "max_new_tokens");
+                None - прервана, отметка о завершении не пишется
+        """
+        if not self.file.closed:
+            if self.token_cache:  # Прервано до streamer.end() из generate
+                self.end()
+            self._sync()
+            self.file.close()
+            if reason:
+                tmp_path = f"{completion_path(self.path)}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump({"reason": reason, "tokens": self.generated}, f)
+                os.replace(tmp_path, completion_path(self.path))
+        seconds = time.perf_counter() - self.start
+        ttft = self.first_token_at - self.start if self.first_token_at else None
+        decode_seconds = seconds - ttft if ttft is not None else 0.0
+        return {
+            "tokens": self.generated,
+            "chars": self.written_chars,
+            "seconds": seconds,
+            "ttft_seconds": ttft,
+            "tokens_per_sec": self.generated / decode_seconds if decode_seconds > 0 else 0.0,
+        }
@@ -0,0 +1,126 @@
+import json
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+import config
+from metrics import Metrics
+from inference_server import GenerationRequest, DynamicBatcher, run_server
+
+
+class FakeTokenizer:
+    """Посимвольный токенизатор с left padding (вместо токенизатора Qwen)"""
+
+    pad_token_id = 0
+    eos_token_id = 1
+    vocab_size = 128
+
+    def __len__(self):
+        return self.vocab_size
+
+    def encode(self, text):
+        return [10 + ord(char) % (self.vocab_size - 10) for char in text]
+
+    def __call__(self, texts, return_tensors=None, padding=False, return_token_type_ids=None):
+        ids = [self.encode(text) for text in texts]
+        width = max(len(row) for row in ids)
+        input_ids = [[self.pad_token_id] * (width - len(row)) + row for row in ids]
+        attention_mask = [[0] * (width - len(row)) + [1] * len(row) for row in ids]
+        return transformers.BatchEncoding({"input_ids": torch.tensor(input_ids),
+                                           "attention_mask": torch.tensor(attention_mask)})
+
+    def decode(self, tokens, skip_special_tokens=False):
+        return " ".join(str(token) for token in tokens)
+
+
+@pytest.fixture(scope="module")
+def tiny_model():
+    model_config = transformers.Qwen2Config(
+        vocab_size=FakeTokenizer.vocab_size, hidden_size=32, intermediate_size=64, num_hidden_layers=1,
+        num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=256,
+        pad_token_id=FakeTokenizer.pad_token_id, eos_token_id=FakeTokenizer.eos_token_id,
+    )
+    torch.manual_seed(0)
+    return transformers.Qwen2ForCausalLM(model_config).eval()
+
+
+def submit_all(batcher, requests):
+    with ThreadPoolExecutor(max_workers=len(requests)) as pool:
+        futures = [pool.submit(batcher.submit, request) for request in requests]
+        return [future.result(timeout=120) for future in futures]
+
+
+def test_concurrent_submits_are_batched(tiny_model):
+    batcher = DynamicBatcher(tiny_model, FakeTokenizer(), max_batch=4, wait_ms=500, metrics=Metrics("test")).start()
+    prompts = [f"story {i} " * (i + 1) for i in range(8)]
+    done = submit_all(batcher, [GenerationRequest(p, 6, temperature=0.0, top_p=1.0) for p in prompts])
+
+    for request in done:
+        assert request.error is None
+        text, tokens = request.result
+        assert tokens <= 6
+        assert request.batch_size <= 4
+    stats = batcher.stats()
+    assert stats["requests"] == 8
+    assert stats["batches"] < 8
+
+
+def test_max_new_tokens_bands_are_not_mixed(tiny_model):
+    batcher = DynamicBatcher(tiny_model, FakeTokenizer(), max_batch=4, wait_ms=300, metrics=Metrics("test")).start()
+    short = [GenerationRequest("short", 4, temperature=0.0, top_p=1.0) for _ in range(2)]
+    long = [GenerationRequest("long", 40, temperature=0.0, top_p=1.0) for _ in range(2)]
+    done = submit_all(batcher, short + long)
+
+    assert {request.batch_size for request in done} == {2}
+    assert all(request.result[1] <= 4 for request in done[:2])
+    assert short[0].key != long[0].key
+    assert GenerationRequest("a", 33, 0.8, 0.95).key == GenerationRequest("b", 64, 0.8, 0.95).key
+
+
+def test_failures_always_release_requests(tiny_model):
+    metrics = Metrics("test")
+    batcher = DynamicBatcher(tiny_model, FakeTokenizer(), max_batch=2, wait_ms=0, metrics=metrics).start()
+
+    def broken_write():
+        raise OSError("disk full")
+
+    metrics.write_prometheus = broken_write
+    first = submit_all(batcher, [GenerationRequest("a", 3, 0.0, 1.0)])[0]
+    assert first.error is None and first.result is not None
+
+    def broken_generate(batch):
+        raise RuntimeError("CUDA out of memory")
+
+    batcher._generate = broken_generate
+    failed = submit_all(batcher, [GenerationRequest("b", 3, 0.0, 1.0)])[0]
+    assert "out of memory" in failed.error
+    assert batcher.thread.is_alive()
+
+
+@pytest.mark.parametrize("payload", [
+    {"prompt": ""},
+    {"prompt": 5},
+    {"prompt": ["a"]},
+    {"instruction": "   "},
+    {},
+    {"prompt": "ok", "max_new_tokens": 0},
+    {"prompt": "ok", "max_new_tokens": -5},
+    {"prompt": "ok", "max_new_tokens": "many"},
+    ["prompt"],
+])
+def test_bad_requests_rejected(tiny_model, tmp_path, monkeypatch, payload):
+    monkeypatch.setattr(config, "METRICS_DIR", str(tmp_path))
+    server = run_server(tiny_model, FakeTokenizer(), host="127.0.0.1", port=0)
+    try:
+        connection = http.client.HTTPConnection("127.0.0.1", server.server_address[1], timeout=30)
+        connection.request("POST", "/generate", body=json.dumps(payload))
+        response = connection.getresponse()
+        assert response.status == 400
+        assert "bad request" in json.loads(response.read())["error"]
+        assert server.batcher.stats()["requests"] == 0
+    finally:
+        server.shutdown()
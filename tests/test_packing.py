@@ -0,0 +1,95 @@
+import random
+
+import pytest
+
+from dataset_format import IGNORE_INDEX
+from packing import pack_lengths, PackedDataset, block_causal_mask
+
+
+class FakeTokenized:
+    """Минимальный аналог datasets.Dataset: dataset["input_ids"] и dataset[i]"""
+
+    def __init__(self, examples):
+        self.examples = examples
+
+    def __len__(self):
+        return len(self.examples)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return [example[key] for example in self.examples]
+        return self.examples[key]
+
+
+def make_example(offset, prompt, response):
+    ids = list(range(offset, offset + prompt + response))
+    labels = [IGNORE_INDEX] * prompt + ids[prompt:]
+    return {"input_ids": ids, "labels": labels}
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_every_example_packed_once_and_bins_fit(seed):
+    rng = random.Random(seed)
+    max_len = 512
+    lengths = [rng.randint(1, 700) for _ in range(300)]
+    bins = pack_lengths(lengths, max_len)
+
+    placed = sorted(index for bin_ in bins for index in bin_)
+    assert placed == list(range(len(lengths)))
+    for bin_ in bins:
+        assert sum(min(lengths[i], max_len) for i in bin_) <= max_len
+
+
+def test_packed_dataset_positions_and_labels():
+    rng = random.Random(0)
+    examples = []
+    offset = 1000
+    for _ in range(40):
+        prompt, response = rng.randint(1, 30), rng.randint(1, 80)
+        examples.append(make_example(offset, prompt, response))
+        offset += prompt + response
+    dataset = PackedDataset(FakeTokenized(examples), max_len=128)
+
+    seen = 0
+    for item in (dataset[i] for i in range(len(dataset))):
+        assert len(item["input_ids"]) == len(item["labels"]) == len(item["position_ids"]) <= 128
+        assert sum(item["seq_lengths"]) == len(item["input_ids"])
+        start = 0
+        for length in item["seq_lengths"]:
+            # position_ids начинаются заново у каждого примера
+            assert item["position_ids"][start:start + length] == list(range(length))
+            example = next(e for e in examples if e["input_ids"][0] == item["input_ids"][start])
+            labels = item["labels"][start:start + length]
+            # Промпт без loss; первый токен примера тоже (нет предсказания через границу)
+            assert labels[0] == IGNORE_INDEX
+            for label, expected in zip(labels, example["labels"][:length]):
+                if expected == IGNORE_INDEX:
+                    assert label == IGNORE_INDEX
+            assert labels[1:] == example["labels"][1:length]
+            start += length
+            seen += 1
+    assert seen == len(examples)
+
+
+def test_block_mask_isolates_examples():
+    torch = pytest.importorskip("torch")
+    seq_lengths = [3, 5, 2]
+    total = 12  # 2 токена паддинга
+    mask = block_causal_mask(seq_lengths, total)[0, 0]
+    allowed = mask == 0
+
+    bounds = []
+    start = 0
+    for length in seq_lengths:
+        bounds.append((start, start + length))
+        start += length
+    for i, (qs, qe) in enumerate(bounds):
+        for j, (ks, ke) in enumerate(bounds):
+            block = allowed[qs:qe, ks:ke]
+            if i == j:
+                assert torch.equal(block, torch.ones(qe - qs, qe - qs, dtype=torch.bool).tril())
+            else:
+                assert not block.any()
+    # Паддинг видит только себя и не виден примерам
+    assert torch.equal(allowed[10:, :], torch.eye(total, dtype=torch.bool)[10:])
+    assert not allowed[:10, 10:].any()
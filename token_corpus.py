@@ -0,0 +1,202 @@
+"""
+Корпус токенов в memory-mapped файле для обучения на окнах
+
+Формат (папка token_corpus/):
+- tokens.bin   - все истории подряд, uint32 little-endian (каждая + EOS)
+- offsets.npy  - int64 [n + 1], история i = tokens[offsets[i]:offsets[i + 1]]
+- meta.json    - имена файлов, sha256, хеш токенизатора
+
+Истории не хранятся строками в памяти: TokenCorpus открывает файлы через
+np.memmap, окна - срезы без копирования. Воркеры DataLoader открывают
+memmap заново (после fork/spawn) и делят одни страницы page cache,
+поэтому занятая корпусом RAM не зависит от его размера.
+
+Экспорт:
+    python prepare_dataset.py --export-corpus
+"""
+
+import os
+import json
+
+import numpy as np
+
+
+TOKENS_FILE = "tokens.bin"
+OFFSETS_FILE = "offsets.npy"
+META_FILE = "meta.json"
+
+TOKEN_DTYPE = np.dtype("<u4")
+
+
+def export_corpus(stories, tokenizer, out_dir: str, batch_size: int = 32) -> dict:
+    """
+    Токенизация историй в tokens.bin + offsets.npy.
+
+    Args:
+        stories: Список (имя, sha256, текст)
+        tokenizer: Токенизатор модели (fast - батчи параллелятся в Rust)
+        out_dir: Папка корпуса
+        batch_size: Историй на вызов токенизатора
+
+    Returns:
+        meta (записывается в meta.json)
+    """
+    from dataset_format import tokenizer_hash
+
+    os.makedirs(out_dir, exist_ok=True)
+    tokens_path = os.path.join(out_dir, TOKENS_FILE)
+    offsets = [0]
+
+    with open(f"{tokens_path}.tmp", "wb") as out:
+        for start in range(0, len(stories), batch_size):
+            batch = stories[start:start + batch_size]
+            encoded = tokenizer([text for _, _, text in batch], add_special_tokens=False)["input_ids"]
+            for ids in encoded:
+                array = np.asarray(ids + [tokenizer.eos_token_id], dtype=TOKEN_DTYPE)
+                array.tofile(out)
+                offsets.append(offsets[-1] + len(array))
+    os.replace(f"{tokens_path}.tmp", tokens_path)
+    np.save(os.path.join(out_dir, OFFSETS_FILE), np.asarray(offsets, dtype=np.int64))
+
+    meta = {
+        "tokenizer_hash": tokenizer_hash(tokenizer),
+        "stories": [{"name": name, "sha256": sha} for name, sha, _ in stories],
+        "tokens": offsets[-1],
+        "eos_token_id": tokenizer.eos_token_id,
+    }
+    with open(os.path.join(out_dir, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=1)
+    return meta
+
+
+def load_meta(out_dir: str) -> dict:
+    try:
+        with open(os.path.join(out_dir, META_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+class TokenCorpus:
+    """Доступ к историям корпуса без загрузки в память"""
+
+    def __init__(self, corpus_dir: str):
+        self.corpus_dir = corpus_dir
+        self._tokens = None
+        self._offsets = None
+
+    def _open(self):
+        # Открывается лениво - в каждом процессе-воркере свой memmap
+        if self._tokens is None:
+            path = os.path.join(self.corpus_dir, TOKENS_FILE)
+            # np.memmap не открывает пустой файл (корпус без историй)
+            self._tokens = np.memmap(path, dtype=TOKEN_DTYPE, mode="r") if os.path.getsize(path) \
+                else np.zeros(0, dtype=TOKEN_DTYPE)
+            self._offsets = np.load(os.path.join(self.corpus_dir, OFFSETS_FILE), mmap_mode="r")
+
+    def __getstate__(self):
+        # В воркеры DataLoader передается только путь
+        return {"corpus_dir": self.corpus_dir, "_tokens": None, "_offsets": None}
+
+    @property
+    def offsets(self):
+        self._open()
+        return self._offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def total_tokens(self) -> int:
+        return int(self.offsets[-1])
+
+    def story(self, index: int):
+        """Токены истории (view в memmap, без копирования)"""
+        self._open()
+        return self._tokens[self._offsets[index]:self._offsets[index + 1]]
+
+    def window(self, index: int, start: int, length: int):
+        """Окно токенов истории (view в memmap, без копирования)"""
+        self._open()
+        begin = int(self._offsets[index]) + start
+        end = min(begin + length, int(self._offsets[index + 1]))
+        return self._tokens[begin:end]
+
+
+class WindowDataset:
+    """
+    Окна seq_len токенов по историям корпуса (не пересекают границы историй).
+
+    Таблица окон - два массива (история, начало), последнее окно истории
+    выровнено по ее концу. random_windows=True - каждое обращение дает
+    случайное окно той же истории (новые срезы на каждой эпохе).
+    """
+
+    def __init__(self, corpus: TokenCorpus, seq_len: int, overlap: int = 0,
+                 random_windows: bool = False, seed: int = 3407):
+        self.corpus = corpus
+        self.seq_len = seq_len
+        self.random_windows = random_windows
+        self.seed = seed
+        self._rng = None
+        self._rng_worker = None
+
+        lengths = np.diff(np.asarray(corpus.offsets))
+        stride = max(1, seq_len - overlap)
+        story_ids, starts = [], []
+        for index, length in enumerate(lengths):
+            if length <= seq_len:
+                story_starts = np.zeros(1, dtype=np.int64)
+            else:
+                story_starts = np.append(np.arange(0, length - seq_len, stride), length - seq_len)
+            story_ids.append(np.full(len(story_starts), index, dtype=np.int64))
+            starts.append(story_starts)
+        self.story_ids = np.concatenate(story_ids) if story_ids else np.zeros(0, dtype=np.int64)
+        self.starts = np.concatenate(starts) if starts else np.zeros(0, dtype=np.int64)
+        self.lengths = lengths
+
+    def __len__(self) -> int:
+        return len(self.story_ids)
+
+    def _generator(self):
+        """
+        Свой генератор в каждом воркере DataLoader: worker_info.seed различается по
+        воркерам и эпохам и зависит от torch.manual_seed (воспроизводимо)
+        """
+        from torch.utils.data import get_worker_info
+
+        worker = get_worker_info()
+        key = worker.seed if worker is not None else None
+        # Генератор, скопированный в воркер при fork, пересоздается
+        if self._rng is None or self._rng_worker != key:
+            self._rng = np.random.default_rng([self.seed] if key is None else [self.seed, key])
+            self._rng_worker = key
+        return self._rng
+
+    def __getitem__(self, index: int) -> dict:
+        story = int(self.story_ids[index])
+        start = int(self.starts[index])
+        if self.random_windows:
+            start = int(self._generator().integers(0, max(1, int(self.lengths[story]) - self.seq_len) + 1))
+        return {"input_ids": self.corpus.window(story, start, self.seq_len)}
+
+
+class CorpusCollator:
+    """uint32 окна -> батч int64 (единственная копия - при сборке батча)"""
+
+    def __init__(self, pad_token_id: int):
+        self.pad_token_id = pad_token_id
+
+    def __call__(self, features: list) -> dict:
+        import torch
+        from dataset_format import IGNORE_INDEX
+
+        length = max(len(f["input_ids"]) for f in features)
+        input_ids = torch.full((len(features), length), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(features), length), dtype=torch.long)
+        for row, f in enumerate(features):
+            n = len(f["input_ids"])
+            input_ids[row, :n] = torch.from_numpy(f["input_ids"].astype(np.int64))
+            attention_mask[row, :n] = 1
+        labels = input_ids.masked_fill(attention_mask == 0, IGNORE_INDEX)
+        return {"input_ids": input_ids, "attention_mask": attention_mask, "labels": labels}
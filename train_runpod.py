@@ -3,36 +3,26 @@ Qwen 2.5 7B Fine-tuning для Warhammer 40K
 Оптимизировано для RunPod (RTX 3090/4090)
 """
 
+import sys
+
 from unsloth import FastLanguageModel
-from datasets import load_from_disk
-import torch
-from trl import SFTTrainer
-from transformers import TrainingArguments
 import config
+from profile_corpus import pick_max_seq_length
+from training_telemetry import TrainingTelemetry
+from checkpointing import AdapterCheckpointer
+from trainer_setup import LORA_KWARGS, load_training_data, build_trainer
 
 print("\n" + "="*60)
 print("🦥 Unsloth + Qwen 2.5 7B Fine-tuning")
 print("="*60)
 
-# Функция форматирования датасета
-def formatting_func(examples):
-    texts = []
-    for instruction, input_text, output in zip(examples['instruction'], examples['input'], examples['output']):
-        text = f"""### Instruction:
-{instruction}
-
-### Input:
-{input_text}
-
-### Response:
-{output}"""
-        texts.append(text)
-    return texts
+# Длина контекста из профиля корпуса (profile_corpus.py) или config.MAX_SEQ_LENGTH
+max_seq_length = pick_max_seq_length()
 
 print("\n[1/6] Загрузка модели Qwen 2.5 7B...")
 model, tokenizer = FastLanguageModel.from_pretrained(
     model_name=config.MODEL_PATH,
-    max_seq_length=16384,  # 16K контекст (покрывает 82.7% историй)
+    max_seq_length=max_seq_length,  # Не больше 16K (config.MAX_SEQ_LENGTH)
     dtype=None,  # Auto-detect
     load_in_4bit=True,  # 4-bit квантизация для экономии VRAM
 )
@@ -40,11 +30,7 @@ model, tokenizer = FastLanguageModel.from_pretrained(
 print("\n[2/6] Добавление LoRA адаптеров...")
 model = FastLanguageModel.get_peft_model(
     model,
-    r=16,
-    target_modules=["q_proj", "k_proj", "v_proj", "o_proj", "gate_proj", "up_proj", "down_proj"],
-    lora_alpha=16,
-    lora_dropout=0,
-    bias="none",
+    **LORA_KWARGS,  # r=16, все проекции внимания и MLP (trainer_setup.py)
     use_gradient_checkpointing="unsloth",
     random_state=3407,
     use_rslora=False,
@@ -52,50 +38,43 @@ model = FastLanguageModel.get_peft_model(
 )
 
 print("\n[3/6] Загрузка датасета...")
-dataset = load_from_disk("warhammer_dataset")
-print(f"   ✅ Загружено {len(dataset)} примеров")
+# Кеш: шаблон + токенизатор один раз
+dataset, collator = load_training_data(tokenizer, max_seq_length, batch_size=2, grad_accum=4,
+                                       num_proc=2, packing=config.PACKING)
+print(f"   ✅ Загружено {len(dataset)} {'упакованных последовательностей' if config.PACKING else 'примеров'}")
 print(f"   📊 Средний размер: ~60K символов/история")
 
 print("\n[4/6] Настройка тренера...")
-trainer = SFTTrainer(
-    model=model,
-    tokenizer=tokenizer,
-    train_dataset=dataset,
-    formatting_func=formatting_func,
-    max_seq_length=16384,
+# Токены/сек, паддинг, время шага, память, стоимость -> metrics/
+telemetry = TrainingTelemetry(run_name="train_runpod")
+# LoRA + optimizer каждые config.CHECKPOINT_STEPS шагов в фоне -> outputs/checkpoint-N
+checkpoints = AdapterCheckpointer()
+trainer = build_trainer(
+    model, tokenizer, dataset, collator, max_seq_length, telemetry,
+    batch_size=2,  # Для 24GB VRAM
+    grad_accum=4,  # Эффективный batch = 8
+    max_steps=100,
     dataset_num_proc=2,  # RunPod поддерживает multiprocessing
-    packing=False,
-    args=TrainingArguments(
-        per_device_train_batch_size=2,  # Для 24GB VRAM
-        gradient_accumulation_steps=4,  # Эффективный batch = 8
-        warmup_steps=5,
-        max_steps=100,
-        learning_rate=2e-4,
-        fp16=not torch.cuda.is_bf16_supported(),
-        bf16=torch.cuda.is_bf16_supported(),
-        logging_steps=1,
-        optim="adamw_8bit",
-        weight_decay=0.01,
-        lr_scheduler_type="linear",
-        seed=3407,
-        output_dir="outputs"
-    )
+    checkpointer=checkpoints,
 )
 
 print("\n[5/6] Начинаю обучение...")
 print("="*60)
 print(f"📊 Параметры:")
-print(f"   • Датасет: {len(dataset)} примеров")
-print(f"   • Контекст: 16,384 токена (~45K символов)")
+print(f"   • Датасет: {len(dataset)} {'упакованных последовательностей' if config.PACKING else 'примеров'}")
+print(f"   • Контекст: {max_seq_length:,} токенов")
 print(f"   • Batch size: 2 × 4 = 8 (effective)")
-print(f"   • Шагов: 100 (~7.7 эпох)")
+print(f"   • Шагов: 100 (~{100 * 8 / len(dataset):.1f} эпох)")
 print(f"   • VRAM: ~14-16GB")
 print(f"   • Время: ~45-90 минут")
 print(f"   • Стоимость: ~$0.26-0.52 (RTX 3090)")
 print("="*60 + "\n")
 
-# ОБУЧЕНИЕ
-trainer.train()
+# ОБУЧЕНИЕ (после вытеснения spot-инстанса продолжает с последнего чекпоинта)
+trainer.train(resume_from_checkpoint=checkpoints.latest(trainer.args.output_dir))
+if checkpoints.preempted:
+    print("\n⏸️  Обучение прервано (SIGTERM), чекпоинт сохранен в outputs/ - перезапустите скрипт")
+    sys.exit(1)
 
 print("\n[6/6] Сохранение модели...")
 model.save_pretrained(config.FINETUNED_MODEL_PATH)
@@ -0,0 +1,128 @@
+"""
+Общая настройка обучения для train.py, train_runpod.py и smoke_train.py
+
+- LORA_KWARGS - параметры LoRA (FastLanguageModel.get_peft_model / peft.LoraConfig)
+- load_training_data - токенизированный кеш, отчет паддинга, packing
+- build_trainer - SFTTrainer с одинаковыми аргументами; скрипты отличаются
+  только батчем, числом шагов, оптимизатором и устройством. Чекпоинты -
+  AdapterCheckpointer (checkpointing.py), штатное сохранение Trainer выключено
+
+Импортировать после unsloth (unsloth патчит trl/transformers при импорте).
+"""
+
+import torch
+from trl import SFTTrainer
+from transformers import TrainingArguments
+
+from dataset_format import load_tokenized, PadCollator
+from packing import PackedDataset, PackedCollator, padding_report, print_padding_report
+from prepare_dataset import window_seq_length
+
+
+LORA_KWARGS = dict(
+    r=16,  # Rank LoRA, 16-32 хорошо
+    target_modules=["q_proj", "k_proj", "v_proj", "o_proj", "gate_proj", "up_proj", "down_proj"],
+    lora_alpha=16,
+    lora_dropout=0,
+    bias="none",
+)
+
+
+def load_training_data(tokenizer, max_seq_length: int, batch_size: int, grad_accum: int,
+                       num_proc: int = None, packing: bool = False, block_mask: bool = False,
+                       limit: int = None, allow_truncation: bool = False):
+    """
+    Датасет и коллатор для тренера.
+
+    Args:
+        tokenizer: Токенизатор модели
+        max_seq_length: Длина контекста
+        batch_size, grad_accum: Батч (для отчета паддинга)
+        num_proc: Процессов токенизации при пустом кеше (None на Windows)
+        packing: Упаковка примеров (config.PACKING)
+        block_mask: 4D маска вместо границ по position_ids (CPU, без flash attention)
+        limit: Взять первые N примеров (smoke)
+        allow_truncation: Не проверять, что окна датасета (--mode windows) влезают в max_seq_length
+
+    Returns:
+        Tuple (dataset, collator)
+    """
+    window = window_seq_length()
+    if window and window > max_seq_length and not allow_truncation:
+        raise ValueError(
+            f"Датасет нарезан окнами по {window:,} токенов, а max_seq_length тренера {max_seq_length:,}: "
+            f"хвосты окон будут обрезаны. Пересоберите: "
+            f"python prepare_dataset.py --mode windows --max-seq-length {max_seq_length}"
+        )
+    dataset = load_tokenized(tokenizer, max_seq_length, num_proc=num_proc)
+    if limit:
+        dataset = dataset.select(range(min(limit, len(dataset))))
+
+    collator = PadCollator(tokenizer)
+    print_padding_report(padding_report([len(ids) for ids in dataset["input_ids"]], max_seq_length, batch_size, grad_accum))
+    if packing:
+        # Примеры склеиваются в полные последовательности, каждый со своими position_ids
+        dataset = PackedDataset(dataset, max_seq_length)
+        collator = PackedCollator(tokenizer, block_mask=block_mask)
+    return dataset, collator
+
+
+def check_packing_attention(model, collator):
+    """
+    Packing без 4D маски разделяет примеры только во flash attention 2
+    (сбросы position_ids -> varlen); в sdpa/eager примеры видят друг друга.
+
+    Unsloth подменяет attention своими ядрами и в конфиге оставляет
+    eager/sdpa, даже когда flash-attn стоит, - тогда коллатор переходит
+    на 4D блочную маску (память total x total на пример, зато без смешивания).
+    """
+    if not isinstance(collator, PackedCollator) or collator.block_mask:
+        return
+    attention = getattr(model.config, "_attn_implementation", None)
+    if attention == "flash_attention_2":
+        return
+    print(f"⚠️  PACKING: attention модели {attention!r}, не flash_attention_2 - "
+          f"примеры разделяются 4D блочной маской")
+    collator.block_mask = True
+    collator.dtype = collator.dtype or getattr(model, "dtype", None)
+
+
+def build_trainer(model, tokenizer, dataset, collator, max_seq_length: int, telemetry, *,
+                  batch_size: int, grad_accum: int, max_steps: int = 100, dataset_num_proc: int = None,
+                  optim: str = "adamw_8bit", output_dir: str = "outputs", checkpointer=None,
+                  **extra_args) -> SFTTrainer:
+    """SFTTrainer по токенизированному датасету (extra_args - доп. TrainingArguments)"""
+    check_packing_attention(model, collator)
+    # Чекпоинт раньше телеметрии: копирование в CPU попадает в шаг, который его вызвал
+    callbacks = ([checkpointer] if checkpointer else []) + [telemetry]
+    bf16 = torch.cuda.is_available() and torch.cuda.is_bf16_supported()
+    return SFTTrainer(
+        model=model,
+        tokenizer=tokenizer,
+        train_dataset=dataset,
+        data_collator=telemetry.wrap_collator(collator),  # labels из датасета (loss только по ответу)
+        max_seq_length=max_seq_length,  # Совпадает с моделью
+        dataset_num_proc=dataset_num_proc,
+        packing=False,  # Своя упаковка: config.PACKING
+        dataset_kwargs={"skip_prepare_dataset": True},  # Датасет уже токенизирован
+        dataset_text_field="input_ids",  # trl<0.9 требует при packing=False (не используется)
+        callbacks=callbacks,
+        args=TrainingArguments(
+            per_device_train_batch_size=batch_size,
+            gradient_accumulation_steps=grad_accum,
+            warmup_steps=5,
+            max_steps=max_steps,
+            learning_rate=2e-4,
+            fp16=torch.cuda.is_available() and not bf16,  # Экономия VRAM
+            bf16=bf16,
+            logging_steps=1,
+            optim=optim,  # 8-bit оптимизатор для экономии памяти (на GPU)
+            weight_decay=0.01,
+            lr_scheduler_type="linear",
+            seed=3407,
+            output_dir=output_dir,  # Сюда же чекпоинты checkpoint-N
+            save_strategy="no",  # Полные чекпоинты Trainer не нужны: только адаптер, в фоне
+            remove_unused_columns=False,  # seq_lengths нужен PackedCollator (4D маска)
+            **extra_args
+        )
+    )
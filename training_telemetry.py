@@ -0,0 +1,246 @@
+"""
+Телеметрия обучения: пропускная способность, паддинг, время шага, память, стоимость
+
+- TrainingTelemetry - TrainerCallback для SFTTrainer/Trainer
+- wrap_collator: обертка коллатора считает реальные токены (до паддинга),
+  слоты с паддингом и время сборки батча (dataloader_num_workers=0)
+- cuda.synchronize только на шагах логирования (args.logging_steps): время
+  меряется окнами между ними, событие "step" - одно на окно (steps шагов),
+  p50/p95 - по среднему шагу окна. Между синхронизациями GPU не простаивает
+- Время шага делится на data (коллатор), optimizer (on_pre_optimizer_step ->
+  on_optimizer_step, замер на шаге логирования, на окно - умножением)
+  и compute (остальное: forward + backward). Хука on_pre_optimizer_step нет
+  в старых transformers (4.44 и раньше) - тогда optimizer не измеряется (н/д)
+  и входит в compute
+- Память: пик CUDA за окно и за прогон; на CPU - пиковый RSS процесса
+- События - METRICS_DIR/training_events.jsonl (Metrics из metrics.py),
+  итог - METRICS_DIR/training_summary.json + печать в конце обучения
+
+Работает и на CPU (tiny модель), поэтому сравнение packing / batch size /
+seq length можно проверить без GPU.
+"""
+
+import os
+import sys
+import json
+import math
+import time
+
+from transformers import TrainerCallback
+
+import config
+from metrics import Metrics, percentile
+
+
+# Старые transformers: Trainer не вызывает on_pre_optimizer_step
+OPTIMIZER_HOOKS = hasattr(TrainerCallback, "on_pre_optimizer_step")
+
+def _cuda():
+    try:
+        import torch
+    except ImportError:
+        return None
+    return torch.cuda if torch.cuda.is_available() else None
+
+
+def _cpu_peak_rss_gb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    # ru_maxrss: Linux - KB, macOS - байты
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 ** 3 if sys.platform == "darwin" else rss / 1024 ** 2
+
+
+def is_logging_step(args, step: int, max_steps: int) -> bool:
+    """Шаг, на котором Trainer логирует (logging_steps < 1 - доля от max_steps), и последний шаг"""
+    interval = args.logging_steps
+    if interval < 1:
+        interval = math.ceil(max_steps * interval)
+    return step % max(1, int(interval)) == 0 or step >= max_steps
+
+
+class _CountingCollator:
+    """Коллатор-обертка: реальные токены, слоты с паддингом, время сборки"""
+
+    def __init__(self, collator, telemetry):
+        self.collator = collator
+        self.telemetry = telemetry
+
+    def __call__(self, features):
+        start = time.perf_counter()
+        batch = self.collator(features)
+        self.telemetry.record_batch(
+            real=sum(len(f["input_ids"]) for f in features),
+            padded=batch["input_ids"].numel(),
+            seconds=time.perf_counter() - start,
+        )
+        return batch
+
+
+class TrainingTelemetry(TrainerCallback):
+    """Телеметрия по шагам оптимизатора"""
+
+    def __init__(self, run_name: str = "train", gpu_cost_per_hour: float = None,
+                 metrics_dir: str = None):
+        self.run_name = run_name
+        self.gpu_cost_per_hour = config.GPU_COST_PER_HOUR if gpu_cost_per_hour is None else gpu_cost_per_hour
+        self.metrics_dir = metrics_dir or config.METRICS_DIR
+        self.metrics = Metrics(prefix="training")
+        self.metrics.configure(self.metrics_dir)
+        self.summary_path = os.path.join(self.metrics_dir, "training_summary.json")
+
+        self.cuda = _cuda()
+        self.train_start = None
+        self.window_start = None
+        self.window_steps = 0
+        self.optimizer_start = None
+        self.optimizer_seconds = None  # Замер на шаге логирования
+        self.step_real = 0
+        self.step_padded = 0
+        self.step_data = 0.0
+        self.real_tokens = 0
+        self.padded_tokens = 0
+        self.peak_memory_gb = 0.0
+        self.max_steps = 0
+        self.step_means = []  # Средний шаг каждого окна - для p50/p95
+
+    def wrap_collator(self, collator):
+        return _CountingCollator(collator, self)
+
+    def record_batch(self, real: int, padded: int, seconds: float):
+        self.step_real += real
+        self.step_padded += padded
+        self.step_data += seconds
+
+    def _now(self) -> float:
+        if self.cuda:
+            self.cuda.synchronize()
+        return time.perf_counter()
+
+    def _memory_gb(self):
+        if self.cuda:
+            return self.cuda.max_memory_allocated() / 1024 ** 3
+        return _cpu_peak_rss_gb()
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        self.max_steps = state.max_steps
+        # Батчи, собранные до обучения (бенчмарк DataLoader и т.п.), не относятся к первому шагу
+        self.step_real = self.step_padded = 0
+        self.step_data = 0.0
+        self.optimizer_seconds = None
+        if self.cuda:
+            self.cuda.reset_peak_memory_stats()
+        self.train_start = self.window_start = self._now()
+
+    def on_pre_optimizer_step(self, args, state, control, **kwargs):
+        # global_step увеличивается после оптимизатора
+        if is_logging_step(args, state.global_step + 1, self.max_steps):
+            self.optimizer_start = self._now()
+
+    def on_optimizer_step(self, args, state, control, **kwargs):
+        if self.optimizer_start is not None:
+            self.optimizer_seconds = self._now() - self.optimizer_start
+            self.optimizer_start = None
+
+    def on_step_end(self, args, state, control, **kwargs):
+        self.window_steps += 1
+        if not is_logging_step(args, state.global_step, self.max_steps):
+            return
+
+        now = self._now()
+        seconds = now - self.window_start
+        steps = self.window_steps
+        memory = self._memory_gb()
+        if memory is not None:
+            self.peak_memory_gb = max(self.peak_memory_gb, memory)
+
+        optimizer = self.optimizer_seconds * steps if self.optimizer_seconds is not None else 0.0
+        compute = max(0.0, seconds - self.step_data - optimizer)
+        self.metrics.observe(
+            "step", seconds,
+            step=state.global_step,
+            steps=steps,
+            real_tokens=self.step_real,
+            padded_tokens=self.step_padded,
+            tokens_per_sec=round(self.step_real / seconds, 1) if seconds else 0.0,
+            data_seconds=round(self.step_data, 4),
+            optimizer_seconds=round(optimizer, 4) if OPTIMIZER_HOOKS else None,
+            compute_seconds=round(compute, 4),
+            peak_memory_gb=round(memory, 3) if memory is not None else None,
+        )
+        self.metrics.observe("data", self.step_data)
+        if OPTIMIZER_HOOKS:
+            self.metrics.observe("optimizer", optimizer)
+        self.metrics.observe("compute", compute)
+        self.step_means.append(seconds / steps)
+
+        self.real_tokens += self.step_real
+        self.padded_tokens += self.step_padded
+        self.step_real = self.step_padded = 0
+        self.step_data = 0.0
+        self.optimizer_seconds = None
+        self.window_steps = 0
+        if self.cuda:
+            self.cuda.reset_peak_memory_stats()
+        self.window_start = now
+
+    def summary(self) -> dict:
+        stages = self.metrics.summary()
+        step = stages.get("step", {})
+        steps = step.get("steps", 0)
+        elapsed = (time.perf_counter() - self.train_start) if self.train_start else 0.0
+        step_total = step.get("total", 0.0)
+        hours = elapsed / 3600
+
+        def share(stage):
+            return stages.get(stage, {}).get("total", 0.0) / step_total if step_total else 0.0
+
+        return {
+            "run": self.run_name,
+            "steps": steps,
+            "elapsed_sec": elapsed,
+            "real_tokens": self.real_tokens,
+            "padded_tokens": self.padded_tokens,
+            "padding_ratio": 1 - self.real_tokens / self.padded_tokens if self.padded_tokens else 0.0,
+            "tokens_per_sec": self.real_tokens / step_total if step_total else 0.0,
+            "step_p50": percentile(self.step_means, 0.5) if self.step_means else 0.0,
+            "step_p95": percentile(self.step_means, 0.95) if self.step_means else 0.0,
+            "data_share": share("data"),
+            "compute_share": share("compute"),
+            "optimizer_share": share("optimizer") if OPTIMIZER_HOOKS else None,
+            "peak_memory_gb": self.peak_memory_gb,
+            "device": "cuda" if self.cuda else "cpu",
+            "gpu_cost_per_hour": self.gpu_cost_per_hour,
+            "cost": hours * self.gpu_cost_per_hour,
+            "projected_cost": (step_total / steps * self.max_steps / 3600 * self.gpu_cost_per_hour)
+            if steps and self.max_steps else 0.0,
+        }
+
+    def on_train_end(self, args, state, control, **kwargs):
+        summary = self.summary()
+        with open(self.summary_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=1)
+        self.metrics.write_prometheus()
+        print_summary(summary)
+        print(f"Телеметрия: {self.metrics.events_path}, {self.summary_path}")
+
+
+def print_summary(summary: dict):
+    print("\n" + "=" * 60)
+    print(f"ТЕЛЕМЕТРИЯ ОБУЧЕНИЯ ({summary['run']}, {summary['device']})")
+    print("=" * 60)
+    print(f"Шагов: {summary['steps']} | время: {summary['elapsed_sec'] / 60:.1f} мин")
+    print(f"Токены: {summary['real_tokens']:,} реальных / {summary['padded_tokens']:,} со слотами паддинга "
+          f"(паддинг {summary['padding_ratio']:.1%})")
+    print(f"Пропускная способность: {summary['tokens_per_sec']:,.0f} токенов/сек")
+    optimizer = f"{summary['optimizer_share']:.0%}" if summary["optimizer_share"] is not None \
+        else "н/д (нет on_pre_optimizer_step в этой версии transformers)"
+    print(f"Шаг: p50 {summary['step_p50']:.2f}s | p95 {summary['step_p95']:.2f}s | "
+          f"data {summary['data_share']:.0%} / compute {summary['compute_share']:.0%} / "
+          f"optimizer {optimizer}")
+    print(f"Пик памяти: {summary['peak_memory_gb']:.2f}GB")
+    print(f"Стоимость: ${summary['cost']:.2f} (${summary['gpu_cost_per_hour']:.2f}/час, "
+          f"прогноз на все шаги ${summary['projected_cost']:.2f})")
+    print("=" * 60)
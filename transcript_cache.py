@@ -0,0 +1,209 @@
+"""
+Локальный кеш транскрипций по ID видео YouTube
+
+- transcripts/<video_id>.json - ответ Lemonfox (проверяется ДО любой сетевой работы)
+- transcripts/sha256-<hash>.json - тот же ответ по хешу аудио (перезаливы, дубликаты)
+- audio/<video_id>.<ext> - скачанное аудио, вытесняется по размеру (LRU по mtime);
+  аудио, ожидающее транскрибации (pin при скачивании/попадании в кеш,
+  release_audio после транскрибации), не вытесняется
+"""
+
+import os
+import re
+import json
+import shutil
+import hashlib
+import threading
+from urllib.parse import urlparse, parse_qs
+
+
+VIDEO_ID_RE = re.compile(r'^[A-Za-z0-9_-]{11}$')
+
+
+def extract_video_id(youtube_url: str):
+    """
+    Канонический ID видео из любой формы ссылки YouTube.
+
+    Поддерживает watch?v=, youtu.be/, shorts/, embed/, live/, v/.
+
+    Returns:
+        ID из 11 символов или None
+    """
+    if not youtube_url:
+        return None
+
+    url = str(youtube_url).strip()
+    if VIDEO_ID_RE.match(url):
+        return url
+    if '://' not in url:
+        url = f"https://{url}"
+
+    parsed = urlparse(url)
+    host = (parsed.hostname or '').lower()
+    parts = [p for p in parsed.path.split('/') if p]
+
+    candidate = None
+    if host.endswith('youtu.be'):
+        candidate = parts[0] if parts else None
+    elif 'youtube' in host:
+        query = parse_qs(parsed.query)
+        if 'v' in query:
+            candidate = query['v'][0]
+        elif len(parts) >= 2 and parts[0] in ('shorts', 'embed', 'live', 'v'):
+            candidate = parts[1]
+
+    if candidate and VIDEO_ID_RE.match(candidate):
+        return candidate
+    return None
+
+
+def file_sha256(path: str) -> str:
+    """SHA-256 файла (читается блоками)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class TranscriptCache:
+    """
+    Кеш транскрипций и аудио. Потокобезопасен (воркеры конвейера).
+    """
+
+    def __init__(self, cache_dir: str, audio_max_mb: float):
+        self.cache_dir = cache_dir
+        self.transcripts_dir = os.path.join(cache_dir, "transcripts")
+        self.audio_dir = os.path.join(cache_dir, "audio")
+        self.audio_max_bytes = int(audio_max_mb * 1024 * 1024)
+        self.lock = threading.Lock()
+        self.pinned = {}  # abspath -> число строк, ждущих транскрибации этого аудио
+
+        os.makedirs(self.transcripts_dir, exist_ok=True)
+        os.makedirs(self.audio_dir, exist_ok=True)
+
+    def _read_json(self, path: str):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_json(self, path: str, data: dict):
+        # Атомарная запись: сначала во временный файл
+        tmp_path = f"{path}.tmp.{threading.get_ident()}"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def get(self, video_id: str):
+        """Ответ Lemonfox по ID видео или None"""
+        if not video_id:
+            return None
+        return self._read_json(os.path.join(self.transcripts_dir, f"{video_id}.json"))
+
+    def get_by_hash(self, audio_hash: str):
+        """Ответ Lemonfox по хешу аудио или None"""
+        if not audio_hash:
+            return None
+        return self._read_json(os.path.join(self.transcripts_dir, f"sha256-{audio_hash}.json"))
+
+    def put(self, video_id: str, result: dict, audio_hash: str = None):
+        """Сохранение ответа Lemonfox по ID и (опционально) по хешу аудио"""
+        if video_id:
+            self._write_json(os.path.join(self.transcripts_dir, f"{video_id}.json"), result)
+        if audio_hash:
+            self._write_json(os.path.join(self.transcripts_dir, f"sha256-{audio_hash}.json"), result)
+
+    def _pin(self, path: str):
+        # Вызывается под self.lock
+        key = os.path.abspath(path)
+        self.pinned[key] = self.pinned.get(key, 0) + 1
+
+    def release_audio(self, path: str):
+        """Аудио больше не нужно строке (транскрибировано или ошибка) - снова может вытесняться"""
+        key = os.path.abspath(path)
+        with self.lock:
+            if key not in self.pinned:
+                return
+            self.pinned[key] -= 1
+            if self.pinned[key] <= 0:
+                del self.pinned[key]
+        # Пока файл был защищен, кеш мог превысить лимит
+        self.evict_audio()
+
+    def audio_path(self, video_id: str):
+        """
+        Путь к закешированному аудио (обновляет время доступа для LRU) или None.
+
+        Найденное аудио защищено от вытеснения до release_audio.
+        """
+        if not video_id:
+            return None
+
+        with self.lock:
+            for name in os.listdir(self.audio_dir):
+                if os.path.splitext(name)[0] == video_id:
+                    path = os.path.join(self.audio_dir, name)
+                    os.utime(path, None)
+                    self._pin(path)
+                    return path
+        return None
+
+    def store_audio(self, video_id: str, path: str) -> str:
+        """
+        Перемещение скачанного аудио в кеш.
+
+        Returns:
+            Новый путь к аудио (внутри кеша), защищен от вытеснения до release_audio
+        """
+        if not video_id:
+            return path
+
+        ext = os.path.splitext(path)[1] or '.mp4'
+        cached_path = os.path.join(self.audio_dir, f"{video_id}{ext}")
+
+        with self.lock:
+            shutil.move(path, cached_path)
+            os.utime(cached_path, None)
+            self._pin(cached_path)
+
+        self.evict_audio()
+        return cached_path
+
+    def owns(self, path: str) -> bool:
+        """Лежит ли файл в кеше аудио (такие файлы не удаляем после транскрибации)"""
+        return os.path.abspath(os.path.dirname(path)) == os.path.abspath(self.audio_dir)
+
+    def evict_audio(self) -> int:
+        """
+        Вытеснение самых старых аудио, пока кеш больше лимита
+        (аудио, ожидающее транскрибации, пропускается).
+
+        Returns:
+            Количество освобожденных байт
+        """
+        freed = 0
+        with self.lock:
+            entries = []
+            for name in os.listdir(self.audio_dir):
+                path = os.path.join(self.audio_dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.audio_max_bytes:
+                    break
+                if os.path.abspath(path) in self.pinned:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                freed += size
+        return freed
@@ -0,0 +1,166 @@
+"""
+Предварительное получение метаданных YouTube (один проход на видео)
+
+- Один YoutubeDL на поток (переиспользуется, без создания на каждое видео)
+- Полный info хранится в памяти и передается прямо в скачивание
+  (без второго extract_info), пока ссылки на форматы не устарели;
+  prefetch_metadata полный info не держит (сотни info по ~0.5 MB на тысячи
+  строк) - только краткие метаданные, скачивание извлекает info заново
+- Краткие метаданные (название, длительность, аудио форматы) кешируются
+  на диск: cache_dir/metadata/<video_id>.json
+"""
+
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import yt_dlp
+
+import config
+from transcript_cache import extract_video_id
+
+
+# Ссылки на форматы YouTube живут ~6 часов - берем с запасом
+INFO_TTL = 4 * 3600
+
+METADATA_DIR = os.path.join(config.CACHE_DIR, "metadata")
+
+_local = threading.local()
+_infos = {}  # video_id -> (fetched_at, info)
+_infos_lock = threading.Lock()
+
+
+def get_extractor() -> yt_dlp.YoutubeDL:
+    """YoutubeDL для извлечения info - один на поток (YoutubeDL не потокобезопасен)"""
+    ydl = getattr(_local, "ydl", None)
+    if ydl is None:
+        ydl = yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True})
+        _local.ydl = ydl
+    return ydl
+
+
+def compact_metadata(info: dict) -> dict:
+    """Краткие метаданные для дискового кеша и планировщика"""
+    audio_formats = [
+        {
+            'format_id': f.get('format_id'),
+            'ext': f.get('ext'),
+            'acodec': f.get('acodec'),
+            'abr': f.get('abr'),
+            'filesize': f.get('filesize') or f.get('filesize_approx'),
+        }
+        for f in info.get('formats') or []
+        if f.get('acodec') not in (None, 'none') and f.get('vcodec') in (None, 'none')
+    ]
+    return {
+        'id': info.get('id'),
+        'title': info.get('title'),
+        'duration': info.get('duration'),
+        'audio_formats': audio_formats,
+        'fetched_at': time.time(),
+    }
+
+
+def load_cached_metadata(video_id: str):
+    """Краткие метаданные с диска или None"""
+    if not video_id:
+        return None
+    try:
+        with open(os.path.join(METADATA_DIR, f"{video_id}.json"), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_cached_metadata(video_id: str, metadata: dict):
+    os.makedirs(METADATA_DIR, exist_ok=True)
+    path = os.path.join(METADATA_DIR, f"{video_id}.json")
+    tmp_path = f"{path}.tmp.{threading.get_ident()}"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def fresh_info(video_id: str):
+    """Полный info из памяти, если ссылки на форматы ещё действуют, иначе None"""
+    if not video_id:
+        return None
+    with _infos_lock:
+        entry = _infos.get(video_id)
+    if entry and time.time() - entry[0] < INFO_TTL:
+        return entry[1]
+    return None
+
+
+def forget_info(video_id: str):
+    """Сбросить info из памяти (после скачивания или ошибки по старым ссылкам)"""
+    with _infos_lock:
+        _infos.pop(video_id, None)
+
+
+def extract_info(youtube_url: str, remember: bool = True) -> dict:
+    """
+    Полный info видео (без скачивания) - из памяти или одним запросом.
+
+    Результат кешируется на диск кратко и (remember=True) запоминается
+    для скачивания.
+    """
+    video_id = extract_video_id(youtube_url)
+    info = fresh_info(video_id)
+    if info is not None:
+        return info
+
+    info = get_extractor().extract_info(youtube_url, download=False)
+    video_id = video_id or info.get('id')
+
+    if video_id and remember:
+        now = time.time()
+        with _infos_lock:
+            # Устаревшие info (ссылки уже не действуют) не держим в памяти
+            for stale in [key for key, (saved, _) in _infos.items() if now - saved >= INFO_TTL]:
+                del _infos[stale]
+            _infos[video_id] = (now, info)
+    if video_id:
+        save_cached_metadata(video_id, compact_metadata(info))
+
+    return info
+
+
+def prefetch_metadata(youtube_urls: list, workers: int = 4) -> dict:
+    """
+    Метаданные для всех ссылок: сначала дисковый кеш, остальное - параллельно.
+
+    Args:
+        youtube_urls: Список ссылок
+        workers: Количество потоков извлечения
+
+    Returns:
+        Словарь {url: краткие метаданные}; при ошибке извлечения ссылки нет в словаре
+    """
+    result = {}
+    to_fetch = []
+
+    for url in youtube_urls:
+        metadata = load_cached_metadata(extract_video_id(url))
+        if metadata:
+            result[url] = metadata
+        else:
+            to_fetch.append(url)
+
+    def fetch(url):
+        try:
+            # Полный info не копим на все строки - скачивание получит его заново
+            return url, compact_metadata(extract_info(url, remember=False))
+        except Exception as e:
+            print(f"[WARNING] Метаданные не получены: {url} ({e})")
+            return url, None
+
+    if to_fetch:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for url, metadata in pool.map(fetch, to_fetch):
+                if metadata:
+                    result[url] = metadata
+
+    return result